@@ -17,11 +17,14 @@ def create_app():
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'info'
     
-    # User loader
-    from app.models import User
+    # User loader, answered from the identity cache when possible
+    from app import identity
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return identity.load_user(int(user_id))
+    
+    # API requests may authenticate with a bearer token instead; the api
+    # blueprint sets the token's user itself (app.tokens)
     
     # Register blueprints
     from app.auth import auth_bp
@@ -34,6 +37,15 @@ def create_app():
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(test_bp, url_prefix='/test')
     
+    # CLI commands
+    from app.cli import register_commands
+    register_commands(app)
+    
+    # Without `flask worker`, web processes run queued jobs themselves
+    if app.config['INLINE_WORKER'] and not app.testing:
+        from app import jobs
+        app.before_request(lambda: jobs.start_inline_runner(app))
+    
     # Initialize config
     Config.init_app(app)
     
@@ -0,0 +1,139 @@
+"""Download analytics.
+
+Every download is appended to the download_event log by the counter
+flush (app.counters). `compact`, run by the worker every
+ANALYTICS_COMPACT_INTERVAL seconds, rolls the log up into per-model
+download_hourly and download_daily tables and trims old rows: events are
+kept DOWNLOAD_EVENT_RETENTION_DAYS days, hourly rollups
+DOWNLOAD_HOURLY_RETENTION_DAYS days, daily rollups for good. Reports
+read the rollups only, a range scan of the (user_id, day) index.
+
+Each run recomputes the hours since the newest rollup (less LATE_EVENTS,
+for downloads flushed late) from the log, so it can be repeated or
+interrupted without counting anything twice.
+"""
+from datetime import date, datetime, timedelta
+from flask import current_app
+from app import db, jobs
+from app.models import DownloadDaily, DownloadEvent, DownloadHourly, Model3D
+
+# How far back each run recomputes from the newest rollup
+LATE_EVENTS = timedelta(hours=1)
+
+# Rows written per INSERT
+INSERT_BATCH = 1000
+
+def floor_hour(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+def _hour_of(column):
+    """SQL expression for 'YYYY-MM-DD HH' of a timestamp column"""
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.to_char(column, 'YYYY-MM-DD HH24')
+    return db.func.strftime('%Y-%m-%d %H', column)
+
+def _insert(table, rows):
+    for start in range(0, len(rows), INSERT_BATCH):
+        db.session.execute(table.insert(), rows[start:start + INSERT_BATCH])
+
+def _rollup_hours(since):
+    """Rewrite the hourly rollups from `since` on from the event log"""
+    hour = _hour_of(DownloadEvent.downloaded_at)
+    rows = db.session.query(DownloadEvent.model_id, db.func.max(DownloadEvent.user_id),
+                            hour, db.func.count()) \
+        .filter(DownloadEvent.downloaded_at >= since) \
+        .group_by(DownloadEvent.model_id, hour).all()
+    DownloadHourly.query.filter(DownloadHourly.hour >= since).delete(synchronize_session=False)
+    _insert(DownloadHourly.__table__, [
+        {'model_id': model_id, 'user_id': user_id, 'downloads': count,
+         'hour': datetime.strptime(bucket, '%Y-%m-%d %H')}
+        for model_id, user_id, bucket, count in rows
+    ])
+    return len(rows)
+
+def _rollup_days(since):
+    """Rewrite the daily rollups from the day of `since` on from the hourly ones"""
+    day = db.func.date(DownloadHourly.hour)
+    first = since.date()
+    rows = db.session.query(DownloadHourly.model_id, db.func.max(DownloadHourly.user_id),
+                            day, db.func.sum(DownloadHourly.downloads)) \
+        .filter(DownloadHourly.hour >= datetime.combine(first, datetime.min.time())) \
+        .group_by(DownloadHourly.model_id, day).all()
+    DownloadDaily.query.filter(DownloadDaily.day >= first).delete(synchronize_session=False)
+    _insert(DownloadDaily.__table__, [
+        {'model_id': model_id, 'user_id': user_id, 'downloads': int(count),
+         'day': date.fromisoformat(str(bucket)[:10])}
+        for model_id, user_id, bucket, count in rows
+    ])
+    return len(rows)
+
+def compact(now=None):
+    """Roll recent download events up into the hourly and daily tables,
+    drop expired rows and commit. Returns the number of rollup rows written."""
+    config = current_app.config
+    now = now or datetime.utcnow()
+
+    # Only hours whose events are all still in the log can be recomputed
+    oldest_complete = floor_hour(now - timedelta(days=config['DOWNLOAD_EVENT_RETENTION_DAYS'])) \
+        + timedelta(hours=1)
+    newest = db.session.query(db.func.max(DownloadHourly.hour)).scalar()
+    if newest is None:
+        newest = db.session.query(db.func.min(DownloadEvent.downloaded_at)).scalar()
+        if newest is None:
+            return 0
+    since = max(floor_hour(newest - LATE_EVENTS), oldest_complete)
+
+    written = _rollup_hours(since) + _rollup_days(since)
+
+    DownloadEvent.query.filter(
+        DownloadEvent.downloaded_at < now - timedelta(days=config['DOWNLOAD_EVENT_RETENTION_DAYS'])
+    ).delete(synchronize_session=False)
+    DownloadHourly.query.filter(
+        DownloadHourly.hour < now - timedelta(days=config['DOWNLOAD_HOURLY_RETENTION_DAYS'])
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+    print(f"📈 Download rollups rewritten from {since:%Y-%m-%d %H:00}: {written} rows")
+    return written
+
+jobs.register('compact-downloads', compact, every='ANALYTICS_COMPACT_INTERVAL')
+
+def user_download_total(user_id):
+    """Lifetime downloads of a user's models, summed in SQL"""
+    return db.session.query(db.func.coalesce(db.func.sum(Model3D.downloads), 0)) \
+        .filter(Model3D.user_id == user_id).scalar()
+
+def downloads_by_day(user_id, days=90, model_id=None):
+    """{model_id: {'name', 'total', 'by_day': {date: downloads}}} for a user's
+    models over the last `days` days (today included), from the daily rollups"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    query = db.session.query(DownloadDaily.model_id, Model3D.name, DownloadDaily.day,
+                             DownloadDaily.downloads) \
+        .join(Model3D, Model3D.id == DownloadDaily.model_id) \
+        .filter(DownloadDaily.user_id == user_id, DownloadDaily.day >= since)
+    if model_id is not None:
+        query = query.filter(DownloadDaily.model_id == model_id)
+
+    models = {}
+    for row_model_id, name, day, downloads in query.order_by(DownloadDaily.day):
+        entry = models.setdefault(row_model_id, {'name': name, 'total': 0, 'by_day': {}})
+        entry['by_day'][day.isoformat()] = downloads
+        entry['total'] += downloads
+    return models
+
+def downloads_by_hour(user_id, hours=48, model_id=None):
+    """Like downloads_by_day, per hour, from the hourly rollups"""
+    since = floor_hour(datetime.utcnow()) - timedelta(hours=hours - 1)
+    query = db.session.query(DownloadHourly.model_id, Model3D.name, DownloadHourly.hour,
+                             DownloadHourly.downloads) \
+        .join(Model3D, Model3D.id == DownloadHourly.model_id) \
+        .filter(DownloadHourly.user_id == user_id, DownloadHourly.hour >= since)
+    if model_id is not None:
+        query = query.filter(DownloadHourly.model_id == model_id)
+
+    models = {}
+    for row_model_id, name, hour, downloads in query.order_by(DownloadHourly.hour):
+        entry = models.setdefault(row_model_id, {'name': name, 'total': 0, 'by_hour': {}})
+        entry['by_hour'][hour.strftime('%Y-%m-%dT%H:00')] = downloads
+        entry['total'] += downloads
+    return models
@@ -1,20 +1,66 @@
-import os
-import uuid
-from flask import Blueprint, request, jsonify, send_file, current_app
+from datetime import datetime
+from functools import partial
+from flask import Blueprint, Response, request, jsonify, current_app, g
 from flask_login import login_required, current_user
+from werkzeug.http import parse_content_range_header
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import get_input_stream
 from app import db
-from app.models import Model3D, User
+from app.models import Model3D, User, UploadSession
+from app import analytics, archives, cache, compression, counters, lod, pagination, pipeline, search, serving, stats, storage, thumbnails, tokens, uploads
 
 api_bp = Blueprint('api', __name__)
 
+@api_bp.before_request
+def authenticate_token():
+    """Accept `Authorization: Bearer <API token>` on every API route"""
+    try:
+        if tokens.authenticate(request) is None:
+            return None
+    except tokens.TokenError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    # The token's user, not a session cookie sent along, is who the
+    # scopes were checked for
+    user = tokens.request_user()
+    if user is None or not user.is_active:
+        return jsonify({'error': 'API token user no longer exists'}), 401
+    current_app.login_manager._update_request_context_with_user(user)
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
+def request_object():
+    """The JSON object in the request body ({} without one); raises
+    ValueError for JSON that is not an object"""
+    data = request.get_json(silent=True)
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    return data
+
 def get_file_extension(filename):
     return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
 
+def create_model_record(name, description, original_filename, content_hash,
+                        file_size, is_public, user_id):
+    """Add a Model3D row pointing at a stored blob (caller commits)"""
+    model = Model3D(
+        name=name,
+        description=description,
+        filename=storage.blob_key(content_hash),
+        original_filename=original_filename,
+        file_size=file_size,
+        file_extension=get_file_extension(original_filename),
+        is_public=is_public,
+        content_hash=content_hash,
+        user_id=user_id
+    )
+    db.session.add(model)
+    return model
+
 @api_bp.route('/upload', methods=['POST'])
 @login_required
 def upload_model():
@@ -36,42 +82,302 @@ def upload_model():
         if not name:
             name = file.filename.rsplit('.', 1)[0]
         
-        # Generate unique filename
         original_filename = secure_filename(file.filename)
-        file_extension = get_file_extension(original_filename)
-        unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
         
-        # Save file
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
-        
-        # Get file size
-        file_size = os.path.getsize(file_path)
+        # Save file into the content-addressed blob store (deduplicated)
+        content_hash, file_size = storage.store_stream(file.stream)
         
         # Create database record
-        model = Model3D(
-            name=name,
-            description=description,
-            filename=unique_filename,
-            original_filename=original_filename,
-            file_size=file_size,
-            file_extension=file_extension,
-            is_public=is_public,
-            user_id=current_user.id
+        model = create_model_record(name, description, original_filename,
+                                    content_hash, file_size, is_public,
+                                    current_user.id)
+        
+        db.session.commit()
+        pipeline.schedule(model)
+        
+        return jsonify({
+            'message': 'File uploaded successfully',
+            'model': model.to_dict()
+        }), 201
+        
+    except Exception as e:
+        storage.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def archive_member_filename(member_name):
+    """File name of an archive member, or None for folders, hidden and OS metadata files"""
+    if '__MACOSX/' in member_name:
+        return None
+    filename = member_name.replace('\\', '/').rsplit('/', 1)[-1]
+    if not filename or filename.startswith('.'):
+        return None
+    return filename
+
+@api_bp.route('/upload/archive', methods=['POST'])
+@login_required
+def upload_archive():
+    """Create a model for every supported file in a ZIP or tar request body.
+
+    The body is the archive itself (not multipart), read as a stream;
+    `description` and `is_public` come from the query string. Rows are
+    committed in batches of ARCHIVE_COMMIT_BATCH.
+    """
+    try:
+        config = current_app.config
+        description = request.args.get('description', '')
+        is_public = request.args.get('is_public', 'true').lower() == 'true'
+        
+        if request.content_length is not None and request.content_length > config['MAX_ARCHIVE_SIZE']:
+            return jsonify({'error': 'Archive too large'}), 413
+        
+        # Read the raw body ourselves: request.stream is capped at MAX_CONTENT_LENGTH
+        stream = get_input_stream(request.environ, max_content_length=config['MAX_ARCHIVE_SIZE'])
+        
+        results = []
+        pending = []  # (result, model) waiting for the next commit
+        error = None
+        
+        def commit_batch():
+            db.session.flush()
+            for result, model in pending:
+                result['model_id'] = model.id
+            uploaded = [(model.content_hash, model.file_extension) for _, model in pending]
+            db.session.commit()
+            pipeline.schedule_many(uploaded)
+            pending.clear()
+        
+        try:
+            members = archives.iter_members(stream, max_member_size=config['MAX_UPLOAD_SIZE'])
+            for member in members:
+                if len(results) >= config['ARCHIVE_MAX_MEMBERS']:
+                    raise archives.ArchiveError(
+                        f"Archive has more than {config['ARCHIVE_MAX_MEMBERS']} files")
+                
+                result = {'name': member.name}
+                results.append(result)
+                filename = archive_member_filename(member.name)
+                if member.error:
+                    result.update(status='failed', error=member.error)
+                elif filename is None:
+                    result.update(status='skipped', error='Hidden or system file')
+                elif not allowed_file(filename):
+                    result.update(status='skipped', error='File type not allowed')
+                else:
+                    content_hash, file_size = storage.store_stream(member.stream)
+                    model = create_model_record(filename.rsplit('.', 1)[0], description,
+                                                secure_filename(filename), content_hash,
+                                                file_size, is_public, current_user.id)
+                    result['status'] = 'created'
+                    pending.append((result, model))
+                    if len(pending) >= config['ARCHIVE_COMMIT_BATCH']:
+                        commit_batch()
+        except archives.ArchiveError as e:
+            # Members stored before the archive broke off are kept
+            error = str(e)
+            if results and results[-1].get('status') is None:
+                results[-1].update(status='failed', error=error)
+        commit_batch()
+        
+        counts = {status: sum(result.get('status') == status for result in results)
+                  for status in ('created', 'skipped', 'failed')}
+        body = dict(counts, results=results)
+        if error:
+            body['error'] = error
+            return jsonify(body), 400
+        if not counts['created']:
+            body['error'] = 'No supported model files found in archive'
+            return jsonify(body), 400
+        body['message'] = f"{counts['created']} models uploaded successfully"
+        return jsonify(body), 201
+        
+    except Exception as e:
+        storage.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def get_own_upload(upload_id):
+    """Return the caller's upload session or None"""
+    upload = UploadSession.query.get(upload_id)
+    if not upload or upload.user_id != current_user.id:
+        return None
+    return upload
+
+@api_bp.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """Start a resumable upload session"""
+    try:
+        if request.is_json:
+            data = request_object()
+        else:
+            data = request.form
+        filename = data.get('filename', '')
+        name = data.get('name', '')
+        description = data.get('description', '')
+        is_public = str(data.get('is_public', 'true')).lower() == 'true'
+        
+        try:
+            total_size = int(data.get('size', 0))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid file size'}), 400
+        
+        if not isinstance(filename, str) or not filename or not allowed_file(filename):
+            return jsonify({'error': 'File type not allowed'}), 400
+        
+        if total_size <= 0:
+            return jsonify({'error': 'File size is required'}), 400
+        
+        if total_size > current_app.config['MAX_UPLOAD_SIZE']:
+            return jsonify({'error': 'File too large'}), 413
+        
+        if not name:
+            name = filename.rsplit('.', 1)[0]
+        
+        uploads.expire_sessions()
+        
+        original_filename = secure_filename(filename)
+        upload = uploads.create_session(
+            current_user.id, name, description, original_filename,
+            is_public, total_size
         )
+        db.session.commit()
+        
+        return jsonify({'upload': upload.to_dict()}), 201
         
-        db.session.add(model)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except uploads.QuotaError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """Write one byte range, given by the Content-Range header"""
+    try:
+        upload = get_own_upload(upload_id)
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+        
+        if upload.state not in (None, uploads.RECEIVING):
+            return jsonify({'error': 'Upload is already complete', 'upload': upload.to_dict()}), 409
+        
+        content_range = parse_content_range_header(request.headers.get('Content-Range'))
+        if content_range is None or content_range.start is None:
+            return jsonify({'error': 'Content-Range header required'}), 400
+        
+        if content_range.length not in (None, upload.total_size):
+            return jsonify({'error': 'Content-Range length does not match upload size'}), 416
+        
+        if request.content_length != content_range.stop - content_range.start:
+            return jsonify({'error': 'Content-Length does not match Content-Range'}), 400
+        
+        upload = uploads.write_range(upload, content_range.start,
+                                     content_range.stop, request.stream)
         db.session.commit()
         
+        response = jsonify({'upload': upload.to_dict()})
+        response.headers['Upload-Offset'] = str(upload.offset)
+        return response
+        
+    except uploads.RangeError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 416
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/uploads/<upload_id>')
+@login_required
+def get_upload(upload_id):
+    """Report how much of an upload has been received, and its model once
+    it is completed"""
+    upload = get_own_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    response = jsonify({'upload': upload.to_dict()})
+    response.headers['Upload-Offset'] = str(upload.offset)
+    return response
+
+@api_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    """Turn a fully received upload session into a model.
+    
+    Hashing a large file takes a while, so it is queued for the worker:
+    the response is 202 and GET /api/uploads/<id> reports the model_id
+    once the session is completed. With PIPELINE_ASYNC off the model is
+    created right away (201).
+    """
+    try:
+        upload = get_own_upload(upload_id)
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+        
+        if not upload.is_complete:
+            return jsonify({
+                'error': 'Upload is incomplete',
+                'upload': upload.to_dict()
+            }), 409
+        
+        if upload.state == uploads.COMPLETED:
+            model = db.session.get(Model3D, upload.model_id)
+            if model is None:
+                return jsonify({'error': 'The model of this upload was deleted'}), 404
+        else:
+            model = uploads.request_finalize(upload)
+        
+        if model is None:
+            db.session.refresh(upload)
+            response = jsonify({'message': 'Upload is being processed', 'upload': upload.to_dict()})
+            response.headers['Location'] = f'/api/uploads/{upload.id}'
+            return response, 202
+        
         return jsonify({
             'message': 'File uploaded successfully',
             'model': model.to_dict()
         }), 201
         
+    except Exception as e:
+        storage.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def abort_upload(upload_id):
+    """Cancel an upload session and drop the received bytes"""
+    try:
+        upload = get_own_upload(upload_id)
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+        
+        uploads.discard(upload)
+        db.session.commit()
+        
+        return jsonify({'message': 'Upload cancelled'})
+        
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def is_new_download(response):
+    """True unless the response is a revalidation or error, or the request
+    resumes a download (a Range that skips the first byte).
+
+    Decided from the request: with FILE_SERVING_MODE offloading or a
+    presigned redirect, ranges are answered later by the proxy or the
+    bucket, so the status here is 200 or 302 either way.
+    """
+    if response.status_code not in (200, 206, 302):
+        return False
+    byte_range = request.range
+    if byte_range is None or byte_range.units != 'bytes':
+        return True
+    return any(start == 0 for start, _ in byte_range.ranges)
+
 @api_bp.route('/download/<int:model_id>')
 def download_model(model_id):
     try:
@@ -85,28 +391,119 @@ def download_model(model_id):
             if not current_user.is_authenticated or model.user_id != current_user.id:
                 return jsonify({'error': 'Access denied'}), 403
         
-        # Ensure upload folder exists
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        if not os.path.exists(upload_folder):
-            os.makedirs(upload_folder, exist_ok=True)
-        
-        file_path = os.path.join(upload_folder, model.filename)
-        
-        if not os.path.exists(file_path):
+        key = storage.resolve_model_key(model)
+        if not key:
             return jsonify({'error': 'File not found on server'}), 404
         
-        # Increment download count
-        model.downloads += 1
-        db.session.commit()
+        response = serving.send_asset(model, key, as_attachment=True)
+        
+        # Count the download (revalidations and resumed ranges don't count)
+        if is_new_download(response):
+            counters.record_downloads([model.id])
         
-        return send_file(file_path, 
-                        download_name=model.original_filename,
-                        as_attachment=True)
+        return response
         
     except Exception as e:
         print(f"Download error: {e}")
         return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
+def unique_archive_name(filename, taken):
+    """filename, or 'name (2).ext' and so on when already in the archive"""
+    candidate = filename
+    stem, dot, extension = filename.rpartition('.')
+    if not dot:
+        stem, extension = filename, ''
+    counter = 2
+    while candidate.lower() in taken:
+        candidate = f"{stem} ({counter}){dot}{extension}"
+        counter += 1
+    taken.add(candidate.lower())
+    return candidate
+
+@api_bp.route('/download/archive', methods=['GET', 'POST'])
+def download_archive():
+    """Stream several models as one ZIP.
+    
+    Pick models with `ids` (comma-separated in the query string, or a JSON
+    list in a POST body) or with the /api/models search parameters. The
+    archive is generated while it is sent: constant memory, no temporary
+    files.
+    """
+    try:
+        limit = current_app.config['DOWNLOAD_ARCHIVE_MAX_MODELS']
+        ids = request_object().get('ids') or [
+            value for value in request.args.get('ids', '').split(',') if value]
+        
+        if ids:
+            if not isinstance(ids, list):
+                return jsonify({'error': 'ids must be a list'}), 400
+            try:
+                ids = list(dict.fromkeys(int(model_id) for model_id in ids))
+            except (TypeError, ValueError):
+                return jsonify({'error': 'ids must be integers'}), 400
+            if len(ids) > limit:
+                return jsonify({'error': f'At most {limit} models per archive'}), 400
+            
+            found = {model.id: model for model in Model3D.query.filter(Model3D.id.in_(ids))}
+            missing = [model_id for model_id in ids if model_id not in found]
+            if missing:
+                return jsonify({'error': 'Model not found', 'ids': missing}), 404
+            
+            # Same rule as download_model: public, or owned by the caller
+            denied = [model_id for model_id, model in found.items()
+                      if not model.is_public and not (current_user.is_authenticated
+                                                      and model.user_id == current_user.id)]
+            if denied:
+                return jsonify({'error': 'Access denied', 'ids': denied}), 403
+            models = [found[model_id] for model_id in ids]
+        elif request.args.get('search') or request.args.get('user_only'):
+            query, _ = search_models_query(request.args)
+            models = query.order_by(
+                Model3D.upload_date.desc(), Model3D.id.desc()).limit(limit + 1).all()
+            if len(models) > limit:
+                return jsonify({'error': f'Search matches more than {limit} models'}), 400
+        else:
+            return jsonify({'error': 'Pass ids or a search query'}), 400
+        
+        if not models:
+            return jsonify({'error': 'No models matched'}), 404
+        
+        # Everything the generator needs is captured now; it runs after the
+        # request context is gone.
+        backend = storage.get_backend()
+        entries = []
+        taken = set()
+        for model in models:
+            key = storage.resolve_model_key(model)
+            if not key:
+                return jsonify({'error': 'File not found on server', 'ids': [model.id]}), 404
+            date_time = (model.upload_date or datetime.utcnow()).timetuple()[:6]
+            entries.append(archives.ZipEntry(
+                name=unique_archive_name(model.original_filename, taken),
+                open=partial(backend.open_read, key),
+                size=model.file_size,
+                date_time=max(date_time, (1980, 1, 1, 0, 0, 0)),
+                # Binary formats (GLB, STL, ...) barely shrink; only deflate text
+                compress=model.file_extension in compression.TEXT_EXTENSIONS
+            ))
+        
+        # Written with the other buffered counters in one batched statement
+        counters.record_downloads([model.id for model in models])
+        
+        response = Response(archives.stream_zip(entries), mimetype='application/zip')
+        response.headers.set('Content-Disposition', 'attachment',
+                             filename=request.args.get('filename', 'models.zip'))
+        response.cache_control.private = True
+        response.cache_control.no_store = True
+        return response
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Archive download error: {e}")
+        return jsonify({'error': f'Download failed: {str(e)}'}), 500
+
 @api_bp.route('/view/<int:model_id>')
 def view_model(model_id):
     """Serve model file for 3D viewing (not as download)"""
@@ -123,31 +520,24 @@ def view_model(model_id):
                 print(f"❌ Access denied for model {model_id}")
                 return jsonify({'error': 'Access denied'}), 403
         
-        # Ensure upload folder exists
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        if not os.path.exists(upload_folder):
-            print(f"❌ Upload folder not found: {upload_folder}")
-            return jsonify({'error': 'Upload folder not found'}), 404
-        
-        file_path = os.path.join(upload_folder, model.filename)
-        print(f"🔍 Looking for file: {file_path}")
-        print(f"📁 Upload folder: {upload_folder}")
-        print(f"📄 Model filename: {model.filename}")
+        # Prefer the converted GLB, or a lighter LOD when ?lod= asks for one,
+        # unless the original upload is asked for
+        level = request.args.get('lod', 0, type=int)
+        if level < 0:
+            return jsonify({'error': 'lod must be a non-negative integer'}), 400
+        if model.content_hash and request.args.get('original', 'false').lower() != 'true':
+            rendition = lod.pick_rendition(model.content_hash, level)
+            if rendition:
+                return serving.send_asset(model, rendition.key,
+                                          mimetype='model/gltf-binary',
+                                          rendition=rendition)
         
-        if not os.path.exists(file_path):
-            print(f"❌ File not found: {file_path}")
-            # List files in upload directory for debugging
-            try:
-                files_in_dir = os.listdir(upload_folder)
-                print(f"📋 Files in upload directory: {files_in_dir}")
-            except Exception as e:
-                print(f"❌ Cannot list upload directory: {e}")
-            
+        key = storage.resolve_model_key(model)
+        if not key:
+            print(f"❌ File not found for model {model_id}: {model.filename}")
             return jsonify({
                 'error': 'File not found on server',
                 'debug_info': {
-                    'expected_path': file_path,
-                    'upload_folder': upload_folder,
                     'filename': model.filename
                 }
             }), 404
@@ -167,62 +557,192 @@ def view_model(model_id):
         
         mimetype = mime_types.get(file_extension, 'application/octet-stream')
         
-        # Serve file for viewing (not download) with proper headers
-        return send_file(file_path, 
-                        as_attachment=False,
-                        mimetype=mimetype,
-                        download_name=model.original_filename)
+        # Serve file for viewing (not download) with validators and range support
+        return serving.send_asset(model, key, mimetype=mimetype)
         
     except Exception as e:
         print(f"View error: {e}")
         return jsonify({'error': f'View failed: {str(e)}'}), 500
 
-@api_bp.route('/models')
-def list_models():
+@api_bp.route('/thumbnail/<int:model_id>')
+def thumbnail(model_id):
+    """Serve a pre-rendered preview image (WebP or PNG, by Accept).
+
+    The preview of given content at a given size never changes, so pages
+    pin the URL with ?v=<content hash> and browsers keep it as immutable.
+    """
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        search = request.args.get('search', '')
-        user_only = request.args.get('user_only', 'false').lower() == 'true'
+        model = Model3D.query.get(model_id)
         
-        query = Model3D.query
+        if not model:
+            return jsonify({'error': 'Model not found'}), 404
         
-        if user_only and current_user.is_authenticated:
-            query = query.filter_by(user_id=current_user.id)
-        else:
-            query = query.filter_by(is_public=True)
+        if not model.is_public:
+            if not current_user.is_authenticated or model.user_id != current_user.id:
+                return jsonify({'error': 'Access denied'}), 403
+        
+        size = request.args.get('size', 256, type=int)
+        chosen = None
+        if model.content_hash:
+            chosen = thumbnails.pick_thumbnail(model.content_hash, size, request.accept_mimetypes)
+        if chosen is None:
+            return jsonify({'error': 'Thumbnail not available'}), 404
         
-        if search:
-            query = query.filter(
-                (Model3D.name.contains(search)) | 
-                (Model3D.description.contains(search))
-            )
+        mimetype, rendition = chosen
+        response = serving.send_asset(model, rendition.key, mimetype=mimetype,
+                                      rendition=rendition, version=model.content_hash)
+        response.vary.add('Accept')
+        return response
         
-        models = query.order_by(Model3D.upload_date.desc()).paginate(
-            page=page, per_page=min(per_page, 100), error_out=False
+    except Exception as e:
+        print(f"Thumbnail error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Sortable /api/models fields; prefix with '-' for descending order
+SORT_COLUMNS = {
+    'upload_date': Model3D.upload_date,
+    'vertex_count': Model3D.vertex_count,
+    'face_count': Model3D.face_count,
+    'surface_area': Model3D.surface_area,
+    'file_size': Model3D.file_size,
+    'downloads': Model3D.downloads,
+}
+
+# Range filters: query parameter -> (column, comparison)
+GEOMETRY_FILTERS = {
+    'min_vertices': (Model3D.vertex_count, '>='),
+    'max_vertices': (Model3D.vertex_count, '<='),
+    'min_faces': (Model3D.face_count, '>='),
+    'max_faces': (Model3D.face_count, '<='),
+    'min_area': (Model3D.surface_area, '>='),
+    'max_area': (Model3D.surface_area, '<='),
+}
+
+def apply_geometry_filters(query, args):
+    """Narrow a Model3D query by mesh complexity, units and format"""
+    for param, (column, op) in GEOMETRY_FILTERS.items():
+        value = args.get(param, type=float)
+        if value is not None:
+            query = query.filter(column >= value if op == '>=' else column <= value)
+    
+    units = args.get('units')
+    if units:
+        query = query.filter(Model3D.units_guess == units)
+    
+    file_format = args.get('format')
+    if file_format:
+        query = query.filter(Model3D.file_extension == file_format.lower())
+    
+    return query
+
+def search_models_query(args):
+    """Models matching the /api/models search parameters.
+    
+    Public models, or the caller's own with user_only=true. Returns the
+    query and the search relevance to order by (None without a search).
+    """
+    user_only = args.get('user_only', 'false').lower() == 'true'
+    
+    # Owners load in the same query; to_dict() would fetch them one by one
+    query = Model3D.query.options(db.joinedload(Model3D.owner))
+    
+    if user_only and current_user.is_authenticated:
+        query = query.filter_by(user_id=current_user.id)
+    else:
+        query = query.filter_by(is_public=True)
+    
+    query, rank = search.match(query, args.get('search', ''))
+    
+    return apply_geometry_filters(query, args), rank
+
+def model_list(args, per_page, count_mode):
+    """The /api/models response for already validated arguments"""
+    query, rank = search_models_query(args)
+    
+    # Searches are ordered by relevance unless a sort is asked for
+    sort = args.get('sort', 'relevance' if rank is not None else '-upload_date')
+    if sort == 'relevance':
+        order = rank if rank is not None else Model3D.upload_date.desc()
+    else:
+        sort_column = SORT_COLUMNS[sort.lstrip('-')]
+        order = sort_column.desc() if sort.startswith('-') else sort_column.asc()
+    
+    if 'page' in args:
+        models = query.order_by(order, Model3D.id.desc()).paginate(
+            page=args.get('page', 1, type=int), per_page=per_page, error_out=False
         )
         
-        return jsonify({
+        return {
             'models': [model.to_dict() for model in models.items],
             'total': models.total,
             'page': models.page,
             'pages': models.pages,
             'per_page': models.per_page
-        })
+        }
+    
+    page = pagination.cursor_page(query, sort, order, cursor=args.get('cursor'), per_page=per_page)
+    
+    result = {
+        'models': [model.to_dict() for model in page.items],
+        'next_cursor': page.next_cursor,
+        'per_page': per_page
+    }
+    if count_mode:
+        result['total'], result['total_exact'] = pagination.count(query, count_mode)
+    return result
+
+@api_bp.route('/models')
+def list_models():
+    """List models a page at a time.
+    
+    Pages follow the opaque `next_cursor` of the previous response
+    (`?cursor=`); the total is only computed with count=exact or
+    count=estimate. The older `?page=N` form is still served, with an
+    exact total on every page.
+    """
+    try:
+        per_page = min(request.args.get('per_page', 20, type=int), 100)
+        if per_page < 1:
+            return jsonify({'error': 'per_page must be at least 1'}), 400
+        sort = request.args.get('sort', 'relevance')
+        if sort != 'relevance' and sort.lstrip('-') not in SORT_COLUMNS:
+            return jsonify({'error': f'Cannot sort by {sort}'}), 400
+        count_mode = request.args.get('count')
+        if count_mode and count_mode not in ('exact', 'estimate'):
+            return jsonify({'error': 'count must be exact or estimate'}), 400
         
+        # Public listings are shared by everyone; a user's own are cached per user
+        if request.args.get('user_only', 'false').lower() == 'true' and current_user.is_authenticated:
+            scope, tags = f'user{current_user.id}', [cache.user_tag(current_user.id)]
+        else:
+            scope, tags = 'public', [cache.PUBLIC]
+        
+        result, source = cache.fetch(cache.request_key('models', scope, request.args), tags,
+                                     partial(model_list, request.args, per_page, count_mode))
+        return cache.mark(jsonify(result), source)
+        
+    except pagination.CursorError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def model_detail(model_id):
+    model = db.session.get(Model3D, model_id, options=[db.joinedload(Model3D.owner)])
+    return model.to_dict() if model else None
+
 @api_bp.route('/model/<int:model_id>')
 def get_model(model_id):
     try:
-        model = Model3D.query.get_or_404(model_id)
+        model, source = cache.fetch(f'model:{model_id}', [cache.model_tag(model_id)],
+                                    partial(model_detail, model_id))
+        if model is None:
+            return jsonify({'error': 'Model not found'}), 404
         
         # Check if model is public or belongs to current user
-        if not model.is_public and (not current_user.is_authenticated or model.user_id != current_user.id):
+        if not model['is_public'] and (not current_user.is_authenticated or model['user']['id'] != current_user.id):
             return jsonify({'error': 'Access denied'}), 403
         
-        return jsonify({'model': model.to_dict()})
+        return cache.mark(jsonify({'model': model}), source)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -237,33 +757,290 @@ def delete_model(model_id):
         if model.user_id != current_user.id:
             return jsonify({'error': 'Access denied'}), 403
         
-        # Delete file
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], model.filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Drop the blob reference; legacy rows own their file outright
+        if model.content_hash:
+            unlink_keys = storage.release_blob(model.content_hash)
+        else:
+            key = storage.resolve_model_key(model)
+            unlink_keys = [key] if key else []
         
         # Delete database record
         db.session.delete(model)
         db.session.commit()
         
+        # Delete files once nothing references them any more
+        storage.remove_files(unlink_keys)
+        
         return jsonify({'message': 'Model deleted successfully'})
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+# Fields a batch update may change, with their check
+BATCH_UPDATE_FIELDS = {
+    'name': lambda value: isinstance(value, str) and 0 < len(value.strip()) <= 100,
+    'description': lambda value: value is None or isinstance(value, str),
+    'is_public': lambda value: isinstance(value, bool),
+}
+
+def batch_ids(values):
+    """Distinct model ids of a batch request, in order; raises ValueError"""
+    limit = current_app.config['API_BATCH_MAX']
+    if not isinstance(values, list) or not values:
+        raise ValueError('ids must be a non-empty list')
+    if len(values) > limit:
+        raise ValueError(f'At most {limit} models per batch')
+    if not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        raise ValueError('ids must be integers')
+    return list(dict.fromkeys(values))
+
+def own_models(ids):
+    """The current user's models among `ids`, in one query, or a 404
+    response naming the ids that are missing or not theirs"""
+    models = Model3D.query.options(db.joinedload(Model3D.owner)).filter(
+        Model3D.id.in_(ids), Model3D.user_id == current_user.id
+    ).all()
+    found = {model.id for model in models}
+    missing = [model_id for model_id in ids if model_id not in found]
+    if missing:
+        return None, (jsonify({'error': 'Models not found', 'not_found': missing}), 404)
+    return models, None
+
+@api_bp.route('/models:batchGet', methods=['POST'])
+def batch_get_models():
+    """Details of up to API_BATCH_MAX models by id, in one query. Ids that
+    do not exist or are not visible to the caller are listed in not_found."""
+    try:
+        ids = batch_ids(request_object().get('ids'))
+        
+        visible = Model3D.is_public.is_(True)
+        if current_user.is_authenticated:
+            visible = visible | (Model3D.user_id == current_user.id)
+        models = Model3D.query.options(db.joinedload(Model3D.owner)).filter(
+            Model3D.id.in_(ids), visible
+        ).all()
+        
+        by_id = {model.id: model for model in models}
+        return jsonify({
+            'models': [by_id[model_id].to_dict() for model_id in ids if model_id in by_id],
+            'not_found': [model_id for model_id in ids if model_id not in by_id]
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/models:batchUpdate', methods=['POST'])
+@login_required
+def batch_update_models():
+    """Change name, description and/or is_public of several of your models
+    in one transaction: {"updates": [{"id": 1, "is_public": false}, ...]}.
+    Nothing is changed unless every model can be."""
+    try:
+        updates = request_object().get('updates')
+        if not isinstance(updates, list) or not all(isinstance(update, dict) for update in updates):
+            return jsonify({'error': 'updates must be a list of objects'}), 400
+        ids = batch_ids([update.get('id') for update in updates])
+        if len(ids) != len(updates):
+            return jsonify({'error': 'Each model may appear only once'}), 400
+        for update in updates:
+            for field, value in update.items():
+                if field == 'id':
+                    continue
+                check = BATCH_UPDATE_FIELDS.get(field)
+                if check is None:
+                    return jsonify({'error': f'Cannot update {field}'}), 400
+                if not check(value):
+                    return jsonify({'error': f'Invalid {field} for model {update["id"]}'}), 400
+        
+        models, error = own_models(ids)
+        if error:
+            return error
+        
+        by_id = {model.id: model for model in models}
+        for update in updates:
+            model = by_id[update['id']]
+            for field, value in update.items():
+                if field != 'id':
+                    setattr(model, field, value.strip() if field == 'name' else value)
+        db.session.commit()
+        
+        return jsonify({'models': [by_id[model_id].to_dict() for model_id in ids]})
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/models:batchDelete', methods=['POST'])
+@login_required
+def batch_delete_models():
+    """Delete several of your models in one transaction: {"ids": [...]}.
+    Nothing is deleted unless every model can be; files no longer
+    referenced are removed afterwards in one job."""
+    try:
+        ids = batch_ids(request_object().get('ids'))
+        models, error = own_models(ids)
+        if error:
+            return error
+        
+        # Blob references are released together; legacy rows own their file outright
+        unlink_keys = storage.release_blobs([model.content_hash for model in models if model.content_hash])
+        for model in models:
+            if not model.content_hash:
+                key = storage.resolve_model_key(model)
+                if key:
+                    unlink_keys.append(key)
+            db.session.delete(model)
+        db.session.commit()
+        
+        storage.schedule_removal(unlink_keys)
+        
+        return jsonify({'message': f'{len(ids)} models deleted', 'deleted': ids})
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @api_bp.route('/stats')
 def get_stats():
+    """Catalog totals, public models per format and activity per day
+    (last `days` days, default 30), read from the materialized stats"""
     try:
-        total_models = Model3D.query.filter_by(is_public=True).count()
-        total_users = User.query.count()
-        total_downloads = db.session.query(db.func.sum(Model3D.downloads)).scalar() or 0
+        days = request.args.get('days', 30, type=int)
+        if not 1 <= days <= 366:
+            return jsonify({'error': 'days must be between 1 and 366'}), 400
+        
+        result, source = cache.fetch(f'stats:{days}', [cache.STATS], partial(stats.snapshot, days=days))
+        result = dict(result, total_downloads=result['total_downloads'] + counters.total_unflushed_downloads())
+        return cache.mark(jsonify(result), source)
         
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/analytics')
+@login_required
+def get_analytics():
+    """Downloads per model per day (last `days` days, default 90) of the
+    current user's models, or per hour with interval=hour (last `hours`
+    hours, default 48). Read from the rollups, so the last few minutes
+    are not included yet."""
+    try:
+        interval = request.args.get('interval', 'day')
+        model_id = request.args.get('model_id', type=int)
+        if interval == 'day':
+            days = request.args.get('days', 90, type=int)
+            if not 1 <= days <= 366:
+                return jsonify({'error': 'days must be between 1 and 366'}), 400
+            series = analytics.downloads_by_day(current_user.id, days=days, model_id=model_id)
+            key = 'by_day'
+        elif interval == 'hour':
+            hours = request.args.get('hours', 48, type=int)
+            max_hours = current_app.config['DOWNLOAD_HOURLY_RETENTION_DAYS'] * 24
+            if not 1 <= hours <= max_hours:
+                return jsonify({'error': f'hours must be between 1 and {max_hours}'}), 400
+            series = analytics.downloads_by_hour(current_user.id, hours=hours, model_id=model_id)
+            key = 'by_hour'
+        else:
+            return jsonify({'error': 'interval must be day or hour'}), 400
+        
+        models = sorted(({'id': id_, 'name': entry['name'], 'total': entry['total'],
+                          key: entry[key]} for id_, entry in series.items()),
+                        key=lambda model: -model['total'])
         return jsonify({
-            'total_models': total_models,
-            'total_users': total_users,
-            'total_downloads': total_downloads
+            'interval': interval,
+            'total': sum(model['total'] for model in models),
+            'models': models
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/tokens', methods=['POST'])
+def create_token():
+    """Issue an API token for the logged-in user, or for `username` and
+    `password` in the body (one password check, then no more logins)"""
+    try:
+        data = request_object()
+        if g.get('api_token'):
+            return jsonify({'error': 'API tokens cannot issue new tokens'}), 403
+        
+        if current_user.is_authenticated:
+            user = current_user
+        else:
+            login_field = data.get('username')
+            user = User.query.filter(
+                (User.username == login_field) | (User.email == login_field)
+            ).first() if login_field else None
+            if not user or not user.check_password(data.get('password') or ''):
+                return jsonify({'error': 'Invalid credentials'}), 401
+        
+        expires_in = data.get('expires_in', current_app.config['API_TOKEN_DEFAULT_TTL'])
+        max_ttl = current_app.config['API_TOKEN_MAX_TTL']
+        if (not isinstance(expires_in, int) or isinstance(expires_in, bool)
+                or not 1 <= expires_in <= max_ttl):
+            return jsonify({'error': f'expires_in must be between 1 and {max_ttl} seconds'}), 400
+        
+        token, claims = tokens.issue(user, data.get('scopes', ['read']), expires_in)
+        return jsonify({
+            'token': token,
+            'token_id': claims['j'],
+            'scopes': claims['s'],
+            'expires_at': datetime.utcfromtimestamp(claims['e']).isoformat()
+        }), 201
+        
+    except tokens.TokenError as e:
+        return jsonify({'error': str(e)}), e.status
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/tokens/revoke', methods=['POST'])
+@login_required
+def revoke_tokens():
+    """Revoke `token` (default: the bearer token in use), or with
+    `all: true` every token issued to the user so far. A bearer token
+    needs the 'write' scope for anything but revoking itself."""
+    try:
+        data = request_object()
+        if data.get('all'):
+            if not tokens.has_scope('write'):
+                return jsonify({'error': "API token lacks the 'write' scope"}), 403
+            tokens.revoke(user_id=current_user.id)
+            return jsonify({'message': 'All API tokens revoked'})
+        
+        token = data.get('token')
+        bearer = g.get('api_token')
+        if token:
+            claims = tokens.verify(token, check_expiry=False)
+        else:
+            claims = bearer
+        if not claims:
+            return jsonify({'error': 'No token given'}), 400
+        if claims['u'] != current_user.id:
+            return jsonify({'error': 'Access denied'}), 403
+        if not (bearer and claims['j'] == bearer['j']) and not tokens.has_scope('write'):
+            return jsonify({'error': "API token lacks the 'write' scope"}), 403
+        
+        tokens.revoke(claims)
+        return jsonify({'message': 'API token revoked', 'token_id': claims['j']})
+        
+    except (tokens.TokenError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/cache/stats')
+@login_required
+def get_cache_stats():
+    """Response cache hit/miss counters of the worker answering (admins only)"""
+    if current_user.username not in current_app.config['ADMIN_USERNAMES']:
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(cache.get_cache().stats())
@@ -0,0 +1,327 @@
+"""Streaming archive reading and writing.
+
+Archives are read front to back from a non-seekable request stream, so an
+asset pack is never written to disk as a whole: ZIP members are decoded
+from their local file headers (the central directory at the end is never
+needed) and tar archives, compressed or not, go through tarfile's stream
+mode. Outgoing ZIPs are produced the same way, chunk by chunk.
+"""
+import struct
+import tarfile
+import zipfile
+import zlib
+from collections import namedtuple
+from contextlib import closing
+
+ZIP_LOCAL_HEADER = 0x04034b50
+ZIP_CENTRAL_HEADER = 0x02014b50
+ZIP_END_OF_CENTRAL_DIR = 0x06054b50
+ZIP_DATA_DESCRIPTOR = 0x08074b50
+ZIP64_EXTRA = 0x0001
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+FLAG_ENCRYPTED = 0x1
+FLAG_DATA_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+
+READ_SIZE = 64 * 1024
+
+# One archive entry: its path inside the archive and a file-like object with
+# the (decompressed) contents, valid until the next member is requested.
+# `error` is set instead of `stream` for entries that cannot be extracted.
+Member = namedtuple('Member', ['name', 'stream', 'error'])
+
+# One file to put in an outgoing ZIP: `open` returns a readable binary
+# stream, `size` is its length and `compress` selects deflate over stored.
+ZipEntry = namedtuple('ZipEntry', ['name', 'open', 'size', 'date_time', 'compress'])
+
+class ArchiveError(ValueError):
+    """Raised when an archive is malformed or cannot be read as a stream"""
+
+class StreamReader:
+    """Buffered reader over a non-seekable stream with exact reads and peek"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b''
+
+    def peek(self, size):
+        while len(self.buffer) < size:
+            chunk = self.stream.read(max(READ_SIZE, size - len(self.buffer)))
+            if not chunk:
+                break
+            self.buffer += chunk
+        return self.buffer[:size]
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.buffer + self.stream.read()
+            self.buffer = b''
+            return data
+        if not self.buffer:
+            return self.stream.read(size)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read_exact(self, size):
+        data = self.peek(size)
+        if len(data) < size:
+            raise ArchiveError('Unexpected end of archive')
+        self.buffer = self.buffer[size:]
+        return data
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+class LimitedReader:
+    """File-like view of the next `size` bytes of a StreamReader"""
+
+    def __init__(self, reader, size):
+        self.reader = reader
+        self.remaining = size
+
+    def read(self, size=-1):
+        if not self.remaining:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.reader.read(size)
+        if not data:
+            raise ArchiveError('Unexpected end of archive')
+        self.remaining -= len(data)
+        return data
+
+    def drain(self):
+        while self.read(READ_SIZE):
+            pass
+
+class InflateReader:
+    """File-like object inflating a raw deflate stream that ends on its own.
+
+    Input left over after the end of the deflate stream is handed back to
+    the StreamReader, so members whose sizes are only given in a trailing
+    data descriptor can still be read.
+    """
+
+    def __init__(self, reader, compressed_size=None):
+        self.reader = reader
+        self.source = LimitedReader(reader, compressed_size) if compressed_size is not None else None
+        self.inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.pending = b''
+
+    def read(self, size=-1):
+        size = READ_SIZE if size is None or size < 0 else size
+        while not self.pending and not self.inflater.eof:
+            data = (self.source or self.reader).read(READ_SIZE)
+            if not data:
+                raise ArchiveError('Unexpected end of archive')
+            try:
+                self.pending = self.inflater.decompress(data)
+            except zlib.error as e:
+                raise ArchiveError(f'Corrupt deflate data: {e}')
+            if self.inflater.eof and self.inflater.unused_data and self.source is None:
+                self.reader.unread(self.inflater.unused_data)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def drain(self):
+        while self.read(READ_SIZE):
+            pass
+        if self.source is not None:
+            self.source.drain()
+
+class CheckedReader:
+    """Track the CRC-32 and size of a member while it is read, cap its size
+    and report read failures as ArchiveError.
+
+    `verify(crc, size)` is called when the member has been read to the end,
+    so a corrupt member fails while it is being consumed.
+    """
+
+    def __init__(self, stream, max_size, verify=None):
+        self.stream = stream
+        self.max_size = max_size
+        self.verify = verify
+        self.crc = 0
+        self.size = 0
+        self.finished = False
+
+    def read(self, size=-1):
+        try:
+            data = self.stream.read(size)
+        except (tarfile.TarError, EOFError, zlib.error) as e:
+            raise ArchiveError(f'Corrupt archive member: {e}')
+        if not data and not self.finished:
+            self.finished = True
+            if self.verify is not None:
+                self.verify(self.crc, self.size)
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise ArchiveError('Member is larger than the upload size limit')
+        return data
+
+def _extra_fields(extra):
+    """Split a ZIP extra field into {tag: data}"""
+    fields = {}
+    offset = 0
+    while offset + 4 <= len(extra):
+        tag, length = struct.unpack_from('<HH', extra, offset)
+        fields[tag] = extra[offset + 4:offset + 4 + length]
+        offset += 4 + length
+    return fields
+
+def _zip64_sizes(zip64_extra, compressed_size, uncompressed_size):
+    """Replace 0xFFFFFFFF sizes with the values from a ZIP64 extra field"""
+    values = [struct.unpack_from('<Q', zip64_extra, index)[0]
+              for index in range(0, len(zip64_extra) - 7, 8)]
+    # The record only holds the fields that overflowed, in this order
+    if uncompressed_size == 0xFFFFFFFF and values:
+        uncompressed_size = values.pop(0)
+    if compressed_size == 0xFFFFFFFF and values:
+        compressed_size = values.pop(0)
+    return compressed_size, uncompressed_size
+
+def iter_zip(reader, max_member_size=None):
+    """Yield a Member for every file entry of a ZIP read from the front.
+
+    A member's stream is only valid until the next member is requested;
+    whatever was not read is skipped. Members read to the end are checked
+    against their CRC-32.
+    """
+    while True:
+        signature = reader.peek(4)
+        if len(signature) < 4:
+            raise ArchiveError('ZIP archive ends without a central directory')
+        (signature,) = struct.unpack('<I', signature)
+        if signature in (ZIP_CENTRAL_HEADER, ZIP_END_OF_CENTRAL_DIR):
+            return
+        if signature != ZIP_LOCAL_HEADER:
+            raise ArchiveError('Invalid ZIP local file header')
+
+        (_, _, flags, method, _, _, crc, compressed_size, uncompressed_size,
+         name_length, extra_length) = struct.unpack('<IHHHHHIIIHH', reader.read_exact(30))
+        raw_name = reader.read_exact(name_length)
+        extra = reader.read_exact(extra_length)
+        name = raw_name.decode('utf-8' if flags & FLAG_UTF8 else 'cp437', errors='replace')
+        zip64_extra = _extra_fields(extra).get(ZIP64_EXTRA)
+        if zip64_extra is not None:
+            compressed_size, uncompressed_size = _zip64_sizes(zip64_extra, compressed_size,
+                                                              uncompressed_size)
+        zip64 = zip64_extra is not None
+        deferred = bool(flags & FLAG_DATA_DESCRIPTOR)
+
+        if method == ZIP_STORED and deferred and name.endswith('/'):
+            _read_data_descriptor(reader, zip64)
+            continue
+        if flags & FLAG_ENCRYPTED or method not in (ZIP_STORED, ZIP_DEFLATED):
+            if deferred:
+                raise ArchiveError(f'{name}: cannot skip an encrypted or unsupported entry '
+                                   'of unknown size')
+            LimitedReader(reader, compressed_size).drain()
+            yield Member(name, None, 'Encrypted entries are not supported' if flags & FLAG_ENCRYPTED
+                         else f'Unsupported compression method {method}')
+            continue
+
+        if method == ZIP_DEFLATED:
+            body = InflateReader(reader, None if deferred else compressed_size)
+        elif not deferred:
+            body = LimitedReader(reader, compressed_size)
+        else:
+            # Without sizes up front there is no way to find where stored data ends
+            raise ArchiveError(f'{name}: stored (uncompressed) entries with a data descriptor '
+                               'cannot be streamed; recreate the archive with compression')
+
+        descriptor = []
+
+        def verify(actual_crc, actual_size, name=name, crc=crc, size=uncompressed_size):
+            body.drain()
+            if deferred:
+                descriptor.append(_read_data_descriptor(reader, zip64))
+                crc, _, size = descriptor[0]
+            if actual_crc != crc or actual_size != size:
+                raise ArchiveError(f'{name}: CRC or size mismatch')
+
+        if not name.endswith('/'):
+            yield Member(name, CheckedReader(body, max_member_size, verify), None)
+
+        # Skip whatever the consumer did not read
+        if not descriptor:
+            body.drain()
+            if deferred:
+                _read_data_descriptor(reader, zip64)
+
+def _read_data_descriptor(reader, zip64):
+    """Read (crc, compressed size, uncompressed size) after a member's data"""
+    if struct.unpack('<I', reader.peek(4))[0] == ZIP_DATA_DESCRIPTOR:
+        reader.read_exact(4)
+    if zip64:
+        return struct.unpack('<IQQ', reader.read_exact(20))
+    return struct.unpack('<III', reader.read_exact(12))
+
+def iter_tar(reader, max_member_size=None):
+    """Yield a Member for every regular file of a (optionally compressed) tar"""
+    try:
+        with tarfile.open(fileobj=reader, mode='r|*') as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                if max_member_size is not None and info.size > max_member_size:
+                    yield Member(info.name, None, 'Member is larger than the upload size limit')
+                    continue
+                yield Member(info.name, CheckedReader(archive.extractfile(info), max_member_size), None)
+    except (tarfile.TarError, EOFError, OSError, zlib.error) as e:
+        raise ArchiveError(f'Invalid tar archive: {e}')
+
+def iter_members(stream, max_member_size=None):
+    """Yield the members of a ZIP or tar(.gz/.bz2/.xz) archive stream"""
+    reader = StreamReader(stream)
+    if reader.peek(4) == struct.pack('<I', ZIP_LOCAL_HEADER):
+        return iter_zip(reader, max_member_size)
+    return iter_tar(reader, max_member_size)
+
+class _ChunkSink:
+    """Unseekable write target that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_zip(entries):
+    """Yield the bytes of a ZIP holding `entries`, one chunk at a time.
+
+    Nothing is buffered beyond a chunk, so memory use does not depend on
+    the archive size. Members larger than 4 GB, and archives larger than
+    4 GB or with more than 65535 members, use ZIP64 records.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, date_time=entry.date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED if entry.compress else zipfile.ZIP_STORED
+            info.file_size = entry.size  # lets zipfile decide on ZIP64 up front
+            info.external_attr = 0o644 << 16
+            with closing(entry.open()) as src, archive.open(info, 'w') as dst:
+                while True:
+                    chunk = src.read(READ_SIZE * 4)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,354 @@
+"""Response cache for the catalog read endpoints.
+
+Two tiers: a bounded LRU in each process, whose entries also expire
+after CACHE_LOCAL_TTL seconds, and with CACHE_SHARED_URL set a store the
+worker processes fill for each other (redis://..., or memory:// for an
+in-process stand-in in development and tests).
+
+Entries carry tags: 'model:<id>', 'user:<id>', 'public' (the public
+listings) and 'stats'. Invalidating a tag bumps its version, and an
+entry is only served while each of its tags still has the version it
+was built under, so nothing has to find the entries themselves and a
+response built while its data changed is never served. With a shared
+tier the versions live there as well, so a change committed by one
+worker invalidates every worker's entries; a lookup is then a single
+round trip (one MGET of the entry and its tag versions).
+
+Tags are invalidated when a transaction that changes models or users
+commits (the session hooks at the end) and by writers that bypass the
+ORM, such as the download counter flush.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from urllib.parse import urlencode
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app.models import Model3D, User
+
+PUBLIC = 'public'
+STATS = 'stats'
+
+# Shared tier key prefixes
+ENTRY_PREFIX = 'cache:entry:'
+TAG_PREFIX = 'cache:tag:'
+
+# X-Cache response header per lookup result
+HEADERS = {'local': 'HIT-LOCAL', 'shared': 'HIT-SHARED', 'miss': 'MISS', 'off': 'BYPASS'}
+
+LocalEntry = namedtuple('LocalEntry', ['value', 'versions', 'expires_at'])
+
+def model_tag(model_id):
+    return f"model:{model_id}"
+
+def user_tag(user_id):
+    return f"user:{user_id}"
+
+def request_key(endpoint, scope, args):
+    """Key for a response that depends on `args` (a dict or MultiDict)"""
+    items = sorted(args.items(multi=True) if hasattr(args, 'getlist') else args.items())
+    digest = hashlib.sha1(urlencode(items).encode('utf-8')).hexdigest()
+    return f"{endpoint}:{scope}:{digest}"
+
+def model_tags(rows):
+    """Tags to invalidate for changed models, given (id, user_id) pairs"""
+    tags = {PUBLIC}
+    for model_id, user_id in rows:
+        tags.add(model_tag(model_id))
+        tags.add(user_tag(user_id))
+    return tags
+
+class LocalCache:
+    """Per-process LRU of built values, and the tag versions used when no
+    shared tier is configured"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.versions = Counter()
+        # Bumped when the versions are reset, so entries from before never match
+        self.generation = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, versions):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = LocalEntry(value, versions, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def tag_versions(self, tags):
+        with self.lock:
+            return (self.generation,) + tuple(self.versions[tag] for tag in tags)
+
+    def bump(self, tags):
+        with self.lock:
+            # Every changed model leaves a version behind; start over once
+            # they far outnumber the entries they could apply to
+            if len(self.versions) > 4 * max(self.max_entries, 1024):
+                self.versions.clear()
+                self.entries.clear()
+                self.generation += 1
+            for tag in tags:
+                self.versions[tag] += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+class MemoryStore:
+    """Shared tier stand-in kept in this process (memory://name)"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def _get(self, key, now):
+        item = self.data.get(key)
+        if item is not None and item[1] <= now:
+            del self.data[key]
+            return None
+        return item[0] if item else None
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self.lock:
+            return [self._get(key, now) for key in keys]
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + ttl)
+
+    def incr_many(self, keys, ttl):
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                self.data[key] = (int(self._get(key, now) or 0) + 1, now + ttl)
+
+_memory_stores = {}
+
+class RedisStore:
+    """Shared tier in Redis (redis://host:port/db)"""
+
+    name = 'redis'
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get_many(self, keys):
+        return self.client.mget(keys)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=ttl)
+
+    def incr_many(self, keys, ttl):
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(key)
+            pipe.expire(key, ttl)
+        pipe.execute()
+
+class ResponseCache:
+    """Tagged two-tier cache; see the module docstring"""
+
+    def __init__(self, local, shared=None, shared_ttl=300, enabled=True):
+        self.local = local
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        # A tag version must outlive every entry built under an older one
+        self.tag_ttl = 2 * max(shared_ttl, local.ttl)
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.metrics = Counter()
+
+    def _count(self, *names):
+        with self.lock:
+            self.metrics.update(names)
+
+    def fetch(self, key, tags, build):
+        """Return (value, source) for `key`, calling build() on a miss.
+
+        `source` is 'local', 'shared', 'miss' or 'off'. A None from build()
+        is not cached. Cached values are shared between requests: treat
+        them as read-only.
+        """
+        if not self.enabled:
+            return build(), 'off'
+        endpoint = key.split(':', 1)[0]
+
+        shared_raw = None
+        if self.shared is not None:
+            try:
+                raw = self.shared.get_many([ENTRY_PREFIX + key] + [TAG_PREFIX + tag for tag in tags])
+            except Exception as e:
+                # Without the shared versions nothing can be trusted; serve uncached
+                self._count('shared_errors', 'misses', f'{endpoint}.misses')
+                print(f"⚠️ Shared cache unavailable: {e}")
+                return build(), 'miss'
+            shared_raw = raw[0]
+            versions = tuple(int(version or 0) for version in raw[1:])
+        else:
+            versions = self.local.tag_versions(tags)
+
+        entry = self.local.get(key)
+        if entry is not None and entry.versions == versions:
+            self._count('local_hits', f'{endpoint}.hits')
+            return entry.value, 'local'
+
+        if shared_raw is not None:
+            stored = json.loads(shared_raw)
+            if tuple(stored['t']) == versions:
+                self.local.set(key, stored['v'], versions)
+                self._count('shared_hits', f'{endpoint}.hits')
+                return stored['v'], 'shared'
+
+        self._count('misses', f'{endpoint}.misses')
+        value = build()
+        if value is None:
+            return value, 'miss'
+        self.local.set(key, value, versions)
+        if self.shared is not None:
+            try:
+                self.shared.set(ENTRY_PREFIX + key, json.dumps({'v': value, 't': versions}),
+                                self.shared_ttl)
+            except Exception as e:
+                self._count('shared_errors')
+                print(f"⚠️ Shared cache write failed: {e}")
+        return value, 'miss'
+
+    def invalidate(self, *tags):
+        """Make every entry carrying any of `tags` stale"""
+        tags = sorted(set(tags))
+        if not tags:
+            return
+        self._count(*['invalidations'] * len(tags))
+        self.local.bump(tags)
+        if self.shared is not None:
+            try:
+                self.shared.incr_many([TAG_PREFIX + tag for tag in tags], self.tag_ttl)
+            except Exception as e:
+                self._count('shared_errors')
+                print(f"⚠️ Shared cache invalidation failed, other workers may serve "
+                      f"stale entries for up to {self.shared_ttl}s: {e}")
+
+    def stats(self):
+        """Hit/miss counters of this process"""
+        with self.lock:
+            metrics = dict(self.metrics)
+        hits = metrics.get('local_hits', 0) + metrics.get('shared_hits', 0)
+        lookups = hits + metrics.get('misses', 0)
+        endpoints = {}
+        for name, value in metrics.items():
+            if '.' in name:
+                endpoint, kind = name.split('.', 1)
+                endpoints.setdefault(endpoint, {'hits': 0, 'misses': 0})[kind] = value
+        return {
+            'enabled': self.enabled,
+            'shared': self.shared.name if self.shared is not None else None,
+            'local_entries': len(self.local),
+            'local_max_entries': self.local.max_entries,
+            'local_hits': metrics.get('local_hits', 0),
+            'shared_hits': metrics.get('shared_hits', 0),
+            'misses': metrics.get('misses', 0),
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'invalidations': metrics.get('invalidations', 0),
+            'shared_errors': metrics.get('shared_errors', 0),
+            'endpoints': endpoints
+        }
+
+def create_cache(config):
+    """Build the response cache configured by the CACHE_* settings"""
+    local = LocalCache(config['CACHE_LOCAL_MAX_ENTRIES'], config['CACHE_LOCAL_TTL'])
+    url = config['CACHE_SHARED_URL']
+    if not url:
+        shared = None
+    elif url.startswith('memory://'):
+        # Apps in one process configured with the same URL share the store
+        shared = _memory_stores.setdefault(url, MemoryStore())
+    elif url.startswith(('redis://', 'rediss://', 'unix://')):
+        shared = RedisStore(url)
+    else:
+        raise ValueError(f"Unknown CACHE_SHARED_URL scheme: {url}")
+    return ResponseCache(local, shared, shared_ttl=config['CACHE_SHARED_TTL'],
+                         enabled=config['CACHE_ENABLED'])
+
+def get_cache():
+    """Return the app's response cache, creating it on first use"""
+    cache = current_app.extensions.get('response_cache')
+    if cache is None:
+        cache = create_cache(current_app.config)
+        current_app.extensions['response_cache'] = cache
+    return cache
+
+def fetch(key, tags, build):
+    return get_cache().fetch(key, tags, build)
+
+def invalidate(*tags):
+    if has_app_context():
+        get_cache().invalidate(*tags)
+
+def mark(response, source):
+    """Label a response with how the cache answered it"""
+    response.headers['X-Cache'] = HEADERS[source]
+    return response
+
+# --- invalidation on commit -------------------------------------------------
+
+def _was_public(model):
+    history = inspect(model).attrs.is_public.history
+    return any(value is not False for value in [model.is_public, *history.deleted])
+
+def _changed_tags(session):
+    tags = set()
+    for obj in session.new | session.deleted:
+        if isinstance(obj, Model3D):
+            tags.update({model_tag(obj.id), user_tag(obj.user_id), STATS})
+            if _was_public(obj):
+                tags.add(PUBLIC)
+        elif isinstance(obj, User):
+            tags.update({user_tag(obj.id), STATS})
+    for obj in session.dirty:
+        if isinstance(obj, Model3D):
+            tags.update({model_tag(obj.id), user_tag(obj.user_id)})
+            if _was_public(obj):
+                tags.add(PUBLIC)
+            if inspect(obj).attrs.is_public.history.deleted:
+                tags.add(STATS)
+        elif isinstance(obj, User):
+            tags.update({user_tag(obj.id), PUBLIC})  # listings show the owner
+    return tags
+
+@event.listens_for(Session, 'after_flush')
+def _collect_tags(session, flush_context):
+    tags = _changed_tags(session)
+    if tags:
+        session.info.setdefault('cache_tags', set()).update(tags)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        invalidate(*tags)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_tags(session):
+    session.info.pop('cache_tags', None)
@@ -0,0 +1,59 @@
+import click
+from flask.cli import with_appcontext
+from flask import current_app
+from app import jobs, migrations, storage
+from app import pipeline  # noqa: F401  registers the post-upload job handlers
+
+@click.command('migrate-uploads')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Files moved per database transaction.')
+@click.option('--pause', default=0.1, show_default=True,
+              help='Seconds to sleep between batches.')
+@with_appcontext
+def migrate_uploads_command(batch_size, pause):
+    """Move legacy flat upload files into the sharded directory layout."""
+    total = 0
+    for moved in storage.migrate_flat_files(batch_size=batch_size, pause=pause):
+        total += moved
+        click.echo(f"Moved {total} files so far")
+    click.echo(f"✅ Migration finished: {total} files moved")
+
+@click.command('worker')
+@click.option('--processes', type=int, default=None,
+              help='Jobs run in parallel. Defaults to WORKER_PROCESSES.')
+@click.option('--concurrency', default=None,
+              help="Per-kind limits such as 'render=2,compress=4'. Defaults to JOB_CONCURRENCY.")
+@click.option('--poll-interval', default=1.0, show_default=True,
+              help='Seconds between queue polls when idle.')
+@click.option('--burst', is_flag=True,
+              help='Exit once no job is ready to run.')
+@with_appcontext
+def worker_command(processes, concurrency, poll_interval, burst):
+    """Run queued background jobs on a process pool."""
+    config = current_app.config
+    limits = jobs.parse_concurrency(config['JOB_CONCURRENCY'])
+    limits.update(jobs.parse_concurrency(concurrency))
+    jobs.run_worker(processes or config['WORKER_PROCESSES'], limits,
+                    poll_interval=poll_interval, burst=burst)
+
+@click.command('migrate-schema')
+@click.option('--status', is_flag=True, help='List migrations and whether they are applied.')
+@click.option('--to', 'target', type=int, default=None,
+              help='Stop after this version instead of applying everything.')
+@with_appcontext
+def migrate_schema_command(status, target):
+    """Apply pending schema migrations (safe while serving)."""
+    if status:
+        for version, description, applied in migrations.status():
+            click.echo(f"{'✅' if applied else '⏳'} {version:>3}  {description}")
+        return
+    applied = migrations.upgrade(target)
+    if applied:
+        click.echo(f"✅ Applied migrations {', '.join(map(str, applied))}")
+    else:
+        click.echo("✅ Schema is up to date")
+
+def register_commands(app):
+    app.cli.add_command(migrate_uploads_command)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(migrate_schema_command)
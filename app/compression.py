@@ -0,0 +1,97 @@
+import gzip
+import os
+import shutil
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Rendition
+from app import storage
+
+try:
+    import zstandard
+except ImportError:  # zstd variants are optional
+    zstandard = None
+
+# Formats stored as text that compress well; binary formats are left alone
+TEXT_EXTENSIONS = {'obj', 'gltf', 'dae'}
+
+# Content-Encoding -> (rendition kind, key suffix), in server preference order
+ENCODINGS = {
+    'zstd': ('zstd', 'zst'),
+    'gzip': ('gzip', 'gz'),
+}
+
+# Only keep a variant if it saves at least this fraction of the original
+MIN_SAVING = 0.1
+
+def available_encodings():
+    return [encoding for encoding in ENCODINGS if encoding != 'zstd' or zstandard]
+
+def _compress_gzip(src_path, dst_path):
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as raw:
+        # mtime=0 keeps the output byte-identical for identical input
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, storage.CHUNK_SIZE)
+
+def _compress_zstd(src_path, dst_path):
+    compressor = zstandard.ZstdCompressor(level=19)
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        compressor.copy_stream(src, dst, size=os.path.getsize(src_path))
+
+COMPRESSORS = {
+    'gzip': _compress_gzip,
+    'zstd': _compress_zstd,
+}
+
+def compress_variants(content_hash, file_extension):
+    """Pipeline stage: write pre-compressed siblings of a text asset.
+
+    Idempotent; variants that already exist are skipped.
+    """
+    if file_extension not in TEXT_EXTENSIONS:
+        return
+
+    existing = {kind for (kind,) in db.session.query(Rendition.kind).filter_by(content_hash=content_hash)}
+    missing = [encoding for encoding in available_encodings()
+               if ENCODINGS[encoding][0] not in existing]
+    if not missing:
+        return
+
+    with storage.local_copy(storage.blob_key(content_hash)) as src_path:
+        original_size = os.path.getsize(src_path)
+        for encoding in missing:
+            kind, suffix = ENCODINGS[encoding]
+            tmp_path = storage.new_tmp_path()
+            try:
+                COMPRESSORS[encoding](src_path, tmp_path)
+                if os.path.getsize(tmp_path) > original_size * (1 - MIN_SAVING):
+                    continue
+                storage.add_rendition(content_hash, kind,
+                                      storage.rendition_key(content_hash, suffix), tmp_path)
+                db.session.commit()
+            except IntegrityError:
+                # Another worker produced the same variant concurrently
+                db.session.rollback()
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+def negotiate(content_hash, accept_encodings):
+    """Pick a stored pre-compressed variant the client accepts, or None.
+
+    Returns (content_encoding, rendition).
+    """
+    variants = {
+        rendition.kind: rendition
+        for rendition in Rendition.query.filter(
+            Rendition.content_hash == content_hash,
+            Rendition.kind.in_([kind for kind, _ in ENCODINGS.values()])
+        )
+    }
+    if not variants:
+        return None
+
+    offered = [encoding for encoding in ENCODINGS if ENCODINGS[encoding][0] in variants]
+    best = accept_encodings.best_match(offered)
+    if not best:
+        return None
+    return best, variants[ENCODINGS[best][0]]
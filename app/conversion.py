@@ -0,0 +1,46 @@
+import os
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Rendition
+from app import meshes, storage
+
+# Formats the viewer would otherwise have to parse in the browser
+CONVERTIBLE_EXTENSIONS = {'obj', 'stl', 'ply'}
+
+# Formats whose faces are flat facets; smoothing their normals would
+# round off the hard edges the file describes, so their GLBs carry none
+FACETED_EXTENSIONS = {'stl'}
+
+GLB_KIND = 'glb'
+
+def convert_to_glb(content_hash, file_extension):
+    """Pipeline stage: add an indexed, interleaved GLB rendition of a mesh upload.
+
+    Vertex colors and texture coordinates are carried over, so the GLB the
+    viewer gets by default shows what the original does. Idempotent;
+    skipped when the rendition already exists.
+    """
+    if file_extension not in CONVERTIBLE_EXTENSIONS:
+        return
+    if Rendition.query.filter_by(content_hash=content_hash, kind=GLB_KIND).first():
+        return
+
+    with storage.local_copy(storage.blob_key(content_hash)) as src_path:
+        try:
+            mesh = meshes.load_mesh(src_path, file_extension)
+        except meshes.MeshError as e:
+            print(f"⚠️ Skipping GLB conversion of {content_hash}: {e}")
+            return
+
+    tmp_path = storage.new_tmp_path()
+    try:
+        meshes.write_glb(mesh, tmp_path, flat=file_extension in FACETED_EXTENSIONS)
+        storage.add_rendition(content_hash, GLB_KIND,
+                              storage.rendition_key(content_hash, GLB_KIND), tmp_path)
+        db.session.commit()
+    except IntegrityError:
+        # Another worker converted the same blob concurrently
+        db.session.rollback()
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,162 @@
+"""Write-behind download counters.
+
+Downloads are tallied in memory per process and written by a background
+thread every DOWNLOAD_COUNTER_FLUSH_INTERVAL seconds as one
+`UPDATE ... SET downloads = downloads + CASE id WHEN ... END` per batch of
+ids, so a popular model is no longer a hot row committed on every
+request. The same flush appends one row per download to the
+download_event log (see app.analytics). Pending counts are flushed at
+interpreter exit; a hard kill loses at most one interval's worth.
+"""
+import atexit
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from flask import current_app, has_app_context
+from app import db
+
+# Ids updated per UPDATE statement
+FLUSH_BATCH = 500
+
+_buffers_lock = threading.Lock()
+
+class CounterBuffer:
+    """In-process download increments for one app, flushed by a daemon thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.in_flight = Counter()  # taken by a flush that has not committed yet
+        self.events = []  # (model_id, time) of each pending download
+        self.wakeup = threading.Event()
+        self.pid = None
+
+    def add(self, model_ids):
+        config = self.app.config
+        now = datetime.utcnow()
+        with self.lock:
+            if self.pid != os.getpid():
+                self._start()
+            self.pending.update(model_ids)
+            self.events.extend((model_id, now) for model_id in model_ids)
+            backlog = len(self.pending)
+
+        if config['DOWNLOAD_COUNTER_FLUSH_INTERVAL'] <= 0:
+            self.flush()
+        elif backlog >= config['DOWNLOAD_COUNTER_MAX_PENDING']:
+            self.wakeup.set()
+
+    def unflushed(self, model_id):
+        return self.pending.get(model_id, 0) + self.in_flight.get(model_id, 0)
+
+    def total_unflushed(self):
+        return sum(self.pending.values()) + sum(self.in_flight.values())
+
+    def flush(self):
+        """Write pending increments to the database. Returns how many were written"""
+        with self.lock:
+            if not self.pending:
+                return 0
+            deltas, self.pending = self.pending, Counter()
+            events, self.events = self.events, []
+            self.in_flight.update(deltas)
+
+        try:
+            with self.app.app_context():
+                try:
+                    write_deltas(deltas, events)
+                except Exception:
+                    db.session.rollback()
+                    raise
+        except Exception as e:
+            with self.lock:
+                self.pending.update(deltas)
+                self.events[:0] = events
+                self.in_flight.subtract(deltas)
+                self.in_flight += Counter()  # drop zero entries
+            print(f"❌ Download counter flush failed, will retry: {e}")
+            return 0
+
+        with self.lock:
+            self.in_flight.subtract(deltas)
+            self.in_flight += Counter()
+        return sum(deltas.values())
+
+    def _start(self):
+        """Start the flush thread in this process (called with the lock held).
+
+        Counts copied from a parent process by fork belong to the parent.
+        Without an interval every add() flushes, so no thread is needed.
+        """
+        if self.pid is not None:
+            self.pending.clear()
+            self.in_flight.clear()
+            self.events.clear()
+        self.pid = os.getpid()
+        if self.app.config['DOWNLOAD_COUNTER_FLUSH_INTERVAL'] > 0:
+            threading.Thread(target=self._run, name='download-counters', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        interval = self.app.config['DOWNLOAD_COUNTER_FLUSH_INTERVAL']
+        while True:
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+            self.flush()
+
+def write_deltas(deltas, events=None):
+    """Add {model_id: count} to the stored counters, log `events` ((model_id,
+    time) per download; default: each counted now) and commit"""
+    from app import cache, stats
+    from app.models import DownloadEvent, Model3D  # app.models reads unflushed counts from this module
+
+    if events is None:
+        now = datetime.utcnow()
+        events = [(model_id, now) for model_id, count in deltas.items() for _ in range(count)]
+
+    # Sorted ids keep row lock order consistent between processes
+    items = sorted(deltas.items())
+    changed = []
+    for start in range(0, len(items), FLUSH_BATCH):
+        batch = dict(items[start:start + FLUSH_BATCH])
+        Model3D.query.filter(Model3D.id.in_(batch)).update({
+            Model3D.downloads: db.func.coalesce(Model3D.downloads, 0)
+            + db.case(batch, value=Model3D.id, else_=0)
+        }, synchronize_session=False)
+        changed += db.session.query(Model3D.id, Model3D.user_id).filter(Model3D.id.in_(batch)).all()
+    owners = dict(changed)
+    for start in range(0, len(events), FLUSH_BATCH):
+        db.session.execute(DownloadEvent.__table__.insert(), [
+            {'model_id': model_id, 'user_id': owners.get(model_id), 'downloaded_at': when}
+            for model_id, when in events[start:start + FLUSH_BATCH]
+        ])
+    stats.record_downloads(db.session.connection(), sum(deltas.values()))
+    db.session.commit()
+
+    # A bulk UPDATE fires no session hooks; invalidate cached responses here
+    cache.invalidate(*cache.model_tags(changed), cache.STATS)
+
+def get_buffer(app=None):
+    app = app or current_app._get_current_object()
+    buffer = app.extensions.get('download_counters')
+    if buffer is None:
+        with _buffers_lock:
+            buffer = app.extensions.setdefault('download_counters', CounterBuffer(app))
+    return buffer
+
+def record_downloads(model_ids):
+    """Count one download of each model id"""
+    get_buffer().add(model_ids)
+
+def unflushed_downloads(model_id):
+    """Downloads of a model counted by this process but not yet written"""
+    if not has_app_context():
+        return 0
+    return get_buffer().unflushed(model_id)
+
+def total_unflushed_downloads():
+    if not has_app_context():
+        return 0
+    return get_buffer().total_unflushed()
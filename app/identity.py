@@ -0,0 +1,128 @@
+"""Cached identity lookup for Flask-Login's user_loader.
+
+Authenticated requests (every file the 3D viewer fetches, every API
+call) need the logged-in User. Instead of a users-table query per
+request, the user's profile fields are kept for IDENTITY_CACHE_TTL
+seconds in a per-process LRU and, with IDENTITY_IN_SESSION, also in the
+signed session cookie, so a request landing on any worker finds them.
+The User handed to Flask-Login is attached to the session without a
+query; anything beyond the cached fields (password hash, models) is
+loaded on first access as usual.
+
+Committing a change to a user drops its cached identity in this process;
+other processes (and session copies) pick the change up within the TTL.
+"""
+import time
+from datetime import datetime
+from flask import current_app, has_app_context, session
+from flask_login import user_logged_out
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from app import db
+from app.cache import LocalCache
+from app.models import User
+
+# Columns kept in the cache; everything current_user is used for
+FIELDS = ('id', 'username', 'email', 'full_name', 'created_at', 'is_active')
+
+SESSION_KEY = '_identity'
+
+class IdentityCache:
+    """Recently loaded identities of this process"""
+
+    def __init__(self, max_entries, ttl):
+        self.entries = LocalCache(max_entries, ttl)
+        self.ttl = ttl
+        self.changed = {}  # user id -> time of the last committed change
+
+    def is_current(self, user_id, loaded_at):
+        return time.time() - loaded_at < self.ttl and loaded_at > self.changed.get(user_id, 0)
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None or not self.is_current(user_id, entry.value['at']):
+            return None
+        return entry.value
+
+    def set(self, data):
+        self.entries.set(data['id'], data, None)
+
+    def invalidate(self, user_ids):
+        now = time.time()
+        for user_id in user_ids:
+            self.changed[user_id] = now
+        # Only changes newer than any cached entry matter
+        horizon = now - self.ttl
+        if len(self.changed) > 1024:
+            self.changed = {user_id: at for user_id, at in self.changed.items() if at > horizon}
+
+def get_cache():
+    cache = current_app.extensions.get('identity_cache')
+    if cache is None:
+        cache = IdentityCache(current_app.config['IDENTITY_CACHE_MAX_ENTRIES'],
+                              current_app.config['IDENTITY_CACHE_TTL'])
+        current_app.extensions['identity_cache'] = cache
+    return cache
+
+def snapshot(user):
+    data = {field: getattr(user, field) for field in FIELDS}
+    data['created_at'] = user.created_at.isoformat() if user.created_at else None
+    data['at'] = time.time()
+    return data
+
+def restore(data):
+    """A persistent User built from cached fields, without a query"""
+    fields = {field: data[field] for field in FIELDS}
+    if fields['created_at']:
+        fields['created_at'] = datetime.fromisoformat(fields['created_at'])
+    user = User(**fields)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def load_user(user_id, use_session=True):
+    """The User for a session's user id, from the caches when possible"""
+    if current_app.config['IDENTITY_CACHE_TTL'] <= 0:
+        return db.session.get(User, user_id)
+    cache = get_cache()
+
+    use_session = use_session and current_app.config['IDENTITY_IN_SESSION']
+    if use_session:
+        data = session.get(SESSION_KEY)
+        if data and data.get('id') == user_id and cache.is_current(user_id, data.get('at', 0)):
+            return restore(data)
+
+    data = cache.get(user_id)
+    if data is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        data = snapshot(user)
+        cache.set(data)
+    else:
+        user = restore(data)
+
+    if use_session and session.get(SESSION_KEY) != data:
+        session[SESSION_KEY] = data
+    return user
+
+@user_logged_out.connect
+def _forget_session_identity(sender, user=None, **extra):
+    session.pop(SESSION_KEY, None)
+
+# --- invalidation on commit -------------------------------------------------
+
+@event.listens_for(Session, 'after_flush')
+def _collect_users(db_session, flush_context):
+    changed = {obj.id for obj in db_session.dirty | db_session.deleted if isinstance(obj, User)}
+    if changed:
+        db_session.info.setdefault('changed_users', set()).update(changed)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(db_session):
+    changed = db_session.info.pop('changed_users', None)
+    if changed and has_app_context():
+        get_cache().invalidate(changed)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_users(db_session):
+    db_session.info.pop('changed_users', None)
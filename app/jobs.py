@@ -0,0 +1,388 @@
+"""Database-backed job queue.
+
+Requests enqueue rows in the job table and return; `flask worker` claims
+them and runs the handlers on a ProcessPoolExecutor, so CPU-heavy work
+uses every core without holding up web workers. Without a worker
+service, web processes run them from a background thread instead
+(start_inline_runner). Handlers must be idempotent: a job is retried with exponential backoff after a failure,
+and re-run if its worker dies mid-job (stops refreshing heartbeat_at).
+"""
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Job
+
+# Job kind -> callable taking the job's payload as keyword arguments.
+# Filled in by the modules that own the work (see app.pipeline).
+HANDLERS = {}
+
+# Job kind -> config key holding the seconds between runs; the worker
+# queues these itself
+PERIODIC = {}
+
+# How often the worker looks for jobs abandoned by a dead worker and
+# queues due periodic jobs, in seconds
+HOUSEKEEPING_INTERVAL = 60
+
+# How often the worker refreshes heartbeat_at of the jobs it is running,
+# in seconds; keep it well below JOB_TIMEOUT
+HEARTBEAT_INTERVAL = 30
+
+# How often a web process's inline runner looks for queued jobs when no
+# enqueue in the same process woke it, in seconds
+INLINE_POLL_INTERVAL = 5
+
+# Set by enqueue() so this process's inline runner starts at once
+_wakeup = threading.Event()
+
+def register(kind, handler, every=None):
+    HANDLERS[kind] = handler
+    if every:
+        PERIODIC[kind] = every
+
+def parse_concurrency(value):
+    """Parse 'kind=limit,kind=limit' into a dict"""
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            kind, limit = item.split('=', 1)
+            limits[kind.strip()] = int(limit)
+    return limits
+
+def enqueue(kind, dedupe_key=None, **payload):
+    """Queue a job and commit. Returns the Job, or None when a job with the
+    same dedupe_key is still waiting to run."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    if dedupe_key and Job.query.filter_by(dedupe_key=dedupe_key).first():
+        return None
+
+    job = Job(kind=kind,
+              payload=json.dumps(payload),
+              dedupe_key=dedupe_key,
+              max_attempts=current_app.config['JOB_MAX_ATTEMPTS'])
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Lost a race with an identical enqueue
+        db.session.rollback()
+        return None
+    _wakeup.set()
+    return job
+
+def enqueue_many(entries):
+    """Queue (kind, dedupe_key, payload) entries in one transaction and commit.
+
+    Entries whose dedupe_key is already waiting are skipped. Returns the
+    number of jobs queued.
+    """
+    keys = {key for _, key, _ in entries if key}
+    waiting = set()
+    if keys:
+        waiting = {key for (key,) in db.session.query(Job.dedupe_key).filter(Job.dedupe_key.in_(keys))}
+
+    max_attempts = current_app.config['JOB_MAX_ATTEMPTS']
+    queued = []
+    for kind, dedupe_key, payload in entries:
+        if kind not in HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if dedupe_key and dedupe_key in waiting:
+            continue
+        waiting.add(dedupe_key)
+        queued.append(Job(kind=kind, payload=json.dumps(payload),
+                          dedupe_key=dedupe_key, max_attempts=max_attempts))
+
+    db.session.add_all(queued)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent enqueue won some keys; fall back to one at a time
+        db.session.rollback()
+        return sum(enqueue(kind, dedupe_key, **payload) is not None
+                   for kind, dedupe_key, payload in entries)
+    if queued:
+        _wakeup.set()
+    return len(queued)
+
+def claim(kinds, worker_id):
+    """Atomically move one due job of the given kinds to 'running'.
+
+    Candidates are locked with SKIP LOCKED where the database supports it;
+    the conditional UPDATE makes the claim safe everywhere else.
+    """
+    now = datetime.utcnow()
+    candidates = db.session.query(Job.id).filter(
+        Job.state == 'queued',
+        Job.run_after <= now,
+        Job.kind.in_(kinds)
+    ).order_by(Job.run_after, Job.id).limit(10).with_for_update(skip_locked=True).all()
+
+    for (job_id,) in candidates:
+        claimed = Job.query.filter_by(id=job_id, state='queued').update({
+            Job.state: 'running',
+            Job.locked_by: worker_id,
+            Job.started_at: now,
+            Job.heartbeat_at: now,
+            Job.finished_at: None,
+            Job.attempts: Job.attempts + 1,
+            Job.dedupe_key: None,
+        }, synchronize_session=False)
+        if claimed:
+            db.session.commit()
+            return db.session.get(Job, job_id)
+    db.session.commit()
+    return None
+
+def finish(job_id, error=None, worker_id=None):
+    """Record the outcome of an attempt, scheduling a retry if any are left.
+
+    With worker_id, the outcome is dropped if the job is no longer locked
+    by that worker (it was requeued as stale and may run elsewhere).
+    """
+    job = db.session.get(Job, job_id)
+    if worker_id is not None and job.locked_by != worker_id:
+        db.session.commit()
+        return job
+    now = datetime.utcnow()
+    job.finished_at = now
+    job.locked_by = None
+    if error is None:
+        job.state = 'succeeded'
+        job.last_error = None
+    elif job.attempts < job.max_attempts:
+        backoff = current_app.config['JOB_RETRY_BACKOFF'] * 2 ** (job.attempts - 1)
+        job.state = 'queued'
+        job.run_after = now + timedelta(seconds=backoff)
+        job.last_error = error
+    else:
+        job.state = 'failed'
+        job.last_error = error
+    db.session.commit()
+    return job
+
+def heartbeat(job_ids, worker_id):
+    """Mark running jobs as still alive; returns how many this worker holds"""
+    if not job_ids:
+        return 0
+    touched = Job.query.filter(
+        Job.id.in_(job_ids),
+        Job.state == 'running',
+        Job.locked_by == worker_id
+    ).update({Job.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return touched
+
+def requeue_stale():
+    """Return jobs whose worker vanished without reporting back to the queue.
+
+    A running job is stale once its heartbeat is JOB_TIMEOUT seconds old,
+    however long it has been running.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_TIMEOUT'])
+    last_seen = db.func.coalesce(Job.heartbeat_at, Job.started_at)
+    stale = Job.query.filter(Job.state == 'running', last_seen < cutoff).all()
+    for job in stale:
+        finish(job.id, error='Worker stopped responding')
+    return len(stale)
+
+def enqueue_periodic():
+    """Queue each periodic job not queued within its interval"""
+    now = datetime.utcnow()
+    for kind, setting in PERIODIC.items():
+        interval = current_app.config[setting]
+        if interval <= 0:
+            continue
+        recent = Job.query.filter(Job.kind == kind,
+                                  Job.created_at > now - timedelta(seconds=interval)).first()
+        if recent is None:
+            enqueue(kind, dedupe_key=f"periodic:{kind}")
+
+@contextmanager
+def _beating(job_id, worker_id):
+    """Refresh a job's heartbeat from another thread while the block runs"""
+    app = current_app._get_current_object()
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(HEARTBEAT_INTERVAL):
+            with app.app_context():
+                try:
+                    heartbeat([job_id], worker_id)
+                except Exception:
+                    db.session.rollback()
+
+    thread = threading.Thread(target=beat, name=f'heartbeat-{job_id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+def run_due(worker_id, kinds=None):
+    """Claim and run due jobs in this thread until none is left; returns
+    how many ran. Failures are recorded like the worker records them."""
+    ran = 0
+    while True:
+        job = claim(kinds or list(HANDLERS), worker_id)
+        if job is None:
+            return ran
+        try:
+            with _beating(job.id, worker_id):
+                HANDLERS[job.kind](**job.arguments)
+        except Exception as e:
+            db.session.rollback()
+            finish(job.id, error=_describe(e), worker_id=worker_id)
+        else:
+            finish(job.id, worker_id=worker_id)
+        ran += 1
+
+# --- inline runner (INLINE_WORKER) ----------------------------------------
+
+_inline_lock = threading.Lock()
+_inline_pid = None
+
+def start_inline_runner(app):
+    """Run queued jobs from a daemon thread of this web process.
+
+    There may be no `flask worker` at all, yet uploads are processed and
+    expired, statistics reconciled and analytics rolled up by jobs. Each
+    process (also after a fork) starts one thread that runs whatever is
+    due as soon as the process queues something, or every
+    INLINE_POLL_INTERVAL, and does the worker's housekeeping every
+    HOUSEKEEPING_INTERVAL; claims are atomic, so processes share the work.
+    Requests never wait for the jobs.
+    """
+    global _inline_pid
+    if _inline_pid == os.getpid():
+        return
+    with _inline_lock:
+        if _inline_pid == os.getpid():
+            return
+        _inline_pid = os.getpid()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:inline"
+
+    def loop():
+        last_housekeeping = None
+        while True:
+            _wakeup.wait(INLINE_POLL_INTERVAL)
+            _wakeup.clear()
+            with app.app_context():
+                try:
+                    if (last_housekeeping is None
+                            or time.monotonic() - last_housekeeping > HOUSEKEEPING_INTERVAL):
+                        requeue_stale()
+                        enqueue_periodic()
+                        last_housekeeping = time.monotonic()
+                    run_due(worker_id)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Inline job runner failed, will retry: {e}")
+
+    threading.Thread(target=loop, name='inline-jobs', daemon=True).start()
+
+# --- process pool side ----------------------------------------------------
+
+_worker_app = None
+
+def _init_process():
+    """Give every pool process its own app and database connections"""
+    global _worker_app
+    from app import create_app
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent decides when to stop
+    _worker_app = create_app()
+
+def _execute(job_id):
+    with _worker_app.app_context():
+        job = db.session.get(Job, job_id)
+        HANDLERS[job.kind](**job.arguments)
+
+def _describe(error):
+    return ''.join(traceback.format_exception(type(error), error, error.__traceback__))[-4000:]
+
+def run_worker(processes, concurrency, poll_interval=1.0, burst=False):
+    """Claim and run jobs until stopped (or, with burst, until the queue is empty).
+
+    At most `processes` jobs run at once, and at most concurrency[kind]
+    of a given kind. SIGTERM/SIGINT stop claiming and let running jobs
+    finish.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = []
+
+    def stop(signum, frame):
+        if not stopping:
+            print(f"🛑 Worker {worker_id} stopping after running jobs finish")
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    requeue_stale()
+    enqueue_periodic()
+    last_housekeeping = last_heartbeat = time.monotonic()
+    pool = ProcessPoolExecutor(max_workers=processes, initializer=_init_process)
+    running = {}  # future -> (job id, kind)
+    print(f"👷 Worker {worker_id} running {processes} processes for {sorted(HANDLERS)}")
+
+    try:
+        while running or not stopping:
+            busy = Counter(kind for _, kind in running.values())
+            while not stopping and len(running) < processes:
+                kinds = [kind for kind in HANDLERS
+                         if busy[kind] < concurrency.get(kind, processes)]
+                job = claim(kinds, worker_id) if kinds else None
+                if job is None:
+                    break
+                running[pool.submit(_execute, job.id)] = (job.id, job.kind)
+                busy[job.kind] += 1
+
+            if not running:
+                if burst:
+                    break
+                time.sleep(poll_interval)
+            else:
+                done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id, kind = running.pop(future)
+                    error = future.exception()
+                    job = finish(job_id, None if error is None else _describe(error),
+                                 worker_id=worker_id)
+                    if error is None:
+                        print(f"✅ Job {job_id} ({kind}) succeeded")
+                    else:
+                        print(f"❌ Job {job_id} ({kind}) failed, attempt {job.attempts}: {error}")
+                    if isinstance(error, BrokenProcessPool):
+                        # A process died hard; every in-flight job is lost with it
+                        for lost_id, _ in running.values():
+                            finish(lost_id, error='Worker process pool broke',
+                                   worker_id=worker_id)
+                        running.clear()
+                        pool.shutdown(wait=False)
+                        pool = ProcessPoolExecutor(max_workers=processes,
+                                                   initializer=_init_process)
+                        break
+
+            if running and time.monotonic() - last_heartbeat > HEARTBEAT_INTERVAL:
+                heartbeat([job_id for job_id, _ in running.values()], worker_id)
+                last_heartbeat = time.monotonic()
+
+            if time.monotonic() - last_housekeeping > HOUSEKEEPING_INTERVAL:
+                requeue_stale()
+                enqueue_periodic()
+                last_housekeeping = time.monotonic()
+    finally:
+        pool.shutdown(wait=True)
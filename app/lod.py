@@ -0,0 +1,196 @@
+"""Level-of-detail renditions for the web viewer.
+
+Meshes are simplified by quadric-error vertex clustering: vertices are
+snapped to a uniform grid, each cell collapses to the point minimising
+the summed plane quadrics of its faces, and faces that collapse are
+dropped. Everything is a handful of NumPy passes over the face array, so
+multi-million triangle scans simplify in seconds without a priority queue.
+"""
+import os
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Rendition
+from app import meshes, storage
+from app.conversion import FACETED_EXTENSIONS, GLB_KIND
+
+# Rendition kind -> fraction of the original face count to aim for
+LOD_LEVELS = (
+    ('lod1', 0.25),
+    ('lod2', 0.05),
+)
+
+# Meshes at or below this many faces are light enough to view as they are
+MIN_LOD_FACES = 10000
+
+# Never simplify below this many faces
+MIN_TARGET_FACES = 1000
+
+# Grid refinement passes used to approach the target face count
+SEARCH_STEPS = 6
+
+def lod_kind(level):
+    """Rendition kind for a ?lod= level; level 0 is the full-resolution mesh"""
+    return f"lod{level}"
+
+def cluster_ids(positions, lo, cell_size, cells):
+    """Grid cell of every vertex, renumbered to 0..n_clusters-1"""
+    cell = np.floor((positions - lo) / cell_size).astype(np.int64)
+    np.clip(cell, 0, cells - 1, out=cell)
+    flat = (cell[:, 0] * cells + cell[:, 1]) * cells + cell[:, 2]
+    _, ids = np.unique(flat, return_inverse=True)
+    return ids.ravel()
+
+def collapse_faces(faces, ids):
+    """Faces re-indexed onto clusters, minus degenerate and duplicate ones"""
+    faces = ids[faces]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2])
+                  & (faces[:, 0] != faces[:, 2])]
+    if not len(faces):
+        return faces
+    _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    return faces[np.sort(first)]
+
+def face_quadrics(positions, faces):
+    """Area-weighted plane quadric of every face, as the 10 unique entries of
+    the symmetric 4x4 matrix (aa, ab, ac, ad, bb, bc, bd, cc, cd, dd)"""
+    corners = positions[faces].astype(np.float64)
+    cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    double_area = np.linalg.norm(cross, axis=1)
+    normals = cross / np.maximum(double_area, 1e-30)[:, None]
+    d = -np.einsum('ij,ij->i', normals, corners[:, 0])
+    a, b, c = normals.T
+    weight = 0.5 * double_area
+    return np.stack([a * a, a * b, a * c, a * d, b * b, b * c, b * d,
+                     c * c, c * d, d * d], axis=1) * weight[:, None]
+
+def cluster_means(values, ids, n_clusters):
+    """Mean of a per-vertex attribute (N, k) over each cluster's vertices"""
+    counts = np.bincount(ids, minlength=n_clusters).astype(np.float64)
+    sums = np.stack([np.bincount(ids, weights=values[:, axis], minlength=n_clusters)
+                     for axis in range(values.shape[1])], axis=1)
+    return sums / np.maximum(counts, 1)[:, None]
+
+def place_clusters(positions, faces, ids, n_clusters, lo, cell_size):
+    """Position of every cluster: the quadric minimiser when it is well
+    conditioned and stays near its cell, the vertex mean otherwise"""
+    mean = cluster_means(positions, ids, n_clusters)
+
+    quadrics = face_quadrics(positions, faces)
+    corner_ids = ids[faces]
+    q = np.stack([
+        sum(np.bincount(corner_ids[:, corner], weights=quadrics[:, entry],
+                        minlength=n_clusters) for corner in range(3))
+        for entry in range(10)
+    ], axis=1)
+
+    a = np.empty((n_clusters, 3, 3))
+    a[:, 0, 0], a[:, 0, 1], a[:, 0, 2] = q[:, 0], q[:, 1], q[:, 2]
+    a[:, 1, 0], a[:, 1, 1], a[:, 1, 2] = q[:, 1], q[:, 4], q[:, 5]
+    a[:, 2, 0], a[:, 2, 1], a[:, 2, 2] = q[:, 2], q[:, 5], q[:, 7]
+    b = -q[:, [3, 6, 8]]
+
+    # Solve around the mean so flat or ridge-like cells (singular A) have a
+    # bounded correction instead of exploding
+    scale = np.maximum(np.abs(a).max(axis=(1, 2)), 1e-30)
+    regularised = a + (scale * 1e-3)[:, None, None] * np.eye(3)
+    rhs = b - np.einsum('nij,nj->ni', a, mean)
+    optimal = mean + np.linalg.solve(regularised, rhs[..., None])[..., 0]
+
+    near = np.all(np.abs(optimal - mean) <= cell_size, axis=1) & np.isfinite(optimal).all(axis=1)
+    return np.where(near[:, None], optimal, mean)
+
+def simplify(mesh, target_faces):
+    """Return a Mesh with roughly target_faces triangles; vertex colors and
+    texture coordinates are averaged over each cluster like positions"""
+    positions = mesh.positions.astype(np.float64)
+    faces = mesh.faces
+    lo = positions.min(axis=0)
+    extent = float((positions.max(axis=0) - lo).max()) or 1.0
+
+    # Surface meshes keep roughly 2 faces per occupied cell of a c^3 grid
+    # on c^2 of its cells, so start from that and refine the resolution.
+    cells = max(int(np.sqrt(target_faces / 2.0)), 2)
+    best = None
+    for _ in range(SEARCH_STEPS):
+        cell_size = extent / cells
+        ids = cluster_ids(positions, lo, cell_size, cells)
+        collapsed = collapse_faces(faces, ids)
+        if len(collapsed) <= target_faces * 1.1:
+            if best is None or len(collapsed) > len(best[1]):
+                best = (ids, collapsed, cell_size)
+            if len(collapsed) >= target_faces * 0.9:
+                break
+        ratio = target_faces / max(len(collapsed), 1)
+        cells = max(int(cells * np.sqrt(ratio) * 0.98), 2) if ratio < 1 else int(cells * np.sqrt(ratio)) + 1
+
+    if best is None:
+        best = (ids, collapsed, cell_size)
+    ids, collapsed, cell_size = best
+    n_clusters = int(ids.max()) + 1
+    placed = place_clusters(positions, faces, ids, n_clusters, lo, cell_size)
+    colors, uvs = (None if values is None else
+                   cluster_means(values.astype(np.float64), ids, n_clusters).astype(np.float32)
+                   for values in (mesh.colors, mesh.uvs))
+    return meshes.compact(meshes.Mesh(placed.astype(np.float32), collapsed, colors, uvs))
+
+def generate_lods(content_hash, file_extension):
+    """Pipeline stage: add decimated GLB renditions for meshes too heavy to
+    preview at full resolution.
+
+    Idempotent; levels that already exist are skipped.
+    """
+    if file_extension not in meshes.MESH_EXTENSIONS:
+        return
+
+    existing = {kind for (kind,) in db.session.query(Rendition.kind).filter_by(content_hash=content_hash)}
+    missing = [(kind, ratio) for kind, ratio in LOD_LEVELS if kind not in existing]
+    if not missing:
+        return
+
+    with storage.local_copy(storage.blob_key(content_hash)) as src_path:
+        try:
+            mesh = meshes.compact(meshes.load_mesh(src_path, file_extension))
+        except meshes.MeshError as e:
+            print(f"⚠️ Skipping LOD generation of {content_hash}: {e}")
+            return
+
+    face_count = len(mesh.faces)
+    if face_count <= MIN_LOD_FACES:
+        return
+
+    for kind, ratio in missing:
+        target = max(int(face_count * ratio), MIN_TARGET_FACES)
+        tmp_path = storage.new_tmp_path()
+        try:
+            meshes.write_glb(simplify(mesh, target), tmp_path,
+                             flat=file_extension in FACETED_EXTENSIONS)
+            storage.add_rendition(content_hash, kind,
+                                  storage.rendition_key(content_hash, f"{kind}.glb"), tmp_path)
+            db.session.commit()
+        except meshes.MeshError as e:
+            print(f"⚠️ Skipping {kind} of {content_hash}: {e}")
+        except IntegrityError:
+            # Another worker produced the same level concurrently
+            db.session.rollback()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def pick_rendition(content_hash, level):
+    """Stored rendition for a ?lod= level, falling back to finer levels.
+
+    Level 0 is the converted GLB; levels past the coarsest one are served
+    the coarsest. Returns None when only the original upload is stored.
+    """
+    level = min(level, len(LOD_LEVELS))
+    kinds = [lod_kind(n) for n in range(level, 0, -1)] + [GLB_KIND]
+    renditions = {
+        rendition.kind: rendition
+        for rendition in Rendition.query.filter(Rendition.content_hash == content_hash,
+                                                Rendition.kind.in_(kinds))
+    }
+    for kind in kinds:
+        if kind in renditions:
+            return renditions[kind]
+    return None
@@ -1,28 +1,42 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from functools import partial
+from flask import Blueprint, render_template, request, redirect, url_for, flash, make_response, session
 from flask_login import login_required, current_user
 from app import db
+from app import analytics, cache, pagination
+from app import search as search_index
+from app import stats
 from app.models import Model3D, User
 
 main_bp = Blueprint('main', __name__)
 
+def cacheable_page():
+    """Pages are cached as rendered HTML for anonymous visitors only; anyone
+    else sees their own name and flashed messages"""
+    return not current_user.is_authenticated and '_flashes' not in session
+
+def render_index():
+    # Get recent public models
+    recent_models = Model3D.query.options(db.joinedload(Model3D.owner)).filter_by(is_public=True).order_by(Model3D.upload_date.desc()).limit(6).all()
+    catalog = stats.snapshot(days=1)
+    return render_template('index.html', 
+                         recent_models=recent_models,
+                         total_models=catalog['total_models'],
+                         total_users=catalog['total_users'])
+
 @main_bp.route('/')
 def index():
     try:
-        # Get recent public models with error handling
-        recent_models = Model3D.query.filter_by(is_public=True).order_by(Model3D.upload_date.desc()).limit(6).all()
-        total_models = Model3D.query.filter_by(is_public=True).count()
-        total_users = User.query.count()
+        if cacheable_page():
+            html, source = cache.fetch('index:', [cache.PUBLIC, cache.STATS], render_index)
+            return cache.mark(make_response(html), source)
+        return render_index()
     except Exception as e:
         print(f"Index page error: {e}")
         # Fallback values if database query fails
-        recent_models = []
-        total_models = 0
-        total_users = 0
-    
-    return render_template('index.html', 
-                         recent_models=recent_models,
-                         total_models=total_models,
-                         total_users=total_users)
+        return render_template('index.html', 
+                             recent_models=[],
+                             total_models=0,
+                             total_users=0)
 
 @main_bp.route('/dashboard')
 @login_required
@@ -30,7 +44,7 @@ def dashboard():
     """Simplified dashboard route"""
     try:
         user_models = Model3D.query.filter_by(user_id=current_user.id).order_by(Model3D.upload_date.desc()).all()
-        total_downloads = sum(model.downloads for model in user_models) if user_models else 0
+        total_downloads = analytics.user_download_total(current_user.id)
         
         return render_template('dashboard.html', 
                              user_models=user_models,
@@ -42,48 +56,41 @@ def dashboard():
                              total_downloads=0,
                              error=str(e))
 
+def render_browse(search, cursor):
+    # Very simple query without complex filtering
+    models_query = Model3D.query.options(db.joinedload(Model3D.owner)).filter_by(is_public=True)
+    
+    # Full-text search, best matches first
+    models_query, rank = search_index.match(models_query, search)
+    sort = 'relevance' if rank is not None else '-upload_date'
+    
+    # One page after the cursor; no OFFSET or COUNT(*) however deep
+    models = pagination.cursor_page(models_query, sort, rank, cursor=cursor, per_page=12)
+    
+    return render_template('browse.html', models=models, search=search)
+
 @main_bp.route('/browse')
 def browse():
     """Simplified browse route with minimal complexity"""
     try:
         # Get search parameter
         search = request.args.get('search', '')
-        page = request.args.get('page', 1, type=int)
-        
-        # Very simple query without complex filtering
-        models_query = Model3D.query.filter_by(is_public=True)
-        
-        # Apply search only if provided and not empty
-        if search and search.strip():
-            search_term = f'%{search}%'
-            models_query = models_query.filter(
-                Model3D.name.ilike(search_term)
-            )
-        
-        # Get models with simple pagination
-        models = models_query.order_by(Model3D.upload_date.desc()).paginate(
-            page=page, 
-            per_page=12, 
-            error_out=False
-        )
+        cursor = request.args.get('cursor')
         
-        # Render template with error handling
-        return render_template('browse.html', models=models, search=search)
+        try:
+            if cacheable_page():
+                key = cache.request_key('browse', 'public', {'search': search, 'cursor': cursor or ''})
+                html, source = cache.fetch(key, [cache.PUBLIC], partial(render_browse, search, cursor))
+                return cache.mark(make_response(html), source)
+            return render_browse(search, cursor)
+        except pagination.CursorError:
+            return redirect(url_for('main.browse', search=search or None))
         
     except Exception as e:
         # If anything fails, show empty browse page
         print(f"Browse error: {e}")
-        # Create empty pagination manually
-        class EmptyPagination:
-            items = []
-            pages = 0
-            page = 1
-            total = 0
-            has_prev = False
-            has_next = False
-            per_page = 12
-            
-        empty_models = EmptyPagination()
+        # Empty page
+        empty_models = pagination.CursorPage(items=[], next_cursor=None)
         return render_template('browse.html', models=empty_models, search='', error=f"Database error: {str(e)}")
 
 @main_bp.route('/model/<int:model_id>')
@@ -142,7 +149,7 @@ def profile():
     """User profile page with error handling"""
     try:
         user_models = Model3D.query.filter_by(user_id=current_user.id).order_by(Model3D.upload_date.desc()).all()
-        total_downloads = sum(model.downloads for model in user_models) if user_models else 0
+        total_downloads = analytics.user_download_total(current_user.id)
         
         return render_template('profile.html', 
                              user_models=user_models,
@@ -0,0 +1,524 @@
+"""NumPy mesh readers for STL, OBJ, PLY and GLB, and a GLB writer.
+
+Parsers return a Mesh of float32 positions (N, 3) and int64 triangle
+indices (M, 3), plus per-vertex float32 colors (N, 3|4) and texture
+coordinates (N, 2, glTF orientation) when the file has them for every
+vertex. Binary formats are read through a memory map so files larger
+than RAM only touch the pages they need.
+"""
+import json
+import re
+import struct
+import warnings
+from collections import namedtuple
+import numpy as np
+
+Mesh = namedtuple('Mesh', ['positions', 'faces', 'colors', 'uvs'], defaults=(None, None))
+
+class MeshError(ValueError):
+    """Raised when a file cannot be parsed as a triangle mesh"""
+
+MESH_EXTENSIONS = {'stl', 'obj', 'ply', 'glb'}
+
+def load_mesh(file_path, file_extension):
+    """Parse a mesh file into a Mesh.
+
+    Any malformed input (bad numbers, truncated data, indices outside the
+    vertex list) raises MeshError.
+    """
+    readers = {
+        'stl': read_stl,
+        'obj': read_obj,
+        'ply': read_ply,
+        'glb': read_glb,
+    }
+    if file_extension not in readers:
+        raise MeshError(f"Unsupported mesh format: {file_extension}")
+    try:
+        mesh = readers[file_extension](file_path)
+    except MeshError:
+        raise
+    except (ValueError, IndexError, KeyError, TypeError, struct.error) as e:
+        raise MeshError(f"Malformed {file_extension.upper()} file: {e}") from e
+    check_indices(mesh.faces, len(mesh.positions), 'Face')
+    return mesh
+
+def check_indices(indices, count, what):
+    """Raise MeshError unless every index addresses one of count items"""
+    if len(indices) and (indices.min() < 0 or indices.max() >= count):
+        raise MeshError(f"{what} index out of range (the file has {count} vertices)")
+
+def _map(file_path):
+    """Read-only memory map of a whole file (empty files give an empty array)"""
+    try:
+        return np.memmap(file_path, dtype=np.uint8, mode='r')
+    except ValueError:
+        return np.zeros(0, dtype=np.uint8)
+
+def _numbers(chunks, dtype):
+    """Parse whitespace-separated numbers from a list of byte strings"""
+    with warnings.catch_warnings():
+        # NumPy stops at the first token it cannot parse and only warns
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(b' '.join(chunks), dtype=dtype, sep=' ')
+        except (DeprecationWarning, ValueError):
+            raise MeshError('Malformed number in mesh file')
+
+def _subset(mesh, index, faces):
+    """Mesh of the vertices at index (with their colors and uvs) and faces"""
+    return Mesh(mesh.positions[index], faces,
+                None if mesh.colors is None else mesh.colors[index],
+                None if mesh.uvs is None else mesh.uvs[index])
+
+# --- STL -----------------------------------------------------------------
+
+STL_TRIANGLE = np.dtype([
+    ('normal', '<f4', 3),
+    ('vertices', '<f4', (3, 3)),
+    ('attributes', '<u2'),
+])
+
+def is_binary_stl(data):
+    if len(data) < 84:
+        return False
+    count = int(np.frombuffer(data[80:84], dtype='<u4')[0])
+    return len(data) == 84 + count * STL_TRIANGLE.itemsize
+
+def stl_triangles(file_path):
+    """Return the (M, 3, 3) triangle corner array of a binary or ASCII STL"""
+    data = _map(file_path)
+    if is_binary_stl(data):
+        records = np.frombuffer(data, dtype=STL_TRIANGLE, offset=84)
+        return records['vertices']
+
+    coords = re.findall(rb'vertex\s+(\S+\s+\S+\s+\S+)', bytes(data))
+    if not coords or len(coords) % 3:
+        raise MeshError('No triangles found in STL file')
+    return _numbers(coords, np.float32).reshape(-1, 3, 3)
+
+def read_stl(file_path):
+    return weld(stl_triangles(file_path).reshape(-1, 3))
+
+def weld(corners):
+    """Deduplicate repeated corner positions into an indexed mesh"""
+    corners = np.ascontiguousarray(corners, dtype=np.float32) + np.float32(0.0)  # -0.0 -> 0.0
+    rows = corners.view(np.dtype((np.void, corners.dtype.itemsize * 3))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return Mesh(corners[first], inverse.reshape(-1, 3).astype(np.int64))
+
+# --- polygon helpers ------------------------------------------------------
+
+def triangulate(indices, counts):
+    """Fan-triangulate polygons given flat vertex indices and per-polygon sizes"""
+    counts = np.asarray(counts, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.int64)
+    keep = counts >= 3
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[keep]
+    counts = counts[keep]
+    if not len(counts):
+        return np.zeros((0, 3), dtype=np.int64)
+
+    fan_sizes = counts - 2
+    polygon = np.repeat(np.arange(len(counts)), fan_sizes)
+    offsets = np.arange(fan_sizes.sum()) - np.repeat(np.cumsum(fan_sizes) - fan_sizes, fan_sizes)
+    first = starts[polygon]
+    return np.stack([
+        indices[first],
+        indices[first + offsets + 1],
+        indices[first + offsets + 2],
+    ], axis=1)
+
+# --- OBJ -----------------------------------------------------------------
+
+def read_obj(file_path):
+    text = bytes(_map(file_path))
+
+    coords = re.findall(rb'^v[ \t]+(\S+[ \t]+\S+[ \t]+\S+)', text, re.M)
+    if not coords:
+        raise MeshError('No vertices found in OBJ file')
+    positions = _numbers(coords, np.float32).reshape(-1, 3)
+
+    # 'v x y z r g b' on every vertex carries colors
+    colors = None
+    colored = re.findall(rb'^v((?:[ \t]+\S+){6})[ \t]*\r?$', text, re.M)
+    if len(colored) == len(coords):
+        colors = _numbers(colored, np.float32).reshape(-1, 6)[:, 3:]
+
+    face_lines = re.findall(rb'^f[ \t]+([^\r\n]+)', text, re.M)
+    if not face_lines:
+        raise MeshError('No faces found in OBJ file')
+
+    # Position index of each v/vt/vn corner
+    block = b'\n'.join(face_lines)
+    position_block = re.sub(rb'/\S*', b'', block)
+    counts = np.fromiter((len(line.split()) for line in position_block.split(b'\n')),
+                         dtype=np.int64, count=len(face_lines))
+    indices = _obj_indices(position_block, len(positions), 'Vertex')
+    mesh = Mesh(positions, triangulate(indices, counts), colors)
+
+    texcoords = re.findall(rb'^vt[ \t]+(\S+[ \t]+\S+)', text, re.M)
+    if not texcoords:
+        return mesh
+
+    # Texture index of each corner; used only when every corner has one
+    uv_block = re.sub(rb'(?<!\S)[^/\s]*/?([^/\s]*)\S*', rb'\1', block)
+    uv_indices = _obj_indices(uv_block, len(texcoords), 'Texture coordinate')
+    if len(uv_indices) != len(indices):
+        return mesh
+
+    # glTF has one index per corner: split vertices used with several uvs
+    uvs = _numbers(texcoords, np.float32).reshape(-1, 2)
+    uvs[:, 1] = 1.0 - uvs[:, 1]  # OBJ puts v=0 at the bottom, glTF at the top
+    pairs, corners = np.unique(np.stack([indices, uv_indices], axis=1), axis=0,
+                               return_inverse=True)
+    return Mesh(positions[pairs[:, 0]], triangulate(corners.ravel(), counts),
+                None if colors is None else colors[pairs[:, 0]], uvs[pairs[:, 1]])
+
+def _obj_indices(block, count, what):
+    """0-based indices from 1-based (or negative, from the end) OBJ ones"""
+    indices = _numbers([block], np.int64)
+    indices = np.where(indices > 0, indices - 1, indices + count)
+    check_indices(indices, count, what)
+    return indices
+
+# --- PLY -----------------------------------------------------------------
+
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+def parse_ply_header(data):
+    """Return (format, elements, body offset); elements are (name, count, properties)"""
+    end = bytes(data[:65536]).find(b'end_header')
+    if not bytes(data[:3]) == b'ply' or end < 0:
+        raise MeshError('Not a PLY file')
+    newline = bytes(data[end:end + 64]).find(b'\n')
+    header = bytes(data[:end]).decode('ascii', 'replace').splitlines()
+
+    fmt = None
+    elements = []
+    for line in header:
+        parts = line.split()
+        if not parts:
+            continue
+        if parts[0] == 'format':
+            fmt = parts[1]
+        elif parts[0] == 'element':
+            elements.append((parts[1], int(parts[2]), []))
+        elif parts[0] == 'property' and elements:
+            if parts[1] == 'list':
+                elements[-1][2].append((parts[4], 'list', PLY_TYPES[parts[2]], PLY_TYPES[parts[3]]))
+            else:
+                elements[-1][2].append((parts[2], PLY_TYPES[parts[1]]))
+    return fmt, elements, end + newline + 1
+
+def read_ply(file_path):
+    data = _map(file_path)
+    fmt, elements, offset = parse_ply_header(data)
+    if fmt == 'ascii':
+        return _read_ply_ascii(data, elements, offset)
+    if fmt not in ('binary_little_endian', 'binary_big_endian'):
+        raise MeshError(f"Unsupported PLY format: {fmt}")
+    return _read_ply_binary(data, elements, offset, '<' if fmt == 'binary_little_endian' else '>')
+
+def _ply_positions(vertex_columns):
+    try:
+        return np.stack([vertex_columns['x'], vertex_columns['y'], vertex_columns['z']],
+                        axis=1).astype(np.float32)
+    except (KeyError, ValueError):
+        raise MeshError('PLY vertices have no x/y/z properties')
+
+def _ply_attributes(vertex_columns, properties):
+    """(colors, uvs) of the vertex element, each None when absent"""
+    types = dict(prop[:2] for prop in properties if len(prop) == 2)
+    colors = uvs = None
+
+    channels = [name for name in ('red', 'green', 'blue', 'alpha') if name in types]
+    if channels[:3] == ['red', 'green', 'blue']:
+        colors = np.stack([vertex_columns[name] for name in channels], axis=1).astype(np.float32)
+        if types['red'][0] in 'iu':  # integer channels span the type's range
+            colors /= np.iinfo(types['red']).max
+
+    for u, v in (('u', 'v'), ('s', 't'), ('texture_u', 'texture_v')):
+        if u in types and v in types:
+            uvs = np.stack([vertex_columns[u], 1.0 - vertex_columns[v]], axis=1).astype(np.float32)
+            break
+    return colors, uvs
+
+def _read_ply_binary(data, elements, offset, endian):
+    positions = None
+    colors = uvs = None
+    faces = np.zeros((0, 3), dtype=np.int64)
+
+    for name, count, properties in elements:
+        if all(len(prop) == 2 for prop in properties):
+            dtype = np.dtype([(prop[0], endian + prop[1]) for prop in properties])
+            records = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += dtype.itemsize * count
+            if name == 'vertex':
+                positions = _ply_positions(records)
+                colors, uvs = _ply_attributes(records, properties)
+            continue
+
+        if name != 'face' or len(properties) != 1:
+            # Lists elsewhere have variable size; nothing after them can be located
+            break
+
+        _, _, count_type, index_type = properties[0]
+        count_dtype = np.dtype(endian + count_type)
+        index_dtype = np.dtype(endian + index_type)
+
+        # Fast path: every face is a triangle, so records have a fixed size
+        tri_dtype = np.dtype([('n', count_dtype), ('i', index_dtype, 3)])
+        if len(data) - offset >= tri_dtype.itemsize * count:
+            records = np.frombuffer(data, dtype=tri_dtype, count=count, offset=offset)
+            if np.all(records['n'] == 3):
+                faces = records['i'].astype(np.int64)
+                offset += tri_dtype.itemsize * count
+                continue
+
+        counts = np.empty(count, dtype=np.int64)
+        indices = []
+        for face in range(count):
+            n = int(np.frombuffer(data, dtype=count_dtype, count=1, offset=offset)[0])
+            offset += count_dtype.itemsize
+            indices.append(np.frombuffer(data, dtype=index_dtype, count=n, offset=offset))
+            offset += index_dtype.itemsize * n
+            counts[face] = n
+        faces = triangulate(np.concatenate(indices) if indices else [], counts)
+
+    if positions is None:
+        raise MeshError('PLY file has no vertex element')
+    return Mesh(positions, faces, colors, uvs)
+
+def _read_ply_ascii(data, elements, offset):
+    lines = bytes(data[offset:]).splitlines()
+    positions = None
+    colors = uvs = None
+    faces = np.zeros((0, 3), dtype=np.int64)
+    cursor = 0
+
+    for name, count, properties in elements:
+        block = lines[cursor:cursor + count]
+        cursor += count
+        if name == 'vertex':
+            names = [prop[0] for prop in properties]
+            table = _numbers(block, np.float64).reshape(count, len(names))
+            columns = {n: table[:, i] for i, n in enumerate(names)}
+            positions = _ply_positions(columns)
+            colors, uvs = _ply_attributes(columns, properties)
+        elif name == 'face':
+            rows = [line.split() for line in block]
+            counts = np.fromiter((int(row[0]) for row in rows), dtype=np.int64, count=count)
+            indices = np.array([value for row in rows for value in row[1:int(row[0]) + 1]],
+                               dtype=np.int64)
+            faces = triangulate(indices, counts)
+
+    if positions is None:
+        raise MeshError('PLY file has no vertex element')
+    return Mesh(positions, faces, colors, uvs)
+
+# --- GLB -----------------------------------------------------------------
+
+GLB_MAGIC = 0x46546C67
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+COMPONENT_TYPES = {
+    5121: np.uint8, 5123: np.uint16, 5125: np.uint32, 5126: np.float32,
+    5120: np.int8, 5122: np.int16,
+}
+TYPE_SIZES = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4}
+
+def read_glb_container(file_path):
+    """Return (gltf JSON dict, BIN chunk array) of a GLB file"""
+    data = _map(file_path)
+    if len(data) < 20:
+        raise MeshError('Not a GLB file')
+    magic, _, _ = struct.unpack('<III', bytes(data[:12]))
+    if magic != GLB_MAGIC:
+        raise MeshError('Not a GLB file')
+
+    json_length, json_type = struct.unpack('<II', bytes(data[12:20]))
+    if json_type != CHUNK_JSON:
+        raise MeshError('GLB file does not start with a JSON chunk')
+    gltf = json.loads(bytes(data[20:20 + json_length]))
+
+    binary = np.zeros(0, dtype=np.uint8)
+    bin_offset = 20 + json_length
+    if len(data) >= bin_offset + 8:
+        bin_length, bin_type = struct.unpack('<II', bytes(data[bin_offset:bin_offset + 8]))
+        if bin_type == CHUNK_BIN:
+            binary = data[bin_offset + 8:bin_offset + 8 + bin_length]
+    return gltf, binary
+
+def _accessor(gltf, binary, index):
+    accessor = gltf['accessors'][index]
+    view = gltf['bufferViews'][accessor['bufferView']]
+    dtype = np.dtype(COMPONENT_TYPES[accessor['componentType']])
+    width = TYPE_SIZES[accessor['type']]
+    start = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+    stride = view.get('byteStride') or dtype.itemsize * width
+    count = accessor['count']
+
+    if stride == dtype.itemsize * width:
+        return np.frombuffer(binary, dtype=dtype, count=count * width, offset=start).reshape(count, width)
+    return np.lib.stride_tricks.as_strided(
+        np.frombuffer(binary, dtype=dtype, offset=start),
+        shape=(count, width), strides=(stride, dtype.itemsize)
+    )
+
+def _float_accessor(gltf, binary, index):
+    """Accessor values as float32, integer components read as normalized"""
+    values = _accessor(gltf, binary, index)
+    if values.dtype.kind in 'iu':
+        return values.astype(np.float32) / np.iinfo(values.dtype).max
+    return values.astype(np.float32)
+
+def read_glb(file_path):
+    """Merge every triangle primitive of a GLB (node transforms are ignored).
+
+    COLOR_0 and TEXCOORD_0 are kept when every primitive has them.
+    """
+    gltf, binary = read_glb_container(file_path)
+    positions, faces, colors, uvs = [], [], [], []
+    base = 0
+    for mesh in gltf.get('meshes', []):
+        for primitive in mesh.get('primitives', []):
+            attributes = primitive.get('attributes', {})
+            if primitive.get('mode', 4) != 4 or 'POSITION' not in attributes:
+                continue
+            points = _accessor(gltf, binary, attributes['POSITION']).astype(np.float32)
+            if 'indices' in primitive:
+                tris = _accessor(gltf, binary, primitive['indices']).astype(np.int64).reshape(-1, 3)
+                check_indices(tris, len(points), 'Face')
+            else:
+                tris = np.arange(len(points) - len(points) % 3, dtype=np.int64).reshape(-1, 3)
+            positions.append(points)
+            faces.append(tris + base)
+            base += len(points)
+            if 'COLOR_0' in attributes:
+                colors.append(_float_accessor(gltf, binary, attributes['COLOR_0']))
+            if 'TEXCOORD_0' in attributes:
+                uvs.append(_float_accessor(gltf, binary, attributes['TEXCOORD_0']))
+
+    if not positions:
+        raise MeshError('GLB file contains no triangle meshes (Draco/extensions are not supported)')
+    complete_colors = (len(colors) == len(positions)
+                       and len({color.shape[1] for color in colors}) == 1)
+    return Mesh(np.concatenate(positions), np.concatenate(faces),
+                np.concatenate(colors) if complete_colors else None,
+                np.concatenate(uvs) if len(uvs) == len(positions) else None)
+
+# --- geometry helpers -----------------------------------------------------
+
+def face_normals(mesh):
+    """Unnormalized face normals; their length is twice the triangle area"""
+    corners = mesh.positions[mesh.faces]
+    return np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+def vertex_normals(mesh):
+    """Area-weighted, normalized per-vertex normals"""
+    normals = np.zeros(mesh.positions.shape, dtype=np.float64)
+    per_face = face_normals(mesh).astype(np.float64)
+    for corner in range(3):
+        np.add.at(normals, mesh.faces[:, corner], per_face)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    lengths[lengths == 0] = 1.0
+    return (normals / lengths).astype(np.float32)
+
+def compact(mesh):
+    """Drop degenerate faces and vertices no face references"""
+    faces = mesh.faces
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    used, remap = np.unique(faces, return_inverse=True)
+    return _subset(mesh, used, remap.reshape(-1, 3))
+
+def write_glb(mesh, out_path, flat=False):
+    """Write an indexed mesh as GLB.
+
+    Positions, normals and any colors and uvs share one interleaved buffer
+    view so the viewer uploads a single vertex buffer; indices use the
+    smallest component type that fits. flat=True leaves out the normals:
+    glTF viewers then shade every face flat (hard edges, as STL facets
+    describe) while vertices stay shared between faces.
+    """
+    mesh = compact(mesh)
+    if not len(mesh.faces):
+        raise MeshError('Mesh has no triangles')
+
+    fields = [('POSITION', mesh.positions, 'VEC3')]
+    if not flat:
+        fields.append(('NORMAL', vertex_normals(mesh), 'VEC3'))
+    if mesh.colors is not None:
+        fields.append(('COLOR_0', mesh.colors, f"VEC{mesh.colors.shape[1]}"))
+    if mesh.uvs is not None:
+        fields.append(('TEXCOORD_0', mesh.uvs, 'VEC2'))
+
+    positions = mesh.positions.astype(np.float32)
+    vertices = np.empty(len(positions), dtype=[(name, '<f4', values.shape[1])
+                                               for name, values, _ in fields])
+    for name, values, _ in fields:
+        vertices[name] = values
+    vertex_bytes = vertices.tobytes()
+
+    if len(positions) <= 0xFFFF:
+        index_bytes, index_type = mesh.faces.astype('<u2').tobytes(), 5123
+    else:
+        index_bytes, index_type = mesh.faces.astype('<u4').tobytes(), 5125
+    index_offset = len(vertex_bytes)
+    padding = (-len(index_bytes)) % 4
+    binary = vertex_bytes + index_bytes + b'\0' * padding
+
+    accessors = [
+        {'bufferView': 0, 'byteOffset': vertices.dtype.fields[name][1], 'componentType': 5126,
+         'count': len(positions), 'type': accessor_type}
+        for name, _, accessor_type in fields
+    ]
+    accessors[0]['min'] = positions.min(axis=0).tolist()
+    accessors[0]['max'] = positions.max(axis=0).tolist()
+    accessors.append({'bufferView': 1, 'byteOffset': 0, 'componentType': index_type,
+                      'count': mesh.faces.size, 'type': 'SCALAR'})
+
+    # Vertex colors multiply the base color, so it is white when they exist
+    base_color = [1.0, 1.0, 1.0, 1.0] if mesh.colors is not None else [0.8, 0.8, 0.8, 1.0]
+    gltf = {
+        'asset': {'version': '2.0', 'generator': '3D Asset Manager'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0}],
+        'meshes': [{'primitives': [{
+            'attributes': {name: index for index, (name, _, _) in enumerate(fields)},
+            'indices': len(fields),
+            'material': 0,
+            'mode': 4,
+        }]}],
+        'materials': [{'pbrMetallicRoughness': {
+            'baseColorFactor': base_color,
+            'metallicFactor': 0.0,
+            'roughnessFactor': 0.8,
+        }}],
+        'buffers': [{'byteLength': len(binary)}],
+        'bufferViews': [
+            {'buffer': 0, 'byteOffset': 0, 'byteLength': len(vertex_bytes),
+             'byteStride': vertices.dtype.itemsize, 'target': 34962},
+            {'buffer': 0, 'byteOffset': index_offset, 'byteLength': len(index_bytes),
+             'target': 34963},
+        ],
+        'accessors': accessors,
+    }
+
+    json_bytes = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    json_bytes += b' ' * ((-len(json_bytes)) % 4)
+    total = 12 + 8 + len(json_bytes) + 8 + len(binary)
+
+    with open(out_path, 'wb') as out:
+        out.write(struct.pack('<III', GLB_MAGIC, 2, total))
+        out.write(struct.pack('<II', len(json_bytes), CHUNK_JSON))
+        out.write(json_bytes)
+        out.write(struct.pack('<II', len(binary), CHUNK_BIN))
+        out.write(binary)
@@ -0,0 +1,135 @@
+import numpy as np
+from collections import namedtuple
+from app import db
+from app.models import Model3D
+from app import cache, meshes, storage
+
+GeometryInfo = namedtuple('GeometryInfo', [
+    'vertex_count', 'face_count', 'bbox_min', 'bbox_max', 'surface_area', 'units_guess'
+])
+
+# Triangles processed per step when scanning binary STL files
+STL_BATCH = 1 << 20
+
+GEOMETRY_COLUMNS = (
+    'vertex_count', 'face_count', 'surface_area', 'units_guess',
+    'bbox_min_x', 'bbox_min_y', 'bbox_min_z', 'bbox_max_x', 'bbox_max_y', 'bbox_max_z',
+)
+
+def guess_units(extent, file_extension):
+    """Best guess at the unit of a model from its largest bounding box side"""
+    if file_extension == 'glb':
+        return 'm'  # glTF is defined in meters
+    if not extent or extent <= 0:
+        return None
+    if extent < 10:
+        return 'm'
+    if extent < 1000 and file_extension != 'stl':
+        return 'cm'
+    return 'mm'
+
+def triangle_areas(corners):
+    """Areas of an (M, 3, 3) triangle corner array, in float64"""
+    corners = corners.astype(np.float64)
+    cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    return 0.5 * np.linalg.norm(cross, axis=1)
+
+def _corner_keys(corners):
+    """64-bit key per corner position, used to count distinct vertices"""
+    corners = np.ascontiguousarray(corners, dtype=np.float32).reshape(-1, 3) + np.float32(0.0)
+    bits = corners.view(np.uint32).astype(np.uint64)
+    return (bits[:, 0] * np.uint64(0x9E3779B97F4A7C15)
+            ^ bits[:, 1] * np.uint64(0xC2B2AE3D27D4EB4F)
+            ^ bits[:, 2])
+
+def stl_info(file_path, file_extension='stl'):
+    """Scan an STL in fixed-size batches so memory stays bounded.
+
+    Distinct vertices are counted on 64-bit hashes of the corner
+    coordinates, deduplicated per batch before the final merge.
+    """
+    triangles = meshes.stl_triangles(file_path)
+    face_count = len(triangles)
+    if not face_count:
+        raise meshes.MeshError('STL file has no triangles')
+
+    lo = np.full(3, np.inf)
+    hi = np.full(3, -np.inf)
+    area = 0.0
+    keys = []
+    for start in range(0, face_count, STL_BATCH):
+        batch = np.asarray(triangles[start:start + STL_BATCH], dtype=np.float32)
+        corners = batch.reshape(-1, 3)
+        lo = np.minimum(lo, corners.min(axis=0))
+        hi = np.maximum(hi, corners.max(axis=0))
+        area += float(triangle_areas(batch).sum())
+        keys.append(np.unique(_corner_keys(batch)))
+
+    vertex_count = len(np.unique(np.concatenate(keys)))
+    return GeometryInfo(vertex_count, face_count, lo.tolist(), hi.tolist(), area,
+                        guess_units(float((hi - lo).max()), file_extension))
+
+def mesh_info(mesh, file_extension):
+    if not len(mesh.positions):
+        raise meshes.MeshError('Mesh has no vertices')
+    lo = mesh.positions.min(axis=0).astype(np.float64)
+    hi = mesh.positions.max(axis=0).astype(np.float64)
+    area = float(triangle_areas(mesh.positions[mesh.faces]).sum()) if len(mesh.faces) else 0.0
+    vertex_count = len(mesh.positions)
+    if file_extension == 'obj' and mesh.uvs is not None:
+        # The reader split vertices shared by several uvs; count positions
+        vertex_count = len(np.unique(mesh.positions, axis=0))
+    return GeometryInfo(vertex_count, len(mesh.faces), lo.tolist(), hi.tolist(), area,
+                        guess_units(float((hi - lo).max()), file_extension))
+
+def extract(file_path, file_extension):
+    """Compute GeometryInfo for a mesh file"""
+    if file_extension == 'stl':
+        return stl_info(file_path)
+    return mesh_info(meshes.load_mesh(file_path, file_extension), file_extension)
+
+def geometry_values(info):
+    return {
+        'vertex_count': info.vertex_count,
+        'face_count': info.face_count,
+        'surface_area': info.surface_area,
+        'units_guess': info.units_guess,
+        'bbox_min_x': info.bbox_min[0],
+        'bbox_min_y': info.bbox_min[1],
+        'bbox_min_z': info.bbox_min[2],
+        'bbox_max_x': info.bbox_max[0],
+        'bbox_max_y': info.bbox_max[1],
+        'bbox_max_z': info.bbox_max[2],
+    }
+
+def extract_metadata(content_hash, file_extension):
+    """Pipeline stage: fill the geometry columns of every row sharing a blob.
+
+    Values already computed for an earlier upload of the same bytes are
+    copied instead of re-reading the file.
+    """
+    if file_extension not in meshes.MESH_EXTENSIONS:
+        return
+
+    pending = Model3D.query.filter(Model3D.content_hash == content_hash,
+                                   Model3D.vertex_count.is_(None))
+    changed = pending.with_entities(Model3D.id, Model3D.user_id).all()
+    if not changed:
+        return
+
+    known = Model3D.query.filter(Model3D.content_hash == content_hash,
+                                 Model3D.vertex_count.isnot(None)).first()
+    if known is not None:
+        values = {column: getattr(known, column) for column in GEOMETRY_COLUMNS}
+    else:
+        with storage.local_copy(storage.blob_key(content_hash)) as src_path:
+            try:
+                values = geometry_values(extract(src_path, file_extension))
+            except meshes.MeshError as e:
+                print(f"⚠️ Skipping metadata extraction of {content_hash}: {e}")
+                return
+
+    pending.update({getattr(Model3D, column): value for column, value in values.items()},
+                   synchronize_session=False)
+    db.session.commit()
+    cache.invalidate(*cache.model_tags(changed))
@@ -0,0 +1,446 @@
+"""Versioned schema migrations, applied with `flask migrate-schema`.
+
+Each migration has a version number and runs once per database; applied
+versions are recorded in the schema_migrations table. Migrations must be
+safe on a live, large database:
+
+- indexes are built with CREATE INDEX CONCURRENTLY on PostgreSQL, so
+  writes continue while they build;
+- columns are added nullable and without a default, which PostgreSQL
+  does without rewriting the table;
+- DDL gives up after LOCK_TIMEOUT instead of queueing behind a long
+  transaction and blocking every query behind it (just re-run).
+
+Every step checks whether its work is already done, so a migration that
+failed halfway can simply be run again, and databases created with
+`db.create_all()` (which already have the current schema) are recorded
+as up to date without changes.
+"""
+import time
+from datetime import datetime
+from sqlalchemy import (BigInteger, Boolean, Column, Date, DateTime, ForeignKey, Index, Integer,
+                        MetaData, String, Table, Text, UniqueConstraint, inspect, text)
+from app import db
+from app import search, stats
+
+MODELS = 'model3_d'
+
+# How long a DDL statement may wait for a table lock, in milliseconds
+LOCK_TIMEOUT = 5000
+
+# Rows copied per statement when a column is rewritten in place
+BACKFILL_BATCH = 5000
+
+# Arbitrary key for the advisory lock that serialises concurrent runs
+ADVISORY_LOCK = 7306191
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# (version, description, function taking a Migrator), in order
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(function):
+        MIGRATIONS.append((version, description, function))
+        return function
+    return register
+
+class Migrator:
+    """Idempotent schema operations on an autocommit connection"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.dialect = connection.dialect.name
+
+    @property
+    def postgres(self):
+        return self.dialect == 'postgresql'
+
+    def execute(self, statement, **params):
+        return self.connection.execute(db.text(statement), params)
+
+    def inspector(self):
+        # Fresh every time: the schema changes as migrations run
+        return inspect(self.connection)
+
+    def has_table(self, table):
+        return self.inspector().has_table(table)
+
+    def has_column(self, table, column):
+        return any(info['name'] == column for info in self.inspector().get_columns(table))
+
+    def create_table(self, table):
+        """Create a table snapshot, with its indexes, if it does not exist yet"""
+        table.create(bind=self.connection, checkfirst=True)
+
+    def add_column(self, table, column, definition):
+        if not self.has_column(table, column):
+            print(f"  + {table}.{column}")
+            self.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def add_foreign_key(self, table, name, column, target):
+        """Add a foreign key constraint (PostgreSQL; SQLite cannot add one later).
+
+        Added NOT VALID and validated separately, which only takes a lock
+        that lets reads and writes continue.
+        """
+        if not self.postgres:
+            return
+        exists = self.execute("SELECT 1 FROM pg_constraint WHERE conname = :name", name=name).first()
+        if not exists:
+            self.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} "
+                         f"FOREIGN KEY ({column}) REFERENCES {target} NOT VALID")
+        self.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+
+    def create_index(self, name, definition):
+        """CREATE INDEX `name` `definition` (e.g. "ON t (a, b DESC)"), online"""
+        if self.postgres:
+            # A failed concurrent build leaves an invalid index behind; start over
+            invalid = self.execute("""
+                SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+                WHERE pg_class.relname = :name AND NOT pg_index.indisvalid
+            """, name=name).first()
+            if invalid:
+                self.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            self.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}")
+        else:
+            self.execute(f"CREATE INDEX IF NOT EXISTS {name} {definition}")
+
+    def drop_index(self, name):
+        concurrently = 'CONCURRENTLY ' if self.postgres else ''
+        self.execute(f"DROP INDEX {concurrently}IF EXISTS {name}")
+
+# --- table snapshots --------------------------------------------------------
+# Each table as the migration that creates it first defined it. Migrations
+# never use app.models, whose classes describe the latest schema: columns
+# added since come from the later migrations that add them.
+
+user_v1 = Table(
+    'user', _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(80), unique=True, nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+    Column('password_hash', String(255), nullable=False),
+    Column('full_name', String(100), nullable=False),
+    Column('created_at', DateTime),
+    Column('is_active', Boolean),
+)
+
+model3_d_v1 = Table(
+    MODELS, _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('description', Text),
+    Column('filename', String(255), nullable=False),
+    Column('original_filename', String(255), nullable=False),
+    Column('file_size', Integer, nullable=False),
+    Column('file_extension', String(10), nullable=False),
+    Column('upload_date', DateTime),
+    Column('downloads', Integer),
+    Column('is_public', Boolean),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+)
+
+blob_v2 = Table(
+    'blob', _metadata,
+    Column('digest', String(64), primary_key=True),
+    Column('size', BigInteger, nullable=False),
+    Column('ref_count', Integer, nullable=False),
+    Column('created_at', DateTime),
+)
+
+rendition_v2 = Table(
+    'rendition', _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('content_hash', String(64), ForeignKey('blob.digest'), nullable=False, index=True),
+    Column('kind', String(32), nullable=False),
+    Column('key', String(255), nullable=False),
+    Column('size', BigInteger, nullable=False),
+    Column('created_at', DateTime),
+    UniqueConstraint('content_hash', 'kind'),
+)
+
+upload_session_v3 = Table(
+    'upload_session', _metadata,
+    Column('id', String(32), primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False, index=True),
+    Column('name', String(100), nullable=False),
+    Column('description', Text),
+    Column('original_filename', String(255), nullable=False),
+    Column('is_public', Boolean),
+    Column('total_size', BigInteger, nullable=False),
+    Column('received_ranges', Text, nullable=False),
+    Column('created_at', DateTime),
+    Column('expires_at', DateTime, nullable=False, index=True),
+)
+
+job_v5 = Table(
+    'job', _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('kind', String(32), nullable=False, index=True),
+    Column('payload', Text, nullable=False),
+    Column('state', String(16), nullable=False),
+    Column('dedupe_key', String(128), unique=True),
+    Column('attempts', Integer, nullable=False),
+    Column('max_attempts', Integer, nullable=False),
+    Column('run_after', DateTime, nullable=False),
+    Column('locked_by', String(64)),
+    Column('last_error', Text),
+    Column('created_at', DateTime),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Index('ix_job_state_run_after', 'state', 'run_after'),
+    Index('ix_job_queued', 'run_after', 'id', postgresql_where=text("state = 'queued'")),
+)
+
+catalog_stat_v9 = Table(
+    'catalog_stat', _metadata,
+    Column('metric', String(32), primary_key=True),
+    Column('bucket', String(32), primary_key=True),
+    Column('value', BigInteger, nullable=False),
+)
+
+download_event_v10 = Table(
+    'download_event', _metadata,
+    Column('id', BigInteger().with_variant(Integer, 'sqlite'), primary_key=True),
+    Column('model_id', Integer, nullable=False),
+    Column('user_id', Integer),
+    Column('downloaded_at', DateTime, nullable=False, index=True),
+)
+
+download_hourly_v10 = Table(
+    'download_hourly', _metadata,
+    Column('model_id', Integer, primary_key=True),
+    Column('hour', DateTime, primary_key=True),
+    Column('user_id', Integer),
+    Column('downloads', Integer, nullable=False),
+    Index('ix_download_hourly_user', 'user_id', 'hour'),
+)
+
+download_daily_v10 = Table(
+    'download_daily', _metadata,
+    Column('model_id', Integer, primary_key=True),
+    Column('day', Date, primary_key=True),
+    Column('user_id', Integer),
+    Column('downloads', Integer, nullable=False),
+    Index('ix_download_daily_user', 'user_id', 'day'),
+)
+
+revoked_token_v11 = Table(
+    'revoked_token', _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('jti', String(32)),
+    Column('user_id', Integer, nullable=False),
+    Column('revoked_at', DateTime, nullable=False),
+    Column('expires_at', DateTime, nullable=False, index=True),
+)
+
+# --- migrations -------------------------------------------------------------
+# Append new migrations at the end; never edit one that has shipped.
+
+@migration(1, 'Users and models')
+def create_base_tables(m):
+    m.create_table(user_v1)
+    m.create_table(model3_d_v1)
+
+@migration(2, 'Content-addressed blob store and renditions')
+def add_blob_store(m):
+    m.create_table(blob_v2)
+    m.create_table(rendition_v2)
+    m.add_column(MODELS, 'content_hash', 'VARCHAR(64)')
+    m.add_foreign_key(MODELS, f'{MODELS}_content_hash_fkey', 'content_hash', 'blob (digest)')
+    m.create_index(f'ix_{MODELS}_content_hash', f"ON {MODELS} (content_hash)")
+
+@migration(3, 'Resumable upload sessions')
+def add_upload_sessions(m):
+    m.create_table(upload_session_v3)
+
+@migration(4, 'Mesh geometry metadata')
+def add_geometry_columns(m):
+    for column, definition in [('vertex_count', 'BIGINT'),
+                               ('face_count', 'BIGINT'),
+                               ('surface_area', 'FLOAT'),
+                               ('units_guess', 'VARCHAR(8)'),
+                               ('bbox_min_x', 'FLOAT'),
+                               ('bbox_min_y', 'FLOAT'),
+                               ('bbox_min_z', 'FLOAT'),
+                               ('bbox_max_x', 'FLOAT'),
+                               ('bbox_max_y', 'FLOAT'),
+                               ('bbox_max_z', 'FLOAT')]:
+        m.add_column(MODELS, column, definition)
+    for column in ('vertex_count', 'face_count', 'surface_area', 'units_guess'):
+        m.create_index(f'ix_{MODELS}_{column}', f"ON {MODELS} ({column})")
+
+@migration(5, 'Background job queue')
+def add_job_queue(m):
+    m.create_table(job_v5)
+
+@migration(6, 'Widen model3_d.file_size to BIGINT')
+def widen_file_size(m):
+    """ALTER COLUMN TYPE would rewrite the table under an exclusive lock, so
+    PostgreSQL copies the values into a new BIGINT column in batches (a
+    trigger keeps it current meanwhile) and swaps the columns at the end.
+    SQLite integers are 64-bit already."""
+    if not m.postgres:
+        return
+    types = {info['name']: info['type'] for info in m.inspector().get_columns(MODELS)}
+    if 'file_size_new' not in types and isinstance(types['file_size'], BigInteger):
+        return
+
+    m.add_column(MODELS, 'file_size_new', 'BIGINT')
+    m.execute(f"""
+        CREATE OR REPLACE FUNCTION {MODELS}_copy_file_size() RETURNS trigger AS $$
+        BEGIN
+            NEW.file_size_new := NEW.file_size;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    m.execute(f"DROP TRIGGER IF EXISTS {MODELS}_copy_file_size ON {MODELS}")
+    m.execute(f"""CREATE TRIGGER {MODELS}_copy_file_size BEFORE INSERT OR UPDATE ON {MODELS}
+                  FOR EACH ROW EXECUTE FUNCTION {MODELS}_copy_file_size()""")
+
+    last_id = m.execute(f"SELECT max(id) FROM {MODELS}").scalar() or 0
+    for start in range(0, last_id, BACKFILL_BATCH):
+        m.execute(f"""UPDATE {MODELS} SET file_size_new = file_size
+                      WHERE id > :start AND id <= :stop AND file_size_new IS NULL""",
+                  start=start, stop=start + BACKFILL_BATCH)
+        time.sleep(0.01)  # leave room for other writers
+
+    # A validated CHECK lets SET NOT NULL skip its full-table scan
+    exists = m.execute("SELECT 1 FROM pg_constraint WHERE conname = 'file_size_new_not_null'").first()
+    if not exists:
+        m.execute(f"""ALTER TABLE {MODELS} ADD CONSTRAINT file_size_new_not_null
+                      CHECK (file_size_new IS NOT NULL) NOT VALID""")
+    m.execute(f"ALTER TABLE {MODELS} VALIDATE CONSTRAINT file_size_new_not_null")
+
+    # The swap itself only touches the catalog; one transaction, brief lock
+    m.execute(f"""
+        BEGIN;
+        ALTER TABLE {MODELS} ALTER COLUMN file_size_new SET NOT NULL;
+        DROP TRIGGER {MODELS}_copy_file_size ON {MODELS};
+        ALTER TABLE {MODELS} DROP COLUMN file_size;
+        ALTER TABLE {MODELS} RENAME COLUMN file_size_new TO file_size;
+        ALTER TABLE {MODELS} DROP CONSTRAINT file_size_new_not_null;
+        COMMIT;
+    """)
+    m.execute(f"DROP FUNCTION IF EXISTS {MODELS}_copy_file_size()")
+
+@migration(7, 'Full-text search index')
+def add_search_index(m):
+    if m.postgres:
+        m.create_index(search.GIN_INDEX, search.POSTGRES_INDEX)
+    elif m.dialect == 'sqlite':
+        existed = m.has_table(search.FTS_TABLE)
+        for statement in search.SQLITE_DDL:
+            m.execute(statement)
+        if not existed:
+            m.execute(f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) VALUES ('rebuild')")
+
+@migration(8, 'Listing indexes')
+def add_listing_indexes(m):
+    m.create_index(f'ix_{MODELS}_listing', f"ON {MODELS} (is_public, upload_date DESC, id DESC)")
+    m.create_index(f'ix_{MODELS}_owner', f"ON {MODELS} (user_id, upload_date DESC)")
+    if m.postgres:
+        m.create_index(f'ix_{MODELS}_popular', f"ON {MODELS} (downloads DESC, id DESC) WHERE is_public")
+        m.create_index('ix_job_queued', "ON job (run_after, id) WHERE state = 'queued'")
+    else:
+        m.create_index(f'ix_{MODELS}_popular', f"ON {MODELS} (downloads DESC, id DESC)")
+        m.create_index('ix_job_queued', "ON job (run_after, id)")
+
+@migration(9, 'Materialized catalog statistics')
+def add_catalog_stats(m):
+    m.create_table(catalog_stat_v9)
+    stats.recount(m.connection)
+
+@migration(10, 'Download event log and rollups')
+def add_download_analytics(m):
+    m.create_table(download_event_v10)
+    m.create_table(download_hourly_v10)
+    m.create_table(download_daily_v10)
+
+@migration(11, 'API token revocations')
+def add_token_revocations(m):
+    m.create_table(revoked_token_v11)
+
+@migration(12, 'Upload session state')
+def add_upload_session_state(m):
+    m.add_column('upload_session', 'state', 'VARCHAR(16)')
+    m.add_column('upload_session', 'model_id', 'INTEGER')
+
+@migration(13, 'Job heartbeats')
+def add_job_heartbeats(m):
+    m.add_column('job', 'heartbeat_at', 'TIMESTAMP')
+
+@migration(14, 'model3_d.upload_date NOT NULL')
+def require_upload_date(m):
+    """Listings page by (upload_date, id), which has no place for NULL.
+    Rows without a date get the oldest known one, so they stay at the end
+    of newest-first lists."""
+    if m.execute(f"SELECT 1 FROM {MODELS} WHERE upload_date IS NULL").first():
+        oldest = m.execute(f"SELECT min(upload_date) FROM {MODELS}").scalar() or datetime.utcnow()
+        last_id = m.execute(f"SELECT max(id) FROM {MODELS}").scalar() or 0
+        for start in range(0, last_id, BACKFILL_BATCH):
+            m.execute(f"""UPDATE {MODELS} SET upload_date = :oldest
+                          WHERE id > :start AND id <= :stop AND upload_date IS NULL""",
+                      oldest=oldest, start=start, stop=start + BACKFILL_BATCH)
+            time.sleep(0.01)
+
+    # SQLite cannot change a column's nullability; the model keeps new rows filled
+    if not m.postgres:
+        return
+    exists = m.execute("SELECT 1 FROM pg_constraint WHERE conname = 'upload_date_not_null'").first()
+    if not exists:
+        m.execute(f"""ALTER TABLE {MODELS} ADD CONSTRAINT upload_date_not_null
+                      CHECK (upload_date IS NOT NULL) NOT VALID""")
+    m.execute(f"ALTER TABLE {MODELS} VALIDATE CONSTRAINT upload_date_not_null")
+    m.execute(f"""
+        BEGIN;
+        ALTER TABLE {MODELS} ALTER COLUMN upload_date SET NOT NULL;
+        ALTER TABLE {MODELS} DROP CONSTRAINT upload_date_not_null;
+        COMMIT;
+    """)
+
+# --- runner -----------------------------------------------------------------
+
+def applied_versions(connection):
+    schema_migrations.create(bind=connection, checkfirst=True)
+    return {row.version for row in connection.execute(schema_migrations.select())}
+
+def status():
+    """[(version, description, applied)] for every known migration"""
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        applied = applied_versions(connection)
+    return [(version, description, version in applied) for version, description, _ in MIGRATIONS]
+
+def upgrade(target=None):
+    """Apply pending migrations up to `target` (default: all). Returns the
+    versions applied."""
+    done = []
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        migrator = Migrator(connection)
+        if migrator.postgres:
+            migrator.execute(f"SET lock_timeout = {LOCK_TIMEOUT}")
+            migrator.execute("SELECT pg_advisory_lock(:key)", key=ADVISORY_LOCK)
+        try:
+            applied = applied_versions(connection)
+            for version, description, function in MIGRATIONS:
+                if version in applied or (target is not None and version > target):
+                    continue
+                print(f"🔧 Migration {version}: {description}")
+                started = time.monotonic()
+                function(migrator)
+                connection.execute(schema_migrations.insert().values(
+                    version=version, description=description, applied_at=datetime.utcnow()))
+                print(f"✅ Migration {version} applied in {time.monotonic() - started:.1f}s")
+                done.append(version)
+        finally:
+            if migrator.postgres:
+                migrator.execute("SELECT pg_advisory_unlock(:key)", key=ADVISORY_LOCK)
+    return done
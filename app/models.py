@@ -1,8 +1,10 @@
+import json
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
+from app import counters
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -29,21 +31,54 @@ class User(UserMixin, db.Model):
             'email': self.email,
             'full_name': self.full_name,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'model_count': len(self.models)
+            'model_count': self.model_count
         }
 
+class Blob(db.Model):
+    """Content-addressed file shared by every Model3D with the same bytes"""
+    digest = db.Column(db.String(64), primary_key=True)  # sha256 hex
+    size = db.Column(db.BigInteger, nullable=False)  # in bytes
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Rendition(db.Model):
+    """Derived file generated once from a blob (e.g. a pre-compressed copy)"""
+    __table_args__ = (db.UniqueConstraint('content_hash', 'kind'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), db.ForeignKey('blob.digest'), nullable=False, index=True)
+    kind = db.Column(db.String(32), nullable=False)  # e.g. 'gzip', 'zstd'
+    key = db.Column(db.String(255), nullable=False)  # storage key
+    size = db.Column(db.BigInteger, nullable=False)  # in bytes
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Model3D(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
-    file_size = db.Column(db.Integer, nullable=False)  # in bytes
+    file_size = db.Column(db.BigInteger, nullable=False)  # in bytes
     file_extension = db.Column(db.String(10), nullable=False)
-    upload_date = db.Column(db.DateTime, default=datetime.utcnow)
+    upload_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     downloads = db.Column(db.Integer, default=0)
     is_public = db.Column(db.Boolean, default=True)
     
+    # Blob holding the file contents (NULL for legacy per-upload files)
+    content_hash = db.Column(db.String(64), db.ForeignKey('blob.digest'), index=True)
+    
+    # Geometry metadata, filled in after upload (NULL until extracted or for non-mesh formats)
+    vertex_count = db.Column(db.BigInteger, index=True)
+    face_count = db.Column(db.BigInteger, index=True)
+    surface_area = db.Column(db.Float, index=True)
+    units_guess = db.Column(db.String(8), index=True)
+    bbox_min_x = db.Column(db.Float)
+    bbox_min_y = db.Column(db.Float)
+    bbox_min_z = db.Column(db.Float)
+    bbox_max_x = db.Column(db.Float)
+    bbox_max_y = db.Column(db.Float)
+    bbox_max_z = db.Column(db.Float)
+    
     # Foreign key
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
@@ -57,6 +92,11 @@ class Model3D(db.Model):
         """Return the owner for template compatibility"""
         return self.owner
     
+    @property
+    def download_count(self):
+        """Stored downloads plus those this process has not written yet"""
+        return (self.downloads or 0) + counters.unflushed_downloads(self.id)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -68,8 +108,17 @@ class Model3D(db.Model):
             'file_extension': self.file_extension,
             'file_format': self.file_format,  # Include both for compatibility
             'upload_date': self.upload_date.isoformat() if self.upload_date else None,
-            'downloads': self.downloads,
+            'downloads': self.download_count,
             'is_public': self.is_public,
+            'content_hash': self.content_hash,
+            'vertex_count': self.vertex_count,
+            'face_count': self.face_count,
+            'surface_area': self.surface_area,
+            'units_guess': self.units_guess,
+            'bounding_box': {
+                'min': [self.bbox_min_x, self.bbox_min_y, self.bbox_min_z],
+                'max': [self.bbox_max_x, self.bbox_max_y, self.bbox_max_z]
+            } if self.bbox_min_x is not None else None,
             'user': {
                 'id': self.user.id,
                 'username': self.user.username,
@@ -84,3 +133,157 @@ class Model3D(db.Model):
                 return f"{self.file_size:.1f} {unit}"
             self.file_size /= 1024.0
         return f"{self.file_size:.1f} TB"
+
+# Hot-path indexes; existing databases get them from app.migrations.
+# Public listings in upload order, and their keyset cursors
+db.Index('ix_model3_d_listing', Model3D.is_public, Model3D.upload_date.desc(), Model3D.id.desc())
+# A user's own models (dashboard, profile, model_count); also serves the user_id foreign key
+db.Index('ix_model3_d_owner', Model3D.user_id, Model3D.upload_date.desc())
+# Most downloaded public models (sort=-downloads); partial on PostgreSQL
+db.Index('ix_model3_d_popular', Model3D.downloads.desc(), Model3D.id.desc(),
+         postgresql_where=Model3D.is_public)
+
+# Counted in SQL rather than by loading every model. Deferred, so loading a
+# user (e.g. on every authenticated request) does not pay for it; listings
+# of users add .options(db.undefer(User.model_count)).
+User.model_count = db.column_property(
+    db.select(db.func.count(Model3D.id))
+    .where(Model3D.user_id == User.id)
+    .correlate_except(Model3D)
+    .scalar_subquery(),
+    deferred=True
+)
+
+class CatalogStat(db.Model):
+    """Materialized catalog counter, maintained by app.stats.
+    
+    `bucket` is '' for the total, 'ext:<extension>' or 'day:<YYYY-MM-DD>'
+    for a breakdown.
+    """
+    metric = db.Column(db.String(32), primary_key=True)  # 'models', 'users', 'downloads'
+    bucket = db.Column(db.String(32), primary_key=True, default='')
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class DownloadEvent(db.Model):
+    """One download, appended in batches by the counter flush and rolled
+    up by app.analytics"""
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    model_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer)  # the model's owner
+    downloaded_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class DownloadHourly(db.Model):
+    """Downloads of a model in one hour"""
+    model_id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)  # start of the hour
+    user_id = db.Column(db.Integer)
+    downloads = db.Column(db.Integer, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_download_hourly_user', 'user_id', 'hour'),
+    )
+
+class DownloadDaily(db.Model):
+    """Downloads of a model in one day"""
+    model_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer)
+    downloads = db.Column(db.Integer, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_download_daily_user', 'user_id', 'day'),
+    )
+
+class RevokedToken(db.Model):
+    """A revoked API token, or with jti NULL every token of the user issued
+    before revoked_at. Kept until the tokens it covers have expired."""
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(32))
+    user_id = db.Column(db.Integer, nullable=False)
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class UploadSession(db.Model):
+    """In-progress resumable upload; byte ranges may arrive in any order"""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    original_filename = db.Column(db.String(255), nullable=False)
+    is_public = db.Column(db.Boolean, default=True)
+    total_size = db.Column(db.BigInteger, nullable=False)  # in bytes
+    received_ranges = db.Column(db.Text, nullable=False, default='[]')  # JSON [[start, stop], ...]
+    state = db.Column(db.String(16), default='receiving')  # receiving, finalizing, completed
+    model_id = db.Column(db.Integer)  # set once completed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    @property
+    def ranges(self):
+        return json.loads(self.received_ranges or '[]')
+    
+    @property
+    def offset(self):
+        """Number of contiguous bytes received from the start of the file"""
+        ranges = self.ranges
+        return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+    
+    @property
+    def is_complete(self):
+        return self.offset == self.total_size
+    
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'name': self.name,
+            'original_filename': self.original_filename,
+            'total_size': self.total_size,
+            'offset': self.offset,
+            'received_ranges': self.ranges,
+            'complete': self.is_complete,
+            'state': self.state or 'receiving',
+            'model_id': self.model_id,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+class Job(db.Model):
+    """Background job; claimed and run by `flask worker`"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False, index=True)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON arguments
+    state = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, succeeded, failed
+    # Set while queued so the same work is not enqueued twice; cleared once claimed
+    dedupe_key = db.Column(db.String(128), unique=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(64))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    # Refreshed by the worker while the job runs; a stale one means the worker died
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_job_state_run_after', 'state', 'run_after'),
+        # PostgreSQL: only the jobs waiting to run, however many finished ones pile up
+        db.Index('ix_job_queued', 'run_after', 'id', postgresql_where=db.text("state = 'queued'")),
+    )
+    
+    @property
+    def arguments(self):
+        return json.loads(self.payload or '{}')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,101 @@
+"""Cursor pagination for model listings.
+
+A cursor is an opaque token naming where the previous page ended. Lists
+in upload order resume from the last (upload_date, id) with a range
+condition the listing index answers directly, so page 10,000 costs the
+same as page 1 and no COUNT(*) is needed. Other orders (relevance, size,
+...) keep an offset inside the cursor.
+"""
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+from app import db
+from app.models import Model3D
+
+# One page of results; next_cursor is None on the last page
+CursorPage = namedtuple('CursorPage', ['items', 'next_cursor'])
+
+# Upper bound on the rows counted for an approximate total
+COUNT_CAP = 10000
+
+class CursorError(ValueError):
+    """Raised for a cursor that is malformed or belongs to another listing"""
+
+def encode_cursor(data):
+    raw = json.dumps(data, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+def decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except (ValueError, TypeError):
+        raise CursorError('Invalid cursor')
+    if not isinstance(data, dict) or data.get('s') != sort:
+        raise CursorError('Cursor does not belong to this listing; start again without it')
+    return data
+
+def is_keyset(sort):
+    return sort in ('upload_date', '-upload_date')
+
+def cursor_page(query, sort, order, cursor=None, per_page=20):
+    """Fetch one page of `query` after `cursor` (None for the first page).
+
+    `sort` names the order and is bound into the cursor; `order` is the
+    ORDER BY expression for non-keyset sorts.
+    """
+    data = decode_cursor(cursor, sort) if cursor else None
+
+    if is_keyset(sort):
+        descending = sort.startswith('-')
+        position = db.tuple_(Model3D.upload_date, Model3D.id)
+        if data:
+            try:
+                after = (datetime.fromisoformat(data['d']), int(data['i']))
+            except (KeyError, TypeError, ValueError):
+                raise CursorError('Invalid cursor')
+            query = query.filter(position < after if descending else position > after)
+        if descending:
+            query = query.order_by(Model3D.upload_date.desc(), Model3D.id.desc())
+        else:
+            query = query.order_by(Model3D.upload_date.asc(), Model3D.id.asc())
+        items = query.limit(per_page + 1).all()
+        has_more = len(items) > per_page
+        items = items[:per_page]
+        next_cursor = None
+        if has_more:
+            last = items[-1]
+            next_cursor = encode_cursor({'s': sort, 'd': last.upload_date.isoformat(), 'i': last.id})
+        return CursorPage(items, next_cursor)
+
+    offset = int(data.get('o', 0)) if data else 0
+    items = query.order_by(order, Model3D.id.desc()).offset(offset).limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    next_cursor = encode_cursor({'s': sort, 'o': offset + per_page}) if has_more else None
+    return CursorPage(items, next_cursor)
+
+def count(query, mode):
+    """Total rows of `query` for ?count=exact|estimate, as (total, exact).
+
+    Estimates come from the PostgreSQL planner; elsewhere the count stops
+    at COUNT_CAP rows. Returns (None, False) for any other mode.
+    """
+    query = query.order_by(None)
+    if mode == 'exact':
+        return query.count(), True
+    if mode != 'estimate':
+        return None, False
+
+    if db.engine.dialect.name == 'postgresql':
+        statement = query.statement.compile(dialect=db.engine.dialect)
+        plan = db.session.connection().exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {statement}", statement.params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows']), False
+
+    capped = query.limit(COUNT_CAP + 1).subquery()
+    total = db.session.query(db.func.count()).select_from(capped).scalar()
+    return min(total, COUNT_CAP), total <= COUNT_CAP
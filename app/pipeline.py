@@ -0,0 +1,61 @@
+import traceback
+from flask import current_app
+from app import db, jobs
+from app.compression import compress_variants
+from app.conversion import convert_to_glb
+from app.lod import generate_lods
+from app.metadata import extract_metadata
+from app.thumbnails import generate_thumbnails
+
+# Post-upload processing, grouped into job types that run independently.
+# Stages within a type run in order (LODs and thumbnails read the GLB).
+# Each stage takes (content_hash, file_extension) and must be idempotent.
+JOB_TYPES = {
+    'metadata': [extract_metadata],
+    'compress': [compress_variants],
+    'render': [convert_to_glb, generate_lods, generate_thumbnails],
+}
+
+STAGES = [stage for stages in JOB_TYPES.values() for stage in stages]
+
+def run_stages(content_hash, file_extension):
+    """Run every stage, logging failures without stopping later stages"""
+    for stage in STAGES:
+        try:
+            stage(content_hash, file_extension)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Post-upload stage {stage.__name__} failed for {content_hash}: {e}")
+            traceback.print_exc()
+
+def _job_handler(stages):
+    def handler(content_hash, file_extension):
+        for stage in stages:
+            stage(content_hash, file_extension)
+    return handler
+
+for _kind, _stages in JOB_TYPES.items():
+    jobs.register(_kind, _job_handler(_stages))
+
+def schedule(model):
+    """Queue processing of a freshly committed upload as background jobs"""
+    schedule_many([(model.content_hash, model.file_extension)])
+
+def schedule_many(uploads):
+    """Queue processing of committed uploads given as (content_hash, file_extension)
+    pairs, in a single transaction"""
+    uploads = [upload for upload in dict.fromkeys(uploads) if upload[0]]
+    if not uploads:
+        return
+
+    if not current_app.config['PIPELINE_ASYNC']:
+        for content_hash, file_extension in uploads:
+            run_stages(content_hash, file_extension)
+        return
+
+    jobs.enqueue_many([
+        (kind, f"{kind}:{content_hash}:{file_extension}",
+         {'content_hash': content_hash, 'file_extension': file_extension})
+        for content_hash, file_extension in uploads
+        for kind in JOB_TYPES
+    ])
@@ -0,0 +1,125 @@
+"""Full-text search over model names and descriptions.
+
+Postgres has a GIN expression index over a weighted `tsvector` of the
+two columns; SQLite keeps an external-content FTS5 table synced by
+triggers. Both are maintained by the database itself on insert, update
+and delete, rank matches (name above description) and match every word
+as a prefix so results update while typing. Databases without the index
+fall back to substring matching.
+
+New databases get the index with the table; existing ones get it from
+the migrations (`flask migrate-schema`).
+"""
+import re
+from flask import current_app
+from sqlalchemy import DDL, event, inspect
+from app import db
+from app.models import Model3D
+
+TABLE = Model3D.__tablename__
+FTS_TABLE = f"{TABLE}_fts"
+GIN_INDEX = f"ix_{TABLE}_search"
+
+# Relative weight of a match in the name vs. the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Longest search term considered, in words
+MAX_TERMS = 16
+
+def vector(prefix=''):
+    """The indexed tsvector expression; queries must repeat it exactly"""
+    return (f"(setweight(to_tsvector('simple'::regconfig, coalesce({prefix}name, '')), 'A') || "
+            f"setweight(to_tsvector('simple'::regconfig, coalesce({prefix}description, '')), 'B'))")
+
+POSTGRES_INDEX = f"ON {TABLE} USING gin ({vector()})"
+
+POSTGRES_DDL = [
+    f"CREATE INDEX IF NOT EXISTS {GIN_INDEX} {POSTGRES_INDEX}",
+]
+
+SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description,
+        content='{TABLE}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description)
+        VALUES (new.id, new.name, coalesce(new.description, ''));
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, coalesce(old.description, ''));
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, coalesce(old.description, ''));
+        INSERT INTO {FTS_TABLE}(rowid, name, description)
+        VALUES (new.id, new.name, coalesce(new.description, ''));
+    END""",
+]
+
+# Fresh databases get the index together with the table
+for _statement in POSTGRES_DDL:
+    event.listen(Model3D.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+for _statement in SQLITE_DDL:
+    event.listen(Model3D.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+event.listen(Model3D.__table__, 'before_drop',
+             DDL(f"DROP TABLE IF EXISTS {FTS_TABLE}").execute_if(dialect='sqlite'))
+
+def dialect():
+    return db.engine.dialect.name
+
+def has_index():
+    """Whether the search index exists (cached per app once found)"""
+    if current_app.extensions.get('search_index'):
+        return True
+    name = dialect()
+    inspector = inspect(db.engine)
+    if name == 'postgresql':
+        found = any(index['name'] == GIN_INDEX for index in inspector.get_indexes(TABLE))
+    elif name == 'sqlite':
+        found = inspector.has_table(FTS_TABLE)
+    else:
+        found = False
+    if found:
+        current_app.extensions['search_index'] = True
+    return found
+
+def terms(text):
+    """Words of a search string, lowercased, at most MAX_TERMS"""
+    return re.findall(r'\w+', text.lower())[:MAX_TERMS]
+
+def match(query, text):
+    """Filter a Model3D query to matches of `text`.
+
+    Returns (query, rank) where rank is an expression to order by
+    (ascending: best first), or None when the fallback is in use.
+    """
+    words = terms(text)
+    if not words:
+        return query, None
+
+    if not has_index():
+        for word in words:
+            pattern = f"%{word}%"
+            query = query.filter(Model3D.name.ilike(pattern) | Model3D.description.ilike(pattern))
+        return query, None
+
+    if dialect() == 'postgresql':
+        tsquery = db.func.to_tsquery('simple', ' & '.join(f"{word}:*" for word in words))
+        document = db.literal_column(vector(f"{TABLE}."))
+        weights = db.literal_column(
+            f"'{{0, 0, {DESCRIPTION_WEIGHT / NAME_WEIGHT}, 1}}'::float4[]")
+        query = query.filter(document.op('@@')(tsquery))
+        return query, -db.func.ts_rank_cd(weights, document, tsquery)
+
+    fts_query = ' '.join(f'"{word}"*' for word in words)
+    matches = db.select(
+        db.literal_column('rowid').label('model_id'),
+        db.literal_column(f"bm25({FTS_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT})").label('rank')
+    ).select_from(db.table(FTS_TABLE)).where(
+        db.literal_column(FTS_TABLE).op('MATCH')(fts_query)
+    ).subquery()
+    query = query.join(matches, matches.c.model_id == Model3D.id)
+    return query, matches.c.rank
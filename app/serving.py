@@ -0,0 +1,318 @@
+import mimetypes
+import os
+import uuid
+from collections import namedtuple
+from urllib.parse import quote
+from flask import Response, current_app, redirect, request, send_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import http_date, is_resource_modified, parse_if_range_header
+from app import compression, storage
+
+# What is being served for a model: the stored key, its validator, the
+# filename offered to the client, whether gzip/zstd siblings may exist and
+# the ?v= value that pins the URL (the validator unless given).
+Asset = namedtuple('Asset', ['model', 'key', 'etag', 'download_name', 'compressible', 'version'],
+                   defaults=(None,))
+
+# Upper bound on parts in one multipart/byteranges response; anything
+# beyond this is coalesced into a single covering range.
+MAX_RANGES = 32
+
+def asset_etag(model):
+    """Strong validator for a model's stored file.
+
+    Blob-backed rows use their content digest; legacy files are written once
+    under a unique name, so the name and size identify their bytes.
+    """
+    if model.content_hash:
+        return model.content_hash
+    return f"{model.filename}-{model.file_size}"
+
+def asset_last_modified(model):
+    if not model.upload_date:
+        return None
+    return model.upload_date.replace(microsecond=0)
+
+def apply_cache_headers(response, asset):
+    """Caching for stored assets; private models stay out of shared caches.
+
+    /api/view, /api/download and /api/thumbnail answer with whatever the
+    model resolves to now (the GLB once it is converted, a 403 once it is
+    private), so caches must revalidate on every use: no-cache plus the
+    ETag keeps that a 304 without a body. A URL pinned to the bytes with
+    ?v=<ETag> (or the asset's own version) can never change meaning and is
+    kept ASSET_CACHE_MAX_AGE seconds as immutable.
+    """
+    if request.args.get('v') == (asset.version or asset.etag):
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = current_app.config['ASSET_CACHE_MAX_AGE']
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+        response.cache_control.max_age = None
+        response.cache_control.immutable = None
+    if asset.model.is_public:
+        response.cache_control.public = True
+        response.cache_control.private = None
+    else:
+        response.cache_control.private = True
+        response.cache_control.public = None
+    return response
+
+def if_range_matches(etag, last_modified):
+    """True when there is no If-Range header or it still matches the asset"""
+    if_range = parse_if_range_header(request.headers.get('If-Range'))
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return last_modified is not None and if_range.date.replace(tzinfo=None) == last_modified
+    return True
+
+def resolve_ranges(ranges, length):
+    """Turn requested byte ranges into sorted, merged (start, stop) pairs"""
+    resolved = []
+    for start, end in ranges:
+        if start < 0:
+            start, stop = max(length + start, 0), length
+        else:
+            stop = length if end is None else min(end, length)
+        if start < stop:
+            resolved.append((start, stop))
+
+    merged = []
+    for start, stop in sorted(resolved):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+
+    if len(merged) > MAX_RANGES:
+        merged = [(merged[0][0], merged[-1][1])]
+    return merged
+
+def multipart_byteranges(file_path, ranges, length, mimetype):
+    """Build a streamed 206 multipart/byteranges response"""
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f"--{boundary}\r\n"
+         f"Content-Type: {mimetype}\r\n"
+         f"Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n").encode('latin-1')
+        for start, stop in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode('latin-1')
+
+    content_length = len(closing) + sum(
+        len(header) + (stop - start) for header, (start, stop) in zip(part_headers, ranges)
+    ) + 2 * (len(ranges) - 1)
+
+    def generate():
+        with open(file_path, 'rb') as f:
+            for index, (header, (start, stop)) in enumerate(zip(part_headers, ranges)):
+                if index:
+                    yield b"\r\n"
+                yield header
+                f.seek(start)
+                remaining = stop - start
+                while remaining:
+                    chunk = f.read(min(storage.CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+        yield closing
+
+    response = Response(generate(), status=206, direct_passthrough=True,
+                        mimetype=f"multipart/byteranges; boundary={boundary}")
+    response.content_length = content_length
+    return response
+
+def model_asset(model, key, rendition=None, version=None):
+    """Describe a model's original file, or one of its renditions"""
+    if rendition is None:
+        return Asset(model, key, asset_etag(model), model.original_filename,
+                     bool(model.content_hash)
+                     and model.file_extension in compression.TEXT_EXTENSIONS, version)
+
+    extension = rendition.key.rsplit('.', 1)[-1]
+    base_name = model.original_filename.rsplit('.', 1)[0]
+    return Asset(model, rendition.key, f"{asset_etag(model)}-{rendition.kind}",
+                 f"{base_name}.{extension}", False, version)
+
+def send_asset(model, key, mimetype=None, as_attachment=False, rendition=None, version=None):
+    """Serve a stored model file with validators, conditional GET and ranges.
+
+    Single ranges, 304s and If-Range are handled by send_file; requests
+    for several ranges get a multipart/byteranges body (overlapping ranges
+    are coalesced, so it may hold a single part). Pass a Rendition to serve
+    a derived file instead of the original upload, and a version when a
+    ?v= other than the ETag pins the URL to these bytes.
+    """
+    asset = model_asset(model, key, rendition, version)
+    last_modified = asset_last_modified(model)
+
+    if (current_app.config['FILE_SERVING_MODE'] != 'direct'
+            and storage.get_backend().local_path(asset.key) is not None):
+        return offload_to_proxy(asset, last_modified, mimetype, as_attachment)
+
+    if asset.compressible:
+        response = send_precompressed(asset, last_modified, mimetype, as_attachment)
+        if response is not None:
+            return response
+
+    file_path = storage.get_backend().local_path(asset.key)
+    if file_path is None:
+        return redirect_to_backend(asset, last_modified, mimetype, as_attachment)
+
+    byte_range = request.range
+    if byte_range is None:
+        # Werkzeug refuses overlapping or unordered range sets with a 416;
+        # ignoring a Range header we cannot parse (a full 200) is allowed
+        request.environ.pop('HTTP_RANGE', None)
+    if (byte_range is not None and byte_range.units == 'bytes'
+            and len(byte_range.ranges) > 1):
+        if (is_resource_modified(request.environ, etag=asset.etag, last_modified=last_modified)
+                and if_range_matches(asset.etag, last_modified)):
+            response = multipart_response(asset, file_path, byte_range, mimetype,
+                                          as_attachment)
+            response.set_etag(asset.etag)
+            if last_modified:
+                response.headers['Last-Modified'] = http_date(last_modified)
+            return apply_cache_headers(response, asset)
+
+        # 304 or full body: send_file must not see a range it cannot serve
+        request.environ.pop('HTTP_RANGE', None)
+
+    try:
+        response = send_file(file_path,
+                             mimetype=mimetype,
+                             as_attachment=as_attachment,
+                             download_name=asset.download_name,
+                             etag=asset.etag,
+                             last_modified=last_modified,
+                             conditional=True)
+    except RequestedRangeNotSatisfiable as e:
+        response = e.get_response()
+        response.headers['Content-Range'] = f"bytes */{os.path.getsize(file_path)}"
+    response.accept_ranges = 'bytes'
+    if asset.compressible:
+        response.vary.add('Accept-Encoding')
+    return apply_cache_headers(response, asset)
+
+def send_precompressed(asset, last_modified, mimetype, as_attachment):
+    """Serve a stored gzip/zstd variant if the client accepts one.
+
+    Range requests always get the identity encoding so offsets refer to
+    the original bytes.
+    """
+    if request.range is not None:
+        return None
+
+    chosen = compression.negotiate(asset.model.content_hash, request.accept_encodings)
+    if chosen is None:
+        return None
+
+    encoding, rendition = chosen
+    variant = asset._replace(key=rendition.key, etag=f"{asset.etag}-{rendition.kind}")
+    file_path = storage.get_backend().local_path(variant.key)
+    if file_path is None:
+        response = redirect_to_backend(variant, last_modified, mimetype, as_attachment,
+                                       content_encoding=encoding)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    response = send_file(file_path,
+                         mimetype=mimetype,
+                         as_attachment=as_attachment,
+                         download_name=variant.download_name,
+                         etag=variant.etag,
+                         last_modified=last_modified,
+                         conditional=True)
+    response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    return apply_cache_headers(response, asset)
+
+def offload_to_proxy(asset, last_modified, mimetype, as_attachment):
+    """Authorize here and let the front proxy send the bytes with sendfile.
+
+    'x-accel' (nginx) redirects to an internal location aliased to
+    UPLOAD_FOLDER; nginx handles ranges and picks stored .gz siblings via
+    gzip_static. 'x-sendfile' (Apache, lighttpd) passes the absolute path,
+    so pre-compressed variants are negotiated here.
+    """
+    backend = storage.get_backend()
+    sendfile = current_app.config['FILE_SERVING_MODE'] == 'x-sendfile'
+    key, etag = asset.key, asset.etag
+    content_encoding = None
+    if sendfile and asset.compressible and request.range is None:
+        chosen = compression.negotiate(asset.model.content_hash, request.accept_encodings)
+        if chosen is not None:
+            content_encoding, rendition = chosen
+            key = rendition.key
+            etag = f"{etag}-{rendition.kind}"
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return apply_cache_headers(response, asset)
+
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(asset.download_name)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype)
+    if sendfile:
+        response.headers['X-Sendfile'] = backend.local_path(key)
+        if content_encoding:
+            response.content_encoding = content_encoding
+    else:
+        prefix = current_app.config['X_ACCEL_REDIRECT_PREFIX'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = f"{prefix}/{quote(key)}"
+
+    response.headers.set('Content-Disposition',
+                         'attachment' if as_attachment else 'inline',
+                         filename=asset.download_name)
+    response.accept_ranges = 'bytes'
+    response.set_etag(etag)
+    if last_modified:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    if asset.compressible:
+        response.vary.add('Accept-Encoding')
+    return apply_cache_headers(response, asset)
+
+def redirect_to_backend(asset, last_modified, mimetype, as_attachment,
+                        content_encoding=None):
+    """Send the client to a presigned URL on a remote backend.
+
+    Validators are still checked here so revalidations stay a cheap 304.
+    The redirect itself is only cached privately, for less than the URL's
+    lifetime.
+    """
+    if not is_resource_modified(request.environ, etag=asset.etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(asset.etag)
+        return apply_cache_headers(response, asset)
+
+    expires = current_app.config['STORAGE_PRESIGN_EXPIRES']
+    url = storage.get_backend().presign(asset.key, expires=expires,
+                                        download_name=asset.download_name,
+                                        content_type=mimetype,
+                                        content_encoding=content_encoding,
+                                        as_attachment=as_attachment)
+    response = redirect(url)
+    response.set_etag(asset.etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = expires // 2
+    return response
+
+def multipart_response(asset, file_path, byte_range, mimetype, as_attachment):
+    length = os.path.getsize(file_path)
+    ranges = resolve_ranges(byte_range.ranges, length)
+    if not ranges:
+        response = Response(status=416)
+        response.headers['Content-Range'] = f"bytes */{length}"
+    else:
+        response = multipart_byteranges(file_path, ranges, length,
+                                         mimetype or 'application/octet-stream')
+        if as_attachment:
+            response.headers.set('Content-Disposition', 'attachment',
+                                 filename=asset.download_name)
+    response.accept_ranges = 'bytes'
+    return response
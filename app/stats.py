@@ -0,0 +1,218 @@
+"""Materialized catalog statistics.
+
+The landing page and /api/stats read a handful of rows from the
+catalog_stat table instead of counting models and users and summing
+downloads on every request. The rows are kept current in the same
+transaction as the change that affects them: a session hook turns
+inserted/deleted models and users and visibility changes into counter
+deltas at flush time, and the download counter flush adds its totals.
+`reconcile` recounts everything from the source tables; the worker runs
+it every STATS_RECONCILE_INTERVAL seconds to correct any drift (e.g.
+from rows changed outside the ORM).
+
+Metrics and buckets:
+    models     ''  ext:<extension>  day:<upload date>   (public models)
+    users      ''
+    downloads  ''  day:<download date>
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app import db, jobs
+from app.models import CatalogStat, Model3D, User
+
+TOTAL = ''
+
+def ext_bucket(extension):
+    return f"ext:{extension}"
+
+def day_bucket(when):
+    return f"day:{when:%Y-%m-%d}"
+
+def _insert(dialect):
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+def apply(connection, deltas):
+    """Add {(metric, bucket): delta} to the counters on `connection`"""
+    # Sorted keys keep row lock order consistent between transactions
+    for (metric, bucket), delta in sorted(deltas.items()):
+        if delta:
+            _add(connection, metric, bucket, delta)
+
+def _add(connection, metric, bucket, delta):
+    """Upsert one counter row, adding `delta`"""
+    table = CatalogStat.__table__
+    insert = _insert(connection.dialect.name)
+    if insert is not None:
+        statement = insert(table).values(metric=metric, bucket=bucket, value=delta)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.metric, table.c.bucket],
+            set_={'value': table.c.value + statement.excluded.value}))
+        return
+    updated = connection.execute(
+        table.update().where(table.c.metric == metric, table.c.bucket == bucket)
+        .values(value=table.c.value + delta))
+    if not updated.rowcount:
+        connection.execute(table.insert().values(metric=metric, bucket=bucket, value=delta))
+
+def is_public(value):
+    return value is not False  # NULL counts as public, like the column default
+
+def _model_deltas(model, sign):
+    deltas = Counter()
+    deltas['models', TOTAL] += sign
+    deltas['models', ext_bucket(model.file_extension)] += sign
+    if model.upload_date:
+        deltas['models', day_bucket(model.upload_date)] += sign
+    return deltas
+
+def _changed_deltas(session):
+    """Deltas for deleted users and models and visibility changes, taken
+    before the flush while the rows can still be read"""
+    deltas = Counter()
+    deleted_ids = []
+    for obj in session.deleted:
+        if isinstance(obj, Model3D):
+            # The stored value, in case is_public was changed before the delete
+            history = inspect(obj).attrs.is_public.history
+            if is_public(history.deleted[0] if history.deleted else obj.is_public):
+                deltas.update(_model_deltas(obj, -1))
+            deleted_ids.append(obj.id)
+        elif isinstance(obj, User):
+            deltas['users', TOTAL] -= 1
+    if deleted_ids:
+        # From the table: the loaded objects may predate a counter flush
+        deltas['downloads', TOTAL] -= session.execute(
+            db.select(db.func.coalesce(db.func.sum(Model3D.downloads), 0))
+            .where(Model3D.id.in_(deleted_ids))).scalar()
+    for obj in session.dirty:
+        if isinstance(obj, Model3D) and obj not in session.deleted:
+            history = inspect(obj).attrs.is_public.history
+            if history.deleted and is_public(history.deleted[0]) != is_public(obj.is_public):
+                deltas.update(_model_deltas(obj, 1 if is_public(obj.is_public) else -1))
+    return deltas
+
+def _new_deltas(session):
+    """Deltas for inserted users and models, taken after the flush once
+    column defaults (upload_date, is_public) are filled in"""
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Model3D):
+            if is_public(obj.is_public):
+                deltas.update(_model_deltas(obj, 1))
+        elif isinstance(obj, User):
+            deltas['users', TOTAL] += 1
+    return deltas
+
+# Load the old value when is_public is set, so a change can be told apart
+# from setting the same value again
+@event.listens_for(Model3D.is_public, 'set', active_history=True)
+def _track_visibility(target, value, oldvalue, initiator):
+    return value
+
+@event.listens_for(Session, 'before_flush')
+def _before_flush(session, flush_context, instances):
+    session.info.setdefault('catalog_stat_deltas', Counter()).update(_changed_deltas(session))
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    deltas = session.info.pop('catalog_stat_deltas', Counter())
+    deltas.update(_new_deltas(session))
+    if deltas:
+        apply(session.connection(), deltas)
+
+def record_downloads(connection, count, when=None):
+    """Count `count` downloads (called by the counter flush, in its transaction)"""
+    when = when or datetime.utcnow()
+    apply(connection, {('downloads', TOTAL): count, ('downloads', day_bucket(when)): count})
+
+def _values(rows):
+    return {(row.metric, row.bucket): row.value for row in rows}
+
+def snapshot(days=30):
+    """Totals and breakdowns: a primary key lookup per range, whatever the
+    size of the catalog"""
+    since = day_bucket(datetime.utcnow() - timedelta(days=days - 1))
+    rows = CatalogStat.query.filter(db.or_(
+        CatalogStat.bucket == TOTAL,
+        CatalogStat.bucket.like('ext:%'),
+        db.and_(CatalogStat.bucket >= since, CatalogStat.bucket < 'day;')  # ';' sorts after ':'
+    )).all()
+
+    by_day = {}
+    by_format = {}
+    totals = Counter()
+    for row in rows:
+        if row.bucket == TOTAL:
+            totals[row.metric] = row.value
+        elif row.bucket.startswith('ext:') and row.metric == 'models' and row.value:
+            by_format[row.bucket[4:]] = row.value
+        elif row.bucket.startswith('day:'):
+            day = by_day.setdefault(row.bucket[4:], {'uploads': 0, 'downloads': 0})
+            day['uploads' if row.metric == 'models' else 'downloads'] = row.value
+    return {
+        'total_models': totals['models'],
+        'total_users': totals['users'],
+        'total_downloads': totals['downloads'],
+        'by_format': dict(sorted(by_format.items(), key=lambda item: -item[1])),
+        'by_day': dict(sorted(by_day.items()))
+    }
+
+def recount(connection):
+    """Recount every statistic from the source tables on `connection` and
+    return the corrections made. The caller commits.
+
+    Daily download counts have no source to recount from and are kept.
+    """
+    table = CatalogStat.__table__
+    models = Model3D.__table__
+    users = User.__table__
+
+    # Hold the total rows every change updates, so no upload or
+    # registration commits between the recount and the write
+    for metric in ('downloads', 'models', 'users'):
+        _add(connection, metric, TOTAL, 0)
+    connection.execute(db.select(table.c.metric).where(table.c.bucket == TOTAL).with_for_update())
+
+    public = db.or_(models.c.is_public.is_(True), models.c.is_public.is_(None))
+    fresh = Counter()
+    fresh['models', TOTAL] = connection.execute(
+        db.select(db.func.count()).select_from(models).where(public)).scalar()
+    for extension, count in connection.execute(
+            db.select(models.c.file_extension, db.func.count()).where(public)
+            .group_by(models.c.file_extension)):
+        fresh['models', ext_bucket(extension)] = count
+    upload_day = db.func.date(models.c.upload_date)
+    for day, count in connection.execute(
+            db.select(upload_day, db.func.count())
+            .where(public, models.c.upload_date.isnot(None)).group_by(upload_day)):
+        fresh['models', f"day:{str(day)[:10]}"] = count
+    fresh['users', TOTAL] = connection.execute(db.select(db.func.count()).select_from(users)).scalar()
+    fresh['downloads', TOTAL] = connection.execute(
+        db.select(db.func.sum(models.c.downloads))).scalar() or 0
+
+    current = _values(connection.execute(db.select(table).where(db.or_(
+        table.c.metric == 'models', table.c.bucket == TOTAL))))
+    drift = Counter({key: fresh.get(key, 0) - value for key, value in current.items()})
+    drift.update({key: value for key, value in fresh.items() if key not in current})
+    apply(connection, drift)
+    connection.execute(table.delete().where(table.c.metric == 'models', table.c.value == 0,
+                                            table.c.bucket != TOTAL))
+    return {key: delta for key, delta in drift.items() if delta}
+
+def reconcile():
+    """Recount every statistic in the session's transaction and commit"""
+    changed = recount(db.session.connection())
+    db.session.commit()
+    if changed:
+        print(f"📊 Catalog stats corrected: {changed}")
+    return changed
+
+jobs.register('reconcile-stats', reconcile, every='STATS_RECONCILE_INTERVAL')
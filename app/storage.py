@@ -0,0 +1,564 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app import db, jobs
+from app.models import Blob, Model3D, Rendition
+
+# Read/write granularity used while hashing uploads
+CHUNK_SIZE = 1024 * 1024
+
+BLOB_DIR = 'blobs'
+FILES_DIR = 'files'
+TMP_DIR = 'tmp'
+
+# Session.info key listing blobs this transaction wrote (see rollback())
+NEW_BLOBS = 'new_blobs'
+
+StoredObject = namedtuple('StoredObject', ['size', 'last_modified'])
+
+class StorageBackend:
+    """Interface for where stored files live.
+
+    Keys are '/'-separated paths such as blobs/ab/cd/<digest>. Scratch files
+    (spooled uploads, resumable parts) always stay on local disk and are
+    handed to put_file() once complete.
+    """
+
+    def open_read(self, key):
+        """Return a binary file-like object streaming the stored bytes"""
+        raise NotImplementedError
+
+    def write(self, key, stream):
+        """Store the contents of a readable binary stream under key"""
+        raise NotImplementedError
+
+    def put_file(self, key, src_path):
+        """Store a local file under key, consuming (removing) the source"""
+        raise NotImplementedError
+
+    def download_to(self, key, dst_path):
+        """Copy the stored bytes into a local file"""
+        with self.open_read(key) as src, open(dst_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+    def stat(self, key):
+        """Return a StoredObject, or None if the key does not exist"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove a key; missing keys are ignored"""
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    def presign(self, key, expires=3600, download_name=None, content_type=None,
+                content_encoding=None, as_attachment=False):
+        """Return a time-limited URL clients can fetch directly, or None"""
+        return None
+
+    def local_path(self, key):
+        """Return a filesystem path for key if the backend is local, else None"""
+        return None
+
+class LocalStorage(StorageBackend):
+    """Files under a directory on the local (or mounted) filesystem"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def open_read(self, key):
+        return open(self.local_path(key), 'rb')
+
+    def write(self, key, stream):
+        tmp_path = new_tmp_path()
+        try:
+            with open(tmp_path, 'wb') as out:
+                shutil.copyfileobj(stream, out, CHUNK_SIZE)
+            self.put_file(key, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put_file(self, key, src_path):
+        dst_path = self.local_path(key)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        os.replace(src_path, dst_path)
+
+    def download_to(self, key, dst_path):
+        shutil.copyfile(self.local_path(key), dst_path)
+
+    def stat(self, key):
+        try:
+            st = os.stat(self.local_path(key))
+        except FileNotFoundError:
+            return None
+        return StoredObject(st.st_size, datetime.fromtimestamp(st.st_mtime, timezone.utc))
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+class S3Storage(StorageBackend):
+    """Objects in an S3-compatible bucket (AWS, MinIO, R2, ...).
+
+    One boto3 client is shared by all threads of a worker so HTTP
+    connections are pooled; large files go up as concurrent multipart
+    uploads via the boto3 transfer manager.
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None,
+                 access_key=None, secret_key=None, max_pool_connections=32,
+                 multipart_threshold=16 * 1024 * 1024,
+                 multipart_chunksize=16 * 1024 * 1024, max_concurrency=8):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config as BotoConfig
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=BotoConfig(
+                max_pool_connections=max_pool_connections,
+                retries={'max_attempts': 5, 'mode': 'standard'},
+                s3={'addressing_style': 'path'} if endpoint_url else None
+            )
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
+            use_threads=True
+        )
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def open_read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body']
+
+    def write(self, key, stream):
+        self.client.upload_fileobj(stream, self.bucket, self._key(key),
+                                   Config=self.transfer_config)
+
+    def put_file(self, key, src_path):
+        self.client.upload_file(src_path, self.bucket, self._key(key),
+                                Config=self.transfer_config)
+        os.remove(src_path)
+
+    def download_to(self, key, dst_path):
+        self.client.download_file(self.bucket, self._key(key), dst_path,
+                                  Config=self.transfer_config)
+
+    def stat(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return StoredObject(head['ContentLength'], head['LastModified'])
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):  # DeleteObjects limit
+            batch = keys[start:start + 1000]
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': self._key(key)} for key in batch],
+                'Quiet': True
+            })
+
+    def presign(self, key, expires=3600, download_name=None, content_type=None,
+                content_encoding=None, as_attachment=False):
+        params = {'Bucket': self.bucket, 'Key': self._key(key)}
+        if content_type:
+            params['ResponseContentType'] = content_type
+        if content_encoding:
+            params['ResponseContentEncoding'] = content_encoding
+        if download_name:
+            disposition = 'attachment' if as_attachment else 'inline'
+            params['ResponseContentDisposition'] = f'{disposition}; filename="{download_name}"'
+        return self.client.generate_presigned_url('get_object', Params=params,
+                                                  ExpiresIn=expires)
+
+def create_backend(config):
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    kind = config['STORAGE_BACKEND']
+    if kind == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'])
+    if kind == 's3':
+        return S3Storage(
+            bucket=config['S3_BUCKET'],
+            prefix=config['S3_PREFIX'],
+            endpoint_url=config['S3_ENDPOINT_URL'],
+            region=config['S3_REGION'],
+            access_key=config['S3_ACCESS_KEY_ID'],
+            secret_key=config['S3_SECRET_ACCESS_KEY'],
+            max_pool_connections=config['S3_MAX_POOL_CONNECTIONS'],
+            multipart_threshold=config['S3_MULTIPART_THRESHOLD'],
+            multipart_chunksize=config['S3_MULTIPART_CHUNKSIZE'],
+            max_concurrency=config['S3_MAX_CONCURRENCY']
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
+
+def get_backend():
+    """Return the app's storage backend, creating it on first use"""
+    backend = current_app.extensions.get('storage')
+    if backend is None:
+        backend = create_backend(current_app.config)
+        current_app.extensions['storage'] = backend
+    return backend
+
+def blob_key(digest):
+    """Return the storage key for a blob digest"""
+    return '/'.join([BLOB_DIR, digest[:2], digest[2:4], digest])
+
+def sharded_key(filename):
+    """Two-level fan-out key for a per-upload (non-blob) file"""
+    bucket = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    return '/'.join([FILES_DIR, bucket[:2], bucket[2:4], filename])
+
+def new_tmp_path():
+    """Return a fresh path in the local scratch directory"""
+    tmp_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], TMP_DIR)
+    os.makedirs(tmp_folder, exist_ok=True)
+    return os.path.join(tmp_folder, uuid.uuid4().hex)
+
+@contextmanager
+def local_copy(key):
+    """Yield a local filesystem path holding the stored bytes of key"""
+    backend = get_backend()
+    file_path = backend.local_path(key)
+    if file_path is not None:
+        yield file_path
+        return
+
+    tmp_path = new_tmp_path()
+    try:
+        backend.download_to(key, tmp_path)
+        yield tmp_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def spool_stream(stream):
+    """Copy a stream to a temporary file while hashing it.
+
+    Returns (tmp_path, sha256 hex digest, size in bytes).
+    """
+    tmp_path = new_tmp_path()
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return tmp_path, sha256.hexdigest(), size
+
+def acquire_blob(digest, size):
+    """Add a reference to a blob, creating its row if needed.
+
+    Returns True if this is the first reference to the blob. A released
+    blob whose files are not purged yet is revived rather than recreated.
+    The caller owns the surrounding transaction; the row is inserted in a
+    savepoint, so losing the race with a concurrent upload of the same
+    content only rolls back the insert and counts a reference instead.
+    """
+    def add_reference():
+        return Blob.query.filter_by(digest=digest).update(
+            {Blob.ref_count: Blob.ref_count + 1, Blob.size: size}, synchronize_session=False
+        )
+
+    if add_reference():
+        return False
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(Blob(digest=digest, size=size, ref_count=1))
+    except IntegrityError:
+        if add_reference():
+            return False
+        raise
+    return True
+
+def blob_digest(key):
+    """The digest of a blob_key(), or None for any other key"""
+    parts = key.split('/')
+    if len(parts) == 4 and parts[0] == BLOB_DIR and '.' not in parts[3]:
+        return parts[3]
+    return None
+
+def release_blob(digest):
+    """Drop a reference to a blob.
+
+    When that was the last reference the blob's key is returned; the
+    caller should pass it to remove_files() once the transaction commits.
+    The row stays behind with no references until then, so an upload of
+    the same content in the meantime revives it instead of racing the
+    removal.
+    """
+    return release_blobs([digest])
+
+def release_blobs(digests):
+    """release_blob() for many references at once (a digest may repeat).
+
+    Returns the storage keys of every blob left unreferenced, for
+    remove_files() after the commit.
+    """
+    counts = Counter(digests)
+    if not counts:
+        return []
+    Blob.query.filter(Blob.digest.in_(counts)).update(
+        {Blob.ref_count: Blob.ref_count - db.case(counts, value=Blob.digest, else_=0)},
+        synchronize_session=False
+    )
+    orphaned = [digest for (digest,) in db.session.query(Blob.digest)
+                .filter(Blob.digest.in_(counts), Blob.ref_count <= 0)]
+    return [blob_key(digest) for digest in orphaned]
+
+def purge_blobs(digests):
+    """Delete blobs that are still unreferenced, with their renditions and files.
+
+    Each blob row is locked first (a no-op UPDATE that only matches while
+    ref_count <= 0) and its files are deleted before that transaction
+    commits. An upload of the same content therefore either revives the
+    blob before the lock and keeps its files, or waits for the purge to
+    commit, finds no row and stores the file again. Returns the digests
+    removed.
+    """
+    backend = get_backend()
+    purged = []
+    for digest in dict.fromkeys(digests):
+        locked = Blob.query.filter(Blob.digest == digest, Blob.ref_count <= 0).update(
+            {Blob.ref_count: Blob.ref_count}, synchronize_session=False
+        )
+        if not locked:
+            db.session.commit()
+            continue
+        try:
+            keys = [key for (key,) in db.session.query(Rendition.key).filter_by(content_hash=digest)]
+            Rendition.query.filter_by(content_hash=digest).delete(synchronize_session=False)
+            Blob.query.filter_by(digest=digest).delete(synchronize_session=False)
+            backend.delete_many([blob_key(digest)] + keys)
+        except Exception:
+            db.session.rollback()
+            raise
+        db.session.commit()
+        purged.append(digest)
+    return purged
+
+def hash_file(file_path):
+    """Return the sha256 hex digest of a file on disk"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def commit_spooled(tmp_path, digest, size):
+    """Move a fully written temporary file into the blob store.
+
+    The temporary file is always consumed: it either becomes the blob or
+    is discarded because identical content is already stored. A blob
+    file written for a new row is removed again by rollback() if the
+    transaction does not commit.
+    """
+    try:
+        created = acquire_blob(digest, size)
+
+        backend = get_backend()
+        if created or backend.stat(blob_key(digest)) is None:
+            backend.put_file(blob_key(digest), tmp_path)
+            if created:
+                db.session.info.setdefault(NEW_BLOBS, []).append(digest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def store_stream(stream):
+    """Store a stream in the content-addressed blob store.
+
+    Identical content is kept only once; each call adds one reference.
+    Returns (digest, size).
+    """
+    tmp_path, digest, size = spool_stream(stream)
+    commit_spooled(tmp_path, digest, size)
+    return digest, size
+
+def store_file(file_path):
+    """Store an existing local file in the blob store. Returns (digest, size).
+
+    The store consumes a copy and the file itself stays where it is, so
+    a caller whose transaction fails can try again from the same file.
+    """
+    digest = hash_file(file_path)
+    size = os.path.getsize(file_path)
+    tmp_path = new_tmp_path()
+    shutil.copyfile(file_path, tmp_path)
+    commit_spooled(tmp_path, digest, size)
+    return digest, size
+
+def rendition_key(digest, suffix):
+    """Storage key for a file derived from a blob, stored next to it"""
+    return f"{blob_key(digest)}.{suffix}"
+
+def add_rendition(digest, kind, key, tmp_path):
+    """Move a generated file into place and record it (caller commits)"""
+    size = os.path.getsize(tmp_path)
+    get_backend().put_file(key, tmp_path)
+
+    rendition = Rendition(content_hash=digest, kind=kind, key=key, size=size)
+    db.session.add(rendition)
+    return rendition
+
+def remove_files(keys):
+    """Delete stored files that are no longer referenced.
+
+    Blob keys (from release_blob()) go through purge_blobs(), which checks
+    again that nothing references them; other keys are deleted as given.
+    """
+    digests = [blob_digest(key) for key in keys]
+    purge_blobs([digest for digest in digests if digest])
+    others = [key for key, digest in zip(keys, digests) if not digest]
+    if others:
+        get_backend().delete_many(others)
+
+def rollback():
+    """Roll back the session and delete the blob files it stored for rows
+    that are now gone.
+
+    Each blob is claimed with a zero-reference row first; if another
+    upload of the same content holds the digest by then, the file is
+    theirs and stays.
+    """
+    digests = db.session.info.pop(NEW_BLOBS, [])
+    db.session.rollback()
+    for digest in digests:
+        db.session.add(Blob(digest=digest, size=0, ref_count=0))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            continue
+        purge_blobs([digest])
+
+@event.listens_for(Session, 'after_commit')
+def _forget_new_blobs(session):
+    session.info.pop(NEW_BLOBS, None)
+
+def schedule_removal(keys):
+    """Delete files after a commit: in one background job, or right away
+    with PIPELINE_ASYNC off"""
+    if not keys:
+        return
+    if not current_app.config['PIPELINE_ASYNC']:
+        remove_files(keys)
+        return
+    jobs.enqueue('remove-files', keys=list(keys))
+
+jobs.register('remove-files', remove_files)
+
+def resolve_model_key(model):
+    """Storage key of a model's file, or None if it is missing.
+
+    Costs at most two stat calls; rows loaded just before an online
+    migration moved their flat file are found at the sharded location.
+    """
+    backend = get_backend()
+    if backend.stat(model.filename) is not None:
+        return model.filename
+
+    if '/' not in model.filename:
+        key = sharded_key(model.filename)
+        if backend.stat(key) is not None:
+            return key
+
+    return None
+
+def migrate_flat_files(batch_size=500, pause=0.0):
+    """Move legacy files from the flat UPLOAD_FOLDER into the sharded layout.
+
+    Safe to run while the app is serving: each file is hard-linked into its
+    new location before its row is updated, and the old name is only
+    unlinked after the batch commits. Re-running resumes where it stopped.
+    Yields the number of files moved in each batch.
+    """
+    backend = get_backend()
+    if not isinstance(backend, LocalStorage):
+        raise RuntimeError('Flat upload files only exist on local storage')
+
+    local_path = backend.local_path
+    last_id = 0
+    while True:
+        batch = Model3D.query.filter(
+            Model3D.id > last_id,
+            Model3D.content_hash.is_(None),
+            ~Model3D.filename.contains('/')
+        ).order_by(Model3D.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        moved = []
+        for model in batch:
+            last_id = model.id
+            src_path = local_path(model.filename)
+            key = sharded_key(model.filename)
+            dst_path = local_path(key)
+
+            if not os.path.exists(dst_path):
+                if not os.path.exists(src_path):
+                    print(f"⚠️ Missing file for model {model.id}: {model.filename}")
+                    continue
+                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                try:
+                    os.link(src_path, dst_path)
+                except OSError:
+                    shutil.copy2(src_path, dst_path)
+
+            model.filename = key
+            moved.append(src_path)
+
+        db.session.commit()
+
+        for src_path in moved:
+            if os.path.exists(src_path):
+                os.remove(src_path)
+
+        yield len(moved)
+
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,221 @@
+"""Headless preview images for browse and index cards.
+
+A small orthographic z-buffer rasterizer over NumPy arrays renders the
+lightest stored version of a mesh once, supersampled, and Pillow
+downsamples and encodes it as WebP and PNG at each card size.
+"""
+import os
+import numpy as np
+from PIL import Image
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Rendition
+from app import lod, meshes, storage
+
+# Square edge lengths, in pixels, of the stored previews
+THUMBNAIL_SIZES = (128, 256, 512)
+
+# Encodings stored for every size, in preference order -> (mimetype, Pillow options)
+THUMBNAIL_FORMATS = {
+    'webp': ('image/webp', {'quality': 80, 'method': 6}),
+    'png': ('image/png', {'optimize': True}),
+}
+
+# Rendering at this multiple of the largest size and downsampling
+# smooths the edges
+SUPERSAMPLE = 2
+
+# Camera: yaw around the vertical axis, then pitch down, in degrees
+YAW = 35.0
+PITCH = 25.0
+
+# Fraction of the image left empty on each side
+MARGIN = 0.06
+
+BASE_COLOR = np.array([99, 102, 241], dtype=np.float64)  # indigo-500, as on the cards
+AMBIENT = 0.35
+LIGHT = np.array([0.3, 0.5, 1.0]) / np.linalg.norm([0.3, 0.5, 1.0])
+
+# Upper bound on candidate pixels examined per rasterizer step
+SAMPLE_BUDGET = 1 << 22
+
+def thumbnail_kind(size, image_format):
+    return f"thumb{size}-{image_format}"
+
+def rotation(yaw, pitch):
+    yaw, pitch = np.radians(yaw), np.radians(pitch)
+    about_y = np.array([[np.cos(yaw), 0, np.sin(yaw)],
+                        [0, 1, 0],
+                        [-np.sin(yaw), 0, np.cos(yaw)]])
+    about_x = np.array([[1, 0, 0],
+                        [0, np.cos(pitch), -np.sin(pitch)],
+                        [0, np.sin(pitch), np.cos(pitch)]])
+    return about_x @ about_y
+
+def project(mesh, size):
+    """Screen-space x/y, depth (smaller is closer) and flat shade per face"""
+    positions = mesh.positions.astype(np.float64)
+    view = (positions - (positions.min(axis=0) + positions.max(axis=0)) / 2) @ rotation(YAW, PITCH).T
+
+    lo, hi = view[:, :2].min(axis=0), view[:, :2].max(axis=0)
+    scale = size * (1 - 2 * MARGIN) / max(float((hi - lo).max()), 1e-12)
+    middle = (lo + hi) / 2
+    xy = np.empty((len(view), 2))
+    xy[:, 0] = (view[:, 0] - middle[0]) * scale + size / 2
+    xy[:, 1] = size / 2 - (view[:, 1] - middle[1]) * scale
+
+    corners = view[mesh.faces]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-30)[:, None]
+    # Two-sided lighting: scanned meshes often have inconsistent winding
+    shade = AMBIENT + (1 - AMBIENT) * np.abs(normals @ LIGHT)
+    return xy, -view[:, 2], shade
+
+def rasterize(xy, depth, faces, shade, size):
+    """Z-buffer the triangles; returns per-pixel shade and a coverage mask.
+
+    Triangles are grouped by the power-of-two square that holds their
+    pixel bounding box, so each group is one broadcast over a fixed grid
+    of candidate pixels instead of a Python loop per triangle.
+    """
+    zbuffer = np.full(size * size, np.inf)
+    image = np.zeros(size * size)
+
+    tri = xy[faces]
+    z = depth[faces]
+    x0 = np.clip(np.ceil(tri[:, :, 0].min(axis=1) - 0.5), 0, size - 1).astype(np.int64)
+    x1 = np.clip(np.floor(tri[:, :, 0].max(axis=1) - 0.5), 0, size - 1).astype(np.int64)
+    y0 = np.clip(np.ceil(tri[:, :, 1].min(axis=1) - 0.5), 0, size - 1).astype(np.int64)
+    y1 = np.clip(np.floor(tri[:, :, 1].max(axis=1) - 0.5), 0, size - 1).astype(np.int64)
+    width, height = x1 - x0 + 1, y1 - y0 + 1
+
+    area = ((tri[:, 1, 0] - tri[:, 0, 0]) * (tri[:, 2, 1] - tri[:, 0, 1])
+            - (tri[:, 2, 0] - tri[:, 0, 0]) * (tri[:, 1, 1] - tri[:, 0, 1]))
+    visible = (width > 0) & (height > 0) & (np.abs(area) > 1e-12)
+    side = np.maximum(width, height)
+    bucket = np.zeros(len(faces), dtype=np.int64)
+    bucket[visible] = np.ceil(np.log2(side[visible])).astype(np.int64)
+
+    for k in np.unique(bucket[visible]):
+        span = 1 << int(k)
+        oy, ox = np.divmod(np.arange(span * span), span)
+        members = np.flatnonzero(visible & (bucket == k))
+        step = max(1, SAMPLE_BUDGET // (span * span))
+        for start in range(0, len(members), step):
+            f = members[start:start + step]
+            px = x0[f, None] + ox
+            py = y0[f, None] + oy
+            cx, cy = px + 0.5, py + 0.5
+
+            a, b, c = tri[f, 0], tri[f, 1], tri[f, 2]
+            inv_area = 1.0 / area[f, None]
+            w0 = ((b[:, 0, None] - cx) * (c[:, 1, None] - cy)
+                  - (c[:, 0, None] - cx) * (b[:, 1, None] - cy)) * inv_area
+            w1 = ((c[:, 0, None] - cx) * (a[:, 1, None] - cy)
+                  - (a[:, 0, None] - cx) * (c[:, 1, None] - cy)) * inv_area
+            w2 = 1.0 - w0 - w1
+            inside = ((ox < width[f, None]) & (oy < height[f, None])
+                      & (w0 >= 0) & (w1 >= 0) & (w2 >= 0))
+
+            rows, cols = np.nonzero(inside)
+            if not len(rows):
+                continue
+            pixel = py[rows, cols] * size + px[rows, cols]
+            fragment_depth = (w0[rows, cols] * z[f[rows], 0] + w1[rows, cols] * z[f[rows], 1]
+                              + w2[rows, cols] * z[f[rows], 2])
+
+            # Nearest fragment per pixel within the step, then against the buffer
+            order = np.lexsort((fragment_depth, pixel))
+            pixel, fragment_depth, rows = pixel[order], fragment_depth[order], rows[order]
+            first = np.ones(len(pixel), dtype=bool)
+            first[1:] = pixel[1:] != pixel[:-1]
+            pixel, fragment_depth, rows = pixel[first], fragment_depth[first], rows[first]
+
+            closer = fragment_depth < zbuffer[pixel]
+            zbuffer[pixel[closer]] = fragment_depth[closer]
+            image[pixel[closer]] = shade[f[rows[closer]]]
+
+    covered = np.isfinite(zbuffer)
+    return image.reshape(size, size), covered.reshape(size, size)
+
+def render(mesh, size):
+    """Render a mesh to a transparent RGBA Pillow image"""
+    mesh = meshes.compact(mesh)
+    if not len(mesh.faces):
+        raise meshes.MeshError('Mesh has no triangles')
+
+    xy, depth, shade = project(mesh, size)
+    image, covered = rasterize(xy, depth, mesh.faces, shade, size)
+
+    rgba = np.zeros((size, size, 4), dtype=np.uint8)
+    rgba[..., :3] = np.clip(image[..., None] * BASE_COLOR, 0, 255).astype(np.uint8)
+    rgba[..., 3] = np.where(covered, 255, 0)
+    return Image.fromarray(rgba, 'RGBA')
+
+def load_preview_mesh(content_hash, file_extension):
+    """The lightest stored version of a mesh: a LOD or GLB rendition when
+    one exists, the original upload otherwise"""
+    rendition = lod.pick_rendition(content_hash, len(lod.LOD_LEVELS))
+    if rendition is not None:
+        with storage.local_copy(rendition.key) as path:
+            return meshes.load_mesh(path, 'glb')
+    with storage.local_copy(storage.blob_key(content_hash)) as path:
+        return meshes.load_mesh(path, file_extension)
+
+def generate_thumbnails(content_hash, file_extension):
+    """Pipeline stage: store WebP and PNG previews at every THUMBNAIL_SIZES.
+
+    Idempotent; renders nothing when every preview already exists.
+    """
+    if file_extension not in meshes.MESH_EXTENSIONS:
+        return
+
+    existing = {kind for (kind,) in db.session.query(Rendition.kind).filter_by(content_hash=content_hash)}
+    missing = [(size, image_format) for size in THUMBNAIL_SIZES for image_format in THUMBNAIL_FORMATS
+               if thumbnail_kind(size, image_format) not in existing]
+    if not missing:
+        return
+
+    try:
+        full = render(load_preview_mesh(content_hash, file_extension),
+                      max(THUMBNAIL_SIZES) * SUPERSAMPLE)
+    except meshes.MeshError as e:
+        print(f"⚠️ Skipping thumbnails of {content_hash}: {e}")
+        return
+
+    # Resample with premultiplied alpha so edges do not pick up the black background
+    premultiplied = full.convert('RGBa')
+    for size, image_format in missing:
+        image = premultiplied.resize((size, size), Image.LANCZOS).convert('RGBA')
+        tmp_path = storage.new_tmp_path()
+        try:
+            with open(tmp_path, 'wb') as f:
+                image.save(f, format=image_format.upper(), **THUMBNAIL_FORMATS[image_format][1])
+            kind = thumbnail_kind(size, image_format)
+            storage.add_rendition(content_hash, kind,
+                                  storage.rendition_key(content_hash, f"thumb{size}.{image_format}"),
+                                  tmp_path)
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored the same preview concurrently
+            db.session.rollback()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def pick_thumbnail(content_hash, size, accept_mimetypes):
+    """Closest stored preview at least `size` pixels wide, in the best
+    format the client accepts. Returns (mimetype, rendition) or None."""
+    fitting = [s for s in THUMBNAIL_SIZES if s >= size] or [max(THUMBNAIL_SIZES)]
+    chosen_size = min(fitting)
+
+    offered = [mimetype for mimetype, _ in THUMBNAIL_FORMATS.values()]
+    best = accept_mimetypes.best_match(offered, default='image/png')
+    image_format = next(name for name, (mimetype, _) in THUMBNAIL_FORMATS.items()
+                        if mimetype == best)
+
+    rendition = Rendition.query.filter_by(content_hash=content_hash,
+                                          kind=thumbnail_kind(chosen_size, image_format)).first()
+    if rendition is None:
+        return None
+    return best, rendition
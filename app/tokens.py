@@ -0,0 +1,172 @@
+"""Stateless API tokens for programmatic clients.
+
+A token is `3dam_<claims>.<signature>`: base64url JSON claims (user id,
+scopes, issue and expiry times, a random token id) and their
+HMAC-SHA256 under API_TOKEN_SECRET (default: SECRET_KEY). Sent as
+`Authorization: Bearer <token>`, it is checked with no database access:
+the signature, the expiry, the scope the route needs and an in-memory
+revocation set, which each process reloads from the revoked_token table
+every API_TOKEN_REVOCATION_REFRESH seconds. The user behind a valid
+token comes from the identity cache (app.identity).
+
+Scopes: 'read' for GET/HEAD requests, 'write' for anything else. A
+request with a valid token acts as the token's user, even if it also
+carries a session cookie for someone else.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app, g
+from app import db, identity
+from app.models import RevokedToken
+
+PREFIX = '3dam_'
+SCOPES = ('read', 'write')
+
+# Endpoints whose scope does not follow from the HTTP method
+ENDPOINT_SCOPES = {
+    'api.revoke_tokens': 'read',  # any valid token may revoke itself; others need 'write'
+    'api.batch_get_models': 'read',
+}
+
+class TokenError(Exception):
+    """Raised for a missing, malformed, expired, revoked or under-scoped token"""
+
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.status = status
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _key():
+    secret = current_app.config['API_TOKEN_SECRET'] or current_app.config['SECRET_KEY']
+    return hashlib.sha256(b'api-token:' + secret.encode('utf-8')).digest()
+
+def _sign(payload):
+    return _b64encode(hmac.new(_key(), payload.encode('utf-8'), hashlib.sha256).digest())
+
+def issue(user, scopes, expires_in):
+    """Return (token, claims) for `user`, valid for `expires_in` seconds"""
+    unknown = set(scopes) - set(SCOPES)
+    if not scopes or unknown:
+        raise TokenError(f"Scopes must be among {', '.join(SCOPES)}", 400)
+    now = int(time.time())
+    claims = {
+        'u': user.id,
+        's': sorted(set(scopes)),
+        'i': now,
+        'e': now + int(expires_in),
+        'j': secrets.token_hex(8),
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    return f"{PREFIX}{payload}.{_sign(payload)}", claims
+
+def verify(token, check_expiry=True):
+    """Claims of a token with a valid signature; raises TokenError"""
+    if not token.startswith(PREFIX) or token.count('.') != 1:
+        raise TokenError('Malformed API token')
+    payload, signature = token[len(PREFIX):].split('.')
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise TokenError('Invalid API token')
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        claims = None
+    if not isinstance(claims, dict) or not {'u', 's', 'i', 'e', 'j'} <= claims.keys():
+        raise TokenError('Malformed API token')
+    if check_expiry and claims['e'] <= time.time():
+        raise TokenError('API token has expired')
+    return claims
+
+class RevocationSet:
+    """Revoked token ids and per-user cut-offs, reloaded periodically"""
+
+    def __init__(self, refresh):
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.token_ids = frozenset()
+        self.not_before = {}  # user id -> tokens issued before this are revoked
+        self.loaded_at = None
+
+    def load(self):
+        rows = db.session.query(RevokedToken.jti, RevokedToken.user_id, RevokedToken.revoked_at) \
+            .filter(RevokedToken.expires_at > datetime.utcnow()).all()
+        token_ids = set()
+        not_before = {}
+        for jti, user_id, revoked_at in rows:
+            if jti:
+                token_ids.add(jti)
+            else:
+                cutoff = (revoked_at - datetime(1970, 1, 1)).total_seconds()
+                not_before[user_id] = max(cutoff, not_before.get(user_id, 0))
+        with self.lock:
+            self.token_ids = frozenset(token_ids)
+            self.not_before = not_before
+            self.loaded_at = time.monotonic()
+
+    def is_revoked(self, claims):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh:
+            self.load()
+        return claims['j'] in self.token_ids or claims['i'] < self.not_before.get(claims['u'], 0)
+
+def get_revocations():
+    revocations = current_app.extensions.get('token_revocations')
+    if revocations is None:
+        revocations = RevocationSet(current_app.config['API_TOKEN_REVOCATION_REFRESH'])
+        current_app.extensions['token_revocations'] = revocations
+    return revocations
+
+def revoke(claims=None, user_id=None):
+    """Revoke one token (by its claims) or every token of `user_id` issued
+    so far, and commit. Other processes notice within the refresh interval."""
+    max_age = timedelta(seconds=current_app.config['API_TOKEN_MAX_TTL'])
+    if claims is not None:
+        db.session.add(RevokedToken(jti=claims['j'], user_id=claims['u'],
+                                    expires_at=datetime.utcfromtimestamp(claims['e'])))
+    else:
+        db.session.add(RevokedToken(user_id=user_id, expires_at=datetime.utcnow() + max_age))
+    # Expired entries cover nothing any more
+    RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    get_revocations().load()
+
+def required_scope(endpoint, method):
+    return ENDPOINT_SCOPES.get(endpoint) or ('read' if method in ('GET', 'HEAD', 'OPTIONS') else 'write')
+
+def authenticate(request):
+    """Check a bearer token on an API request and remember its claims for
+    the request loader. Requests without one are left alone."""
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    claims = verify(header[len('Bearer '):].strip())
+    if get_revocations().is_revoked(claims):
+        raise TokenError('API token has been revoked')
+    scope = required_scope(request.endpoint, request.method)
+    if scope not in claims['s']:
+        raise TokenError(f"API token lacks the '{scope}' scope", 403)
+    g.api_token = claims
+    return claims
+
+def request_user():
+    """The user authenticated by this request's bearer token, if any"""
+    claims = g.get('api_token')
+    if claims is None:
+        return None
+    return identity.load_user(claims['u'], use_session=False)
+
+def has_scope(scope):
+    """Whether this request may act with `scope`: always for a session
+    login, otherwise only if its bearer token carries the scope"""
+    claims = g.get('api_token')
+    return claims is None or scope in claims['s']
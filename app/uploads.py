@@ -0,0 +1,217 @@
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db, jobs
+from app.models import UploadSession
+from app import storage
+
+SESSION_DIR = 'sessions'
+
+# Session states: chunks are accepted while 'receiving'; 'finalizing' once
+# /complete has queued the hashing job; 'completed' when the model exists
+RECEIVING = 'receiving'
+FINALIZING = 'finalizing'
+COMPLETED = 'completed'
+
+class RangeError(ValueError):
+    """Raised when a chunk does not fit the upload session"""
+
+class QuotaError(Exception):
+    """Raised when a user has too many open sessions or bytes in flight"""
+
+    def __init__(self, message, status=413):
+        super().__init__(message)
+        self.status = status
+
+def part_path(session_id):
+    """Return the scratch file that collects the chunks of a session"""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], storage.TMP_DIR,
+                        SESSION_DIR, f"{session_id}.part")
+
+def merge_ranges(ranges, start, stop):
+    """Insert [start, stop) into a sorted list of disjoint ranges"""
+    merged = []
+    for lo, hi in sorted(ranges + [[start, stop]]):
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+def open_sessions(user_id):
+    """Sessions of a user that still hold (or will hold) a scratch file"""
+    return UploadSession.query.filter(
+        UploadSession.user_id == user_id,
+        db.or_(UploadSession.state.is_(None), UploadSession.state != COMPLETED)
+    )
+
+def check_quota(user_id, total_size):
+    """Raise QuotaError if a new session of total_size bytes is over the
+    user's UPLOAD_SESSION_MAX_PER_USER or UPLOAD_QUOTA_PER_USER"""
+    config = current_app.config
+    sessions = open_sessions(user_id)
+    if sessions.count() >= config['UPLOAD_SESSION_MAX_PER_USER']:
+        raise QuotaError(f"At most {config['UPLOAD_SESSION_MAX_PER_USER']} uploads "
+                         f"may be in progress at once", 429)
+    reserved = sessions.with_entities(db.func.sum(UploadSession.total_size)).scalar() or 0
+    if reserved + total_size > config['UPLOAD_QUOTA_PER_USER']:
+        raise QuotaError('Upload quota exceeded; complete or cancel other uploads first')
+
+def create_session(user_id, name, description, original_filename,
+                   is_public, total_size):
+    """Open a new upload session and its (empty) scratch file.
+
+    Nothing is preallocated: chunks written past the end leave holes
+    that later chunks fill, so disk use grows with the bytes received.
+    """
+    check_quota(user_id, total_size)
+
+    ttl = current_app.config['UPLOAD_SESSION_TTL']
+    upload = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        name=name,
+        description=description,
+        original_filename=original_filename,
+        is_public=is_public,
+        total_size=total_size,
+        received_ranges='[]',
+        state=RECEIVING,
+        expires_at=datetime.utcnow() + timedelta(seconds=ttl)
+    )
+
+    path = part_path(upload.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+    db.session.add(upload)
+    return upload
+
+def write_range(upload, start, stop, stream):
+    """Copy the bytes [start, stop) of the file from stream into the session.
+
+    Data goes straight to the scratch file in CHUNK_SIZE pieces. The set of
+    received ranges is updated under a row lock so parallel chunks for the
+    same session do not lose each other's progress.
+    """
+    if start < 0 or stop > upload.total_size or start >= stop:
+        raise RangeError('Range outside of the declared file size')
+
+    remaining = stop - start
+    with open(part_path(upload.id), 'r+b') as f:
+        f.seek(start)
+        while remaining:
+            chunk = stream.read(min(storage.CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            f.write(chunk)
+            remaining -= len(chunk)
+
+    if remaining:
+        raise RangeError('Request body shorter than Content-Range')
+
+    locked = UploadSession.query.filter_by(id=upload.id).with_for_update().one()
+    locked.received_ranges = json.dumps(merge_ranges(locked.ranges, start, stop))
+    locked.expires_at = datetime.utcnow() + timedelta(
+        seconds=current_app.config['UPLOAD_SESSION_TTL'])
+    return locked
+
+def request_finalize(upload):
+    """Hand a fully received session to finalize(): queued for `flask worker`
+    (returns None), or run inline with PIPELINE_ASYNC off (returns the model).
+
+    Only the first call moves the session on; repeated calls are no-ops.
+    """
+    if not upload.is_complete:
+        raise RangeError('Upload is incomplete')
+
+    if not current_app.config['PIPELINE_ASYNC']:
+        return finalize(upload.id)
+
+    ttl = current_app.config['UPLOAD_SESSION_TTL']
+    moved = UploadSession.query.filter(
+        UploadSession.id == upload.id,
+        db.or_(UploadSession.state.is_(None), UploadSession.state == RECEIVING)
+    ).update({UploadSession.state: FINALIZING,
+              UploadSession.expires_at: datetime.utcnow() + timedelta(seconds=ttl)},
+             synchronize_session=False)
+    db.session.commit()
+    if moved:
+        jobs.enqueue('finalize-upload', dedupe_key=f"finalize-upload:{upload.id}",
+                     upload_id=upload.id)
+    return None
+
+def finalize(upload_id):
+    """Hash a complete session into the blob store, create its model and
+    commit. Returns the model (None if the session is gone).
+
+    Idempotent: a session that already produced its model returns it, and
+    the scratch file is only removed once the model is committed.
+    """
+    from app.api import create_model_record  # app.api imports this module
+    from app import pipeline
+    from app.models import Model3D
+
+    upload = UploadSession.query.filter_by(id=upload_id).with_for_update().first()
+    if upload is None:
+        db.session.commit()
+        return None
+    path = part_path(upload.id)
+    if upload.state == COMPLETED:
+        db.session.commit()
+        if os.path.exists(path):
+            os.remove(path)
+        return db.session.get(Model3D, upload.model_id)
+
+    try:
+        content_hash, file_size = storage.store_file(path)
+        model = create_model_record(upload.name, upload.description,
+                                    upload.original_filename, content_hash,
+                                    file_size, upload.is_public, upload.user_id)
+        db.session.flush()
+        upload.state = COMPLETED
+        upload.model_id = model.id
+        db.session.commit()
+    except Exception:
+        storage.rollback()
+        raise
+
+    os.remove(path)
+    pipeline.schedule(model)
+    return model
+
+jobs.register('finalize-upload', finalize)
+
+def discard(upload):
+    """Abort a session and remove its scratch file"""
+    path = part_path(upload.id)
+    if os.path.exists(path):
+        os.remove(path)
+    db.session.delete(upload)
+
+def expire_sessions(limit=100):
+    """Discard up to `limit` sessions that have not received data within
+    their TTL (caller commits). Completed sessions are kept until then so
+    clients can still look up their model; sessions being finalized are
+    left to their job."""
+    expired = UploadSession.query.filter(
+        UploadSession.expires_at < datetime.utcnow(),
+        db.or_(UploadSession.state.is_(None), UploadSession.state != FINALIZING)
+    ).limit(limit).all()
+    for upload in expired:
+        discard(upload)
+    return len(expired)
+
+def reap_sessions():
+    """Background job: discard every expired session, a batch per commit"""
+    total = 0
+    while True:
+        removed = expire_sessions()
+        db.session.commit()
+        total += removed
+        if not removed:
+            return total
+
+jobs.register('expire-uploads', reap_sessions, every='UPLOAD_EXPIRE_INTERVAL')
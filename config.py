@@ -35,12 +35,108 @@ class Config:
     }
     
     # File upload settings
-    MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB
+    MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB per request
+    
+    # Where stored files live: 'local' (UPLOAD_FOLDER) or 's3' (any S3-compatible service)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID')
+    S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY')
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32))
+    S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', 16 * 1024 * 1024))
+    S3_MULTIPART_CHUNKSIZE = int(os.environ.get('S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024))
+    S3_MAX_CONCURRENCY = int(os.environ.get('S3_MAX_CONCURRENCY', 8))
+    STORAGE_PRESIGN_EXPIRES = int(os.environ.get('STORAGE_PRESIGN_EXPIRES', 3600))  # seconds
+    
+    # Resumable uploads: total file size and idle session lifetime
+    MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 8 * 1024 * 1024 * 1024))  # 8GB
+    UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 60 * 60))  # seconds
+    # Per user: sessions open at once, and their declared sizes added up
+    UPLOAD_SESSION_MAX_PER_USER = int(os.environ.get('UPLOAD_SESSION_MAX_PER_USER', 5))
+    UPLOAD_QUOTA_PER_USER = int(os.environ.get('UPLOAD_QUOTA_PER_USER', 16 * 1024 * 1024 * 1024))  # 16GB
+    # How often the worker discards expired sessions and their scratch files (0 = never)
+    UPLOAD_EXPIRE_INTERVAL = int(os.environ.get('UPLOAD_EXPIRE_INTERVAL', 15 * 60))  # seconds
+    
+    # Bulk archive ingest (/api/upload/archive); each member is still limited by MAX_UPLOAD_SIZE
+    MAX_ARCHIVE_SIZE = int(os.environ.get('MAX_ARCHIVE_SIZE', 20 * 1024 * 1024 * 1024))  # 20GB
+    ARCHIVE_MAX_MEMBERS = int(os.environ.get('ARCHIVE_MAX_MEMBERS', 2000))
+    ARCHIVE_COMMIT_BATCH = int(os.environ.get('ARCHIVE_COMMIT_BATCH', 100))  # rows per transaction
+    DOWNLOAD_ARCHIVE_MAX_MODELS = int(os.environ.get('DOWNLOAD_ARCHIVE_MAX_MODELS', 1000))
     
     # Railway persistent volume storage
     # Use /app/data for Railway volume mount, fallback to local for development
     UPLOAD_FOLDER = os.environ.get('UPLOAD_PATH', '/app/data/uploads') if os.environ.get('RAILWAY_ENVIRONMENT') else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     
+    # Queue post-upload processing as background jobs; false runs it inline
+    # in the request, which is only meant for tests and development
+    PIPELINE_ASYNC = os.environ.get('PIPELINE_ASYNC', 'true').lower() == 'true'
+    
+    # Web processes also run queued jobs from a background thread, so a
+    # deployment without a `flask worker` service still processes uploads.
+    # Turn off on the web service once a worker service runs.
+    INLINE_WORKER = os.environ.get('INLINE_WORKER', 'true').lower() == 'true'
+    
+    # Download counters are buffered per process and written every this many seconds
+    # (also the most a hard-killed worker can lose); 0 writes on every download
+    DOWNLOAD_COUNTER_FLUSH_INTERVAL = float(os.environ.get('DOWNLOAD_COUNTER_FLUSH_INTERVAL', 5))
+    DOWNLOAD_COUNTER_MAX_PENDING = int(os.environ.get('DOWNLOAD_COUNTER_MAX_PENDING', 1000))  # models
+    
+    # Background jobs (`flask worker`)
+    WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES') or os.cpu_count() or 1)
+    JOB_CONCURRENCY = os.environ.get('JOB_CONCURRENCY', '')  # e.g. 'render=2,compress=4'
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    JOB_RETRY_BACKOFF = int(os.environ.get('JOB_RETRY_BACKOFF', 30))  # seconds, doubled per attempt
+    JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 300))  # seconds without a heartbeat = worker died
+    
+    # Catalog statistics are kept up to date incrementally; the worker also
+    # recounts them from scratch this often to correct any drift (0 = never)
+    STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', 3600))  # seconds
+    
+    # Download analytics: the worker rolls the download event log up into hourly
+    # and daily per-model counts this often (0 = never)
+    ANALYTICS_COMPACT_INTERVAL = int(os.environ.get('ANALYTICS_COMPACT_INTERVAL', 300))  # seconds
+    DOWNLOAD_EVENT_RETENTION_DAYS = int(os.environ.get('DOWNLOAD_EVENT_RETENTION_DAYS', 7))
+    DOWNLOAD_HOURLY_RETENTION_DAYS = int(os.environ.get('DOWNLOAD_HOURLY_RETENTION_DAYS', 35))
+    
+    # Logged-in users are looked up at most once per this many seconds per worker
+    # (0 = every request); IDENTITY_IN_SESSION also keeps them in the session cookie
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 30))
+    IDENTITY_CACHE_MAX_ENTRIES = int(os.environ.get('IDENTITY_CACHE_MAX_ENTRIES', 10000))
+    IDENTITY_IN_SESSION = os.environ.get('IDENTITY_IN_SESSION', 'false').lower() == 'true'
+    
+    # Most models per /api/models:batchGet, :batchUpdate or :batchDelete request
+    API_BATCH_MAX = int(os.environ.get('API_BATCH_MAX', 500))
+    
+    # API tokens (POST /api/tokens): signed with API_TOKEN_SECRET, or SECRET_KEY if unset
+    API_TOKEN_SECRET = os.environ.get('API_TOKEN_SECRET', '')
+    API_TOKEN_DEFAULT_TTL = int(os.environ.get('API_TOKEN_DEFAULT_TTL', 30 * 24 * 60 * 60))  # seconds
+    API_TOKEN_MAX_TTL = int(os.environ.get('API_TOKEN_MAX_TTL', 90 * 24 * 60 * 60))  # seconds
+    # How often each worker reloads the revoked tokens, in seconds
+    API_TOKEN_REVOCATION_REFRESH = int(os.environ.get('API_TOKEN_REVOCATION_REFRESH', 30))
+    
+    # Response cache for the catalog pages and read API: a per-process LRU,
+    # plus an optional tier shared by all workers (redis://host:6379/0, or
+    # memory:// for an in-process stand-in)
+    CACHE_ENABLED = os.environ.get('CACHE_ENABLED', 'true').lower() == 'true'
+    CACHE_LOCAL_MAX_ENTRIES = int(os.environ.get('CACHE_LOCAL_MAX_ENTRIES', 2048))
+    CACHE_LOCAL_TTL = int(os.environ.get('CACHE_LOCAL_TTL', 60))  # seconds
+    CACHE_SHARED_URL = os.environ.get('CACHE_SHARED_URL', '')
+    CACHE_SHARED_TTL = int(os.environ.get('CACHE_SHARED_TTL', 300))  # seconds
+    # Usernames allowed to read operational endpoints such as /api/cache/stats
+    ADMIN_USERNAMES = {name.strip() for name in os.environ.get('ADMIN_USERNAMES', '').split(',') if name.strip()}
+    
+    # How local files reach the client: 'direct' (Flask send_file, for development),
+    # 'x-accel' (nginx X-Accel-Redirect) or 'x-sendfile' (Apache/lighttpd X-Sendfile)
+    FILE_SERVING_MODE = os.environ.get('FILE_SERVING_MODE', 'direct')
+    X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '/_protected_uploads')
+    
+    # Browser/CDN lifetime for asset URLs pinned to their bytes with ?v=<ETag>;
+    # plain /api/view, /api/download and /api/thumbnail URLs are revalidated
+    ASSET_CACHE_MAX_AGE = int(os.environ.get('ASSET_CACHE_MAX_AGE', 365 * 24 * 60 * 60))
+    
     ALLOWED_EXTENSIONS = {'obj', 'fbx', 'gltf', 'glb', 'dae', '3ds', 'ply', 'stl'}
     
     # Railway specific
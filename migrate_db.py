@@ -0,0 +1,21 @@
+"""
+Apply pending schema migrations.
+
+Same as `flask --app app migrate-schema` (what the Procfile release phase
+and Railway's pre-deploy command run), for platforms that can only run a
+plain script before starting the app:
+    python migrate_db.py
+"""
+import sys
+from app import create_app
+from app import migrations
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        try:
+            migrations.upgrade()
+        except Exception as e:
+            print(f"❌ Migration failed: {e}")
+            sys.exit(1)
+    print("✅ Database schema is up to date")
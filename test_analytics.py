@@ -0,0 +1,112 @@
+"""
+Checks for download analytics: the event log rolled up per hour and per
+day, repeated and late compaction, retention, and /api/analytics.
+
+    python -m pytest test_analytics.py
+    python test_analytics.py
+"""
+import io
+from datetime import datetime, timedelta
+
+from testing import add_user, login, make_app, run_as_script
+from app import analytics, counters, db
+from app.models import DownloadDaily, DownloadEvent, DownloadHourly
+
+app = make_app(DOWNLOAD_EVENT_RETENTION_DAYS=7, DOWNLOAD_HOURLY_RETENTION_DAYS=35)
+add_user(app, 'owner')
+add_user(app, 'other')
+owner = login(app, 'owner')
+other = login(app, 'other')
+
+def upload(client, name):
+    response = client.post('/api/upload', data={
+        'file': (io.BytesIO(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n# ' + name.encode()), f'{name}.obj'),
+        'name': name, 'is_public': 'true'}, content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']['id']
+
+mine = upload(owner, 'mine')
+also_mine = upload(owner, 'also-mine')
+theirs = upload(other, 'theirs')
+
+now = datetime.utcnow()
+recent = now - timedelta(minutes=5)
+yesterday = now - timedelta(days=1)
+
+def record(times):
+    """Log downloads at the given {model_id: [time, ...]}"""
+    events = [(model_id, when) for model_id, whens in times.items() for when in whens]
+    with app.app_context():
+        counters.write_deltas({model_id: len(whens) for model_id, whens in times.items()}, events)
+
+def rollups():
+    with app.app_context():
+        hourly = {(row.model_id, row.hour): row.downloads for row in DownloadHourly.query}
+        daily = {(row.model_id, row.day): row.downloads for row in DownloadDaily.query}
+    return hourly, daily
+
+record({mine: [recent, recent, yesterday], also_mine: [yesterday], theirs: [recent]})
+
+def test_compact_rolls_up_hours_and_days():
+    with app.app_context():
+        assert analytics.compact(now) > 0
+    hourly, daily = rollups()
+    assert hourly[mine, analytics.floor_hour(recent)] == 2
+    assert hourly[mine, analytics.floor_hour(yesterday)] == 1
+    assert daily[mine, recent.date()] == 2
+    assert daily[also_mine, yesterday.date()] == 1
+
+def test_compacting_again_counts_nothing_twice():
+    with app.app_context():
+        analytics.compact(now)
+    before = rollups()
+    with app.app_context():
+        analytics.compact(now)
+    assert rollups() == before
+
+    # A late flush for the current hour is picked up by the next run
+    record({mine: [recent]})
+    with app.app_context():
+        analytics.compact(now)
+    hourly, daily = rollups()
+    assert hourly[mine, analytics.floor_hour(recent)] == 3
+    assert daily[mine, recent.date()] == 3
+
+def test_old_rows_are_trimmed():
+    long_ago = now - timedelta(days=40)
+    with app.app_context():
+        db.session.add(DownloadEvent(model_id=mine, user_id=1, downloaded_at=long_ago))
+        db.session.add(DownloadHourly(model_id=mine, user_id=1, hour=analytics.floor_hour(long_ago),
+                                      downloads=5))
+        db.session.add(DownloadDaily(model_id=mine, user_id=1, day=long_ago.date(), downloads=5))
+        db.session.commit()
+        analytics.compact(now)
+        assert DownloadEvent.query.filter(DownloadEvent.downloaded_at < now - timedelta(days=7)).count() == 0
+        assert DownloadHourly.query.filter(DownloadHourly.hour < now - timedelta(days=35)).count() == 0
+        # Daily rollups are kept for good
+        assert DownloadDaily.query.filter_by(day=long_ago.date()).count() == 1
+
+def test_report_shows_only_the_callers_models():
+    with app.app_context():
+        analytics.compact(now)
+    body = owner.get('/api/analytics', query_string={'days': 7}).get_json()
+    assert {model['id'] for model in body['models']} == {mine, also_mine}
+    assert body['models'][0]['id'] == mine and body['total'] == 5
+    assert body['models'][0]['by_day'][recent.date().isoformat()] == 3
+
+    body = owner.get('/api/analytics', query_string={'interval': 'hour', 'hours': 2,
+                                                     'model_id': mine}).get_json()
+    assert [model['id'] for model in body['models']] == [mine]
+    assert body['models'][0]['by_hour'] == {analytics.floor_hour(recent).strftime('%Y-%m-%dT%H:00'): 3}
+
+    body = other.get('/api/analytics').get_json()
+    assert [model['id'] for model in body['models']] == [theirs]
+
+def test_bad_parameters():
+    assert owner.get('/api/analytics?days=0').status_code == 400
+    assert owner.get('/api/analytics?interval=hour&hours=100000').status_code == 400
+    assert owner.get('/api/analytics?interval=week').status_code == 400
+    assert app.test_client().get('/api/analytics').status_code in (302, 401)
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,220 @@
+"""
+Checks for bulk archive ingest (/api/upload/archive): ZIP and tar bodies
+read as a stream, member filtering, the per-member report and what is
+kept when an archive breaks off. Also the streamed multi-model ZIP
+download (/api/download/archive) and its access checks.
+
+    python -m pytest test_archives.py
+    python test_archives.py
+"""
+import io
+import os
+import struct
+import tarfile
+import zipfile
+
+from testing import add_user, login, make_app, run_as_script
+from app import archives, db
+from app.models import Model3D
+
+TRIANGLE = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'
+
+class Unseekable(io.RawIOBase):
+    """Write target without tell/seek, so zipfile writes data descriptors"""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+def make_zip(files, streamed=False):
+    target = Unseekable() if streamed else io.BytesIO()
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files:
+            if streamed:
+                with archive.open(name, 'w') as member:
+                    member.write(content)
+            else:
+                archive.writestr(name, content)
+    return (target.buffer if streamed else target).getvalue()
+
+def make_tar(files, mode='w:gz'):
+    target = io.BytesIO()
+    with tarfile.open(fileobj=target, mode=mode) as archive:
+        for name, content in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return target.getvalue()
+
+app = make_app(ARCHIVE_COMMIT_BATCH=2)
+add_user(app, 'owner')
+owner = login(app, 'owner')
+
+def ingest(body, **params):
+    response = owner.post('/api/upload/archive', data=body, query_string=params,
+                          content_type='application/zip')
+    return response.status_code, response.get_json()
+
+def statuses(report):
+    return {result['name']: result['status'] for result in report['results']}
+
+def test_zip_members_are_filtered_and_reported():
+    body = make_zip([('pack/a.obj', TRIANGLE), ('pack/b.obj', TRIANGLE + b'# b\n'),
+                     ('pack/readme.txt', b'hello'), ('__MACOSX/pack/._a.obj', b'junk'),
+                     ('pack/.hidden.obj', TRIANGLE)])
+    status, report = ingest(body, description='asset pack', is_public='false')
+    assert status == 201, report
+    assert statuses(report) == {'pack/a.obj': 'created', 'pack/b.obj': 'created',
+                                'pack/readme.txt': 'skipped', '__MACOSX/pack/._a.obj': 'skipped',
+                                'pack/.hidden.obj': 'skipped'}
+    assert (report['created'], report['skipped'], report['failed']) == (2, 3, 0)
+    with app.app_context():
+        model = db.session.get(Model3D, report['results'][0]['model_id'])
+        assert model.name == 'a' and model.original_filename == 'a.obj'
+        assert model.description == 'asset pack' and not model.is_public
+        assert model.file_size == len(TRIANGLE)
+
+def test_streamed_zips_and_tars_are_read():
+    files = [(f'part{i}.obj', TRIANGLE + b'# %d\n' % i) for i in range(5)]
+    for body in (make_zip(files, streamed=True), make_tar(files), make_tar(files, 'w')):
+        status, report = ingest(body)
+        assert status == 201, report
+        assert report['created'] == 5
+        # Every batch was committed, the last partial one included
+        with app.app_context():
+            ids = [result['model_id'] for result in report['results']]
+            assert Model3D.query.filter(Model3D.id.in_(ids)).count() == 5
+
+def test_identical_members_share_one_blob():
+    status, report = ingest(make_zip([('one.obj', TRIANGLE), ('two.obj', TRIANGLE)]))
+    assert status == 201
+    with app.app_context():
+        first, second = (db.session.get(Model3D, result['model_id']) for result in report['results'])
+        assert first.content_hash == second.content_hash
+
+def test_corrupt_member_fails_the_archive_but_keeps_earlier_ones():
+    body = bytearray(make_zip([('good.obj', TRIANGLE), ('bad.obj', TRIANGLE * 50)]))
+    second = body.index(b'bad.obj') + len(b'bad.obj')
+    body[second + 10] ^= 0xFF  # damage the deflated data of the second member
+    status, report = ingest(bytes(body))
+    assert status == 400 and 'error' in report
+    assert report['results'][0]['status'] == 'created'
+    assert report['results'][1]['status'] == 'failed'
+    with app.app_context():
+        assert db.session.get(Model3D, report['results'][0]['model_id']) is not None
+
+def test_archives_without_models_or_not_archives():
+    status, report = ingest(make_zip([('notes.txt', b'hello')]))
+    assert status == 400 and report['created'] == 0
+    status, report = ingest(b'this is not an archive')
+    assert status == 400 and 'error' in report
+    whole = make_zip([('a.obj', TRIANGLE), ('b.obj', TRIANGLE * 20)])
+    status, report = ingest(whole[:whole.index(b'b.obj') + 20])  # cut off mid-member
+    assert status == 400 and report['created'] == 1
+
+def test_member_limit():
+    app.config['ARCHIVE_MAX_MEMBERS'] = 2
+    try:
+        status, report = ingest(make_zip([(f'{i}.obj', TRIANGLE + b'#%d' % i) for i in range(4)]))
+    finally:
+        app.config['ARCHIVE_MAX_MEMBERS'] = 2000
+    assert status == 400 and 'more than 2' in report['error']
+    assert report['created'] == 2
+
+def test_login_is_required():
+    response = app.test_client().post('/api/upload/archive', data=make_zip([('a.obj', TRIANGLE)]))
+    assert response.status_code in (302, 401)
+
+def test_stream_zip_yields_small_chunks():
+    content = os.urandom(3 * 1024 * 1024)
+    entries = [archives.ZipEntry('big.bin', lambda: io.BytesIO(content), len(content),
+                                 (2024, 1, 1, 0, 0, 0), False),
+               archives.ZipEntry('text.obj', lambda: io.BytesIO(TRIANGLE * 1000),
+                                 len(TRIANGLE) * 1000, (2024, 1, 1, 0, 0, 0), True)]
+    chunks = list(archives.stream_zip(entries))
+    assert max(len(chunk) for chunk in chunks) <= 4 * archives.READ_SIZE + 1024
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.getinfo('big.bin').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('text.obj').compress_type == zipfile.ZIP_DEFLATED
+        assert archive.read('big.bin') == content
+        assert archive.read('text.obj') == TRIANGLE * 1000
+
+add_user(app, 'stranger')
+stranger = login(app, 'stranger')
+
+def upload(content, filename, is_public='true'):
+    response = owner.post('/api/upload', data={'file': (io.BytesIO(content), filename),
+                                               'is_public': is_public},
+                          content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']
+
+# Binary STL with one triangle: header, count, normal, three corners, attributes
+STL = b'\0' * 80 + struct.pack('<I12fH', 1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0)
+first = upload(TRIANGLE + b'# first\n', 'shared.obj')
+second = upload(TRIANGLE + b'# second\n', 'shared.obj')
+solid = upload(STL, 'zebra.stl')
+private = upload(TRIANGLE + b'# private\n', 'private.obj', is_public='false')
+
+def downloads(model):
+    return owner.get(f"/api/model/{model['id']}").get_json()['model']['downloads']
+
+def fetch(client, **params):
+    response = client.get('/api/download/archive', query_string=params)
+    return response.status_code, response
+
+def test_download_by_ids():
+    before = [downloads(model) for model in (first, second, solid)]
+    status, response = fetch(app.test_client(), ids=f"{first['id']},{second['id']},{solid['id']}")
+    assert status == 200 and response.mimetype == 'application/zip'
+    assert 'attachment' in response.headers['Content-Disposition']
+    assert response.cache_control.no_store
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ['shared.obj', 'shared (2).obj', 'zebra.stl']
+        assert archive.read('shared (2).obj') == TRIANGLE + b'# second\n'
+        assert archive.read('zebra.stl') == STL
+        assert archive.getinfo('shared.obj').compress_type == zipfile.ZIP_DEFLATED
+        assert archive.getinfo('zebra.stl').compress_type == zipfile.ZIP_STORED
+    after = [downloads(model) for model in (first, second, solid)]
+    assert after == [count + 1 for count in before]
+
+def test_json_body_and_owner_access():
+    response = owner.post('/api/download/archive', json={'ids': [private['id']]})
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ['private.obj']
+
+def test_private_and_missing_models_are_refused():
+    ids = f"{first['id']},{private['id']}"
+    for client in (app.test_client(), stranger):
+        status, response = fetch(client, ids=ids)
+        assert status == 403 and response.get_json()['ids'] == [private['id']]
+    status, response = fetch(owner, ids=f"{first['id']},999999")
+    assert status == 404 and response.get_json()['ids'] == [999999]
+
+def test_search_selects_visible_models():
+    status, response = fetch(stranger, search='zebra')
+    assert status == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ['zebra.stl']
+    status, _ = fetch(stranger, search='private')
+    assert status == 404
+
+def test_bad_requests():
+    assert fetch(owner)[0] == 400
+    assert fetch(owner, ids='1,two')[0] == 400
+    for body in ([first['id']], 'ids', {'ids': first['id']}):
+        assert owner.post('/api/download/archive', json=body).status_code == 400, body
+    app.config['DOWNLOAD_ARCHIVE_MAX_MODELS'] = 1
+    try:
+        assert fetch(owner, ids=f"{first['id']},{second['id']}")[0] == 400
+    finally:
+        app.config['DOWNLOAD_ARCHIVE_MAX_MODELS'] = 1000
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,159 @@
+"""
+Checks for the storage backends, run against local disk and against an
+S3 API served by moto (pip install 'moto[server]'; no AWS account needed).
+
+    python -m pytest test_backends.py
+    python test_backends.py
+"""
+import io
+import os
+import time
+import urllib.request
+from urllib.parse import parse_qs, urlsplit
+
+from moto.server import ThreadedMotoServer
+
+from testing import add_user, login, make_app, run_as_script
+from app import storage
+
+BUCKET = 'models-test'
+MESH = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 0 0 1\nf 1 2 3\nf 1 2 4\nf 1 3 4\nf 2 3 4\n'
+MiB = 1024 * 1024
+
+server = ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+server.start()
+ENDPOINT = 'http://%s:%d' % server.get_host_and_port()
+
+S3_SETTINGS = {
+    'STORAGE_BACKEND': 's3',
+    'S3_BUCKET': BUCKET,
+    'S3_PREFIX': 'test/',
+    'S3_ENDPOINT_URL': ENDPOINT,
+    'S3_REGION': 'us-east-1',
+    'S3_ACCESS_KEY_ID': 'testing',
+    'S3_SECRET_ACCESS_KEY': 'testing',
+    # S3's smallest part, so the multipart path runs on modest files
+    'S3_MULTIPART_THRESHOLD': 5 * MiB,
+    'S3_MULTIPART_CHUNKSIZE': 5 * MiB,
+}
+
+local_app = make_app()
+s3_app = make_app(**S3_SETTINGS)
+with s3_app.app_context():
+    storage.get_backend().client.create_bucket(Bucket=BUCKET)
+
+APPS = {'local': local_app, 's3': s3_app}
+
+def fetch(url, **headers):
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+        return response.status, response.headers, response.read()
+
+def scratch_file(content):
+    path = storage.new_tmp_path()
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+def test_put_get_stat_and_delete():
+    for name, app in APPS.items():
+        with app.app_context():
+            backend = storage.get_backend()
+            src_path = scratch_file(MESH)
+            backend.put_file('checks/a/tetra.obj', src_path)
+            assert not os.path.exists(src_path), name  # the source is consumed
+
+            backend.write('checks/b/tetra.obj', io.BytesIO(MESH))
+            for key in ('checks/a/tetra.obj', 'checks/b/tetra.obj'):
+                with backend.open_read(key) as f:
+                    assert f.read() == MESH, name
+                assert backend.stat(key).size == len(MESH), name
+                assert backend.stat(key).last_modified.tzinfo is not None, name
+
+            dst_path = storage.new_tmp_path()
+            backend.download_to('checks/a/tetra.obj', dst_path)
+            with open(dst_path, 'rb') as f:
+                assert f.read() == MESH, name
+            os.remove(dst_path)
+
+            backend.delete('checks/a/tetra.obj')
+            backend.delete('checks/a/tetra.obj')  # missing keys are ignored
+            backend.delete_many(['checks/b/tetra.obj', 'checks/never-written'])
+            assert backend.stat('checks/a/tetra.obj') is None, name
+            assert backend.stat('checks/b/tetra.obj') is None, name
+
+def test_only_local_storage_has_paths():
+    with local_app.app_context():
+        backend = storage.get_backend()
+        assert backend.local_path('blobs/ab/cd/x') == os.path.join(backend.root, 'blobs', 'ab', 'cd', 'x')
+        assert backend.presign('blobs/ab/cd/x') is None
+    with s3_app.app_context():
+        assert storage.get_backend().local_path('blobs/ab/cd/x') is None
+
+def test_presigned_urls_serve_ranges_and_headers():
+    with s3_app.app_context():
+        backend = storage.get_backend()
+        backend.write('checks/tetra.obj', io.BytesIO(MESH))
+        url = backend.presign('checks/tetra.obj', expires=60, download_name='tetra.obj',
+                              content_type='model/obj', as_attachment=True)
+        query = parse_qs(urlsplit(url).query)
+        assert 'Signature' in query or 'X-Amz-Signature' in query
+        if 'Expires' in query:  # SigV2 carries the deadline, SigV4 the lifetime
+            assert 0 < int(query['Expires'][0]) - time.time() <= 61
+        else:
+            assert query['X-Amz-Expires'] == ['60']
+
+    status, headers, body = fetch(url)
+    assert status == 200 and body == MESH
+    assert headers['Content-Type'] == 'model/obj'
+    assert headers['Content-Disposition'] == 'attachment; filename="tetra.obj"'
+
+    status, headers, body = fetch(url, Range='bytes=8-15')
+    assert status == 206
+    assert body == MESH[8:16]
+    assert headers['Content-Range'] == f'bytes 8-15/{len(MESH)}'
+
+def test_large_files_go_up_in_parts():
+    content = os.urandom(11 * MiB)
+    with s3_app.app_context():
+        backend = storage.get_backend()
+        backend.put_file('checks/large.bin', scratch_file(content))
+        head = backend.client.head_object(Bucket=BUCKET, Key='test/checks/large.bin')
+        # Multipart ETags end in -<number of parts>
+        assert head['ETag'].strip('"').endswith('-3')
+        assert backend.stat('checks/large.bin').size == len(content)
+
+        dst_path = storage.new_tmp_path()
+        backend.download_to('checks/large.bin', dst_path)
+        with open(dst_path, 'rb') as f:
+            assert f.read() == content
+        os.remove(dst_path)
+        backend.delete('checks/large.bin')
+
+def test_uploads_through_the_app_land_in_the_bucket():
+    add_user(s3_app, 'owner')
+    client = login(s3_app, 'owner')
+    response = client.post('/api/upload', data={'file': (io.BytesIO(MESH), 'tetra.obj'),
+                                                'is_public': 'true'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    model = response.get_json()['model']
+
+    with s3_app.app_context():
+        key = storage.blob_key(model['content_hash'])
+        listing = storage.get_backend().client.list_objects_v2(Bucket=BUCKET, Prefix='test/')
+        assert f'test/{key}' in {item['Key'] for item in listing['Contents']}
+
+    response = client.get(f"/api/download/{model['id']}")
+    assert response.status_code == 302
+    assert response.headers['Location'].startswith(ENDPOINT)
+    status, headers, body = fetch(response.headers['Location'], Range='bytes=0-6')
+    assert (status, body) == (206, MESH[:7])
+
+    assert client.delete(f"/api/model/{model['id']}").status_code == 200
+    with s3_app.app_context():
+        assert storage.get_backend().stat(key) is None
+
+if __name__ == '__main__':
+    failed = run_as_script(globals())
+    server.stop()
+    raise SystemExit(failed)
@@ -0,0 +1,118 @@
+"""
+Checks for the batch model endpoints (/api/models:batchGet, :batchUpdate
+and :batchDelete): visibility and ownership checks, all-or-nothing
+changes, one query per batch and the blob cleanup after a delete.
+
+    python -m pytest test_batch.py
+    python test_batch.py
+"""
+import io
+
+from testing import add_user, count_queries, login, make_app, run_as_script
+from app import db, storage
+from app.models import Blob, Job, Model3D
+
+app = make_app(API_BATCH_MAX=50)
+add_user(app, 'owner')
+add_user(app, 'other')
+owner = login(app, 'owner')
+other = login(app, 'other')
+
+def upload(client, name, is_public='true', content=None):
+    content = content or b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n# ' + name.encode()
+    response = client.post('/api/upload', data={'file': (io.BytesIO(content), f'{name}.obj'),
+                                                'name': name, 'is_public': is_public},
+                           content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']
+
+public = [upload(owner, f'public-{i}')['id'] for i in range(5)]
+private = upload(owner, 'private', is_public='false')['id']
+theirs = upload(other, 'theirs', is_public='false')['id']
+
+def test_batch_get_keeps_order_and_hides_what_the_caller_cannot_see():
+    ids = [public[3], private, theirs, 999999, public[0]]
+    body = app.test_client().post('/api/models:batchGet', json={'ids': ids}).get_json()
+    assert [model['id'] for model in body['models']] == [public[3], public[0]]
+    assert body['not_found'] == [private, theirs, 999999]
+
+    body = owner.post('/api/models:batchGet', json={'ids': ids + [public[3]]}).get_json()
+    assert [model['id'] for model in body['models']] == [public[3], private, public[0]]
+    assert body['not_found'] == [theirs, 999999]
+
+def test_batch_get_is_one_query():
+    with count_queries(app) as statements:
+        response = app.test_client().post('/api/models:batchGet', json={'ids': public})
+    assert response.status_code == 200
+    assert len([s for s in statements if s.lstrip().upper().startswith('SELECT')]) == 1
+
+def test_bad_batches_are_refused():
+    for body in ({}, {'ids': []}, {'ids': ['1']}, {'ids': [True]}, {'ids': list(range(1, 52))},
+                 [1, 2], 'ids'):
+        response = app.test_client().post('/api/models:batchGet', json=body)
+        assert response.status_code == 400, body
+    for body in ([{'id': public[0]}], {'updates': [{'id': public[0], 'owner': 2}]},
+                 {'updates': [{'id': public[0], 'name': '  '}]},
+                 {'updates': [{'id': public[0], 'is_public': 'no'}]},
+                 {'updates': [{'id': public[0]}, {'id': public[0]}]}):
+        response = owner.post('/api/models:batchUpdate', json=body)
+        assert response.status_code == 400, body
+    assert owner.post('/api/models:batchDelete', json=[public[0]]).status_code == 400
+
+def test_batch_update_is_all_or_nothing():
+    response = owner.post('/api/models:batchUpdate', json={'updates': [
+        {'id': public[1], 'name': 'renamed'}, {'id': theirs, 'is_public': True}]})
+    assert response.status_code == 404 and response.get_json()['not_found'] == [theirs]
+    with app.app_context():
+        assert db.session.get(Model3D, public[1]).name == 'public-1'
+        assert db.session.get(Model3D, theirs).is_public is False
+
+    response = owner.post('/api/models:batchUpdate', json={'updates': [
+        {'id': public[1], 'name': ' renamed ', 'description': 'new'},
+        {'id': private, 'is_public': True}]})
+    assert response.status_code == 200
+    models = response.get_json()['models']
+    assert [(model['id'], model['name']) for model in models] == [(public[1], 'renamed'),
+                                                                   (private, 'private')]
+    assert models[0]['description'] == 'new' and models[1]['is_public']
+
+def test_batch_delete_checks_ownership_and_removes_unused_files():
+    shared = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n# shared\n'
+    kept = upload(owner, 'kept', content=shared)
+    twin = upload(owner, 'twin', content=shared)
+    alone = upload(owner, 'alone')
+
+    response = owner.post('/api/models:batchDelete', json={'ids': [alone['id'], theirs]})
+    assert response.status_code == 404
+    assert app.test_client().get(f"/api/model/{alone['id']}").status_code == 200
+
+    response = owner.post('/api/models:batchDelete', json={'ids': [alone['id'], twin['id']]})
+    assert response.status_code == 200 and response.get_json()['deleted'] == [alone['id'], twin['id']]
+    with app.app_context():
+        assert Model3D.query.filter(Model3D.id.in_([alone['id'], twin['id']])).count() == 0
+        # The shared blob still backs `kept`; the other one is gone with its file
+        assert db.session.get(Blob, kept['content_hash']).ref_count == 1
+        assert db.session.get(Blob, alone['content_hash']) is None
+        assert storage.get_backend().stat(storage.blob_key(alone['content_hash'])) is None
+    assert app.test_client().get(f"/api/download/{kept['id']}").status_code == 200
+
+def test_batch_delete_queues_one_removal_job_when_async():
+    queued = make_app(PIPELINE_ASYNC=True)
+    add_user(queued, 'owner')
+    client = login(queued, 'owner')
+    ids = [upload(client, f'async-{i}')['id'] for i in range(3)]
+    with queued.app_context():
+        Job.query.delete()
+        db.session.commit()
+    assert client.post('/api/models:batchDelete', json={'ids': ids}).status_code == 200
+    with queued.app_context():
+        jobs = Job.query.all()
+        assert [job.kind for job in jobs] == ['remove-files']
+        assert len(jobs[0].arguments['keys']) == 3
+
+def test_login_is_required_to_change():
+    assert app.test_client().post('/api/models:batchUpdate', json={'updates': []}).status_code in (302, 401)
+    assert app.test_client().post('/api/models:batchDelete', json={'ids': [1]}).status_code in (302, 401)
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,50 @@
+"""
+Checks for the response cache: local and shared hits, invalidation when
+a commit changes what a cached response shows, and who may read
+/api/cache/stats.
+
+    python -m pytest test_cache.py
+    python test_cache.py
+"""
+import io
+
+from testing import add_user, login, make_app, run_as_script
+
+app = make_app(CACHE_ENABLED=True, CACHE_SHARED_URL='memory://', ADMIN_USERNAMES={'admin'})
+add_user(app, 'owner')
+add_user(app, 'admin')
+owner = login(app, 'owner')
+
+def upload(name):
+    response = owner.post('/api/upload', data={
+        'file': (io.BytesIO(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n# ' + name.encode()), f'{name}.obj'),
+        'name': name, 'is_public': 'true'}, content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']['id']
+
+def listing():
+    response = app.test_client().get('/api/models')
+    return response.headers['X-Cache'], [model['name'] for model in response.get_json()['models']]
+
+def test_repeated_reads_are_hits():
+    upload('first')
+    assert listing() == ('MISS', ['first'])
+    assert listing() == ('HIT-LOCAL', ['first'])
+
+def test_commits_invalidate_what_they_change():
+    listing()
+    model_id = upload('second')
+    assert listing() == ('MISS', ['second', 'first'])
+    owner.post('/api/models:batchUpdate', json={'updates': [{'id': model_id, 'is_public': False}]})
+    assert listing() == ('MISS', ['first'])
+
+def test_stats_are_for_admins_only():
+    assert app.test_client().get('/api/cache/stats').status_code in (302, 401)
+    assert owner.get('/api/cache/stats').status_code == 403
+    response = login(app, 'admin').get('/api/cache/stats')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['enabled'] and body['shared'] == 'memory'
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,88 @@
+"""
+Checks for the stored gzip/zstd variants of text formats and how they
+are negotiated with Accept-Encoding.
+
+    python -m pytest test_compression.py
+    python test_compression.py
+"""
+import gzip
+import io
+
+from testing import add_user, login, make_app, run_as_script
+from app import compression, storage
+from app.models import Rendition
+
+MESH = b''.join(f'v {i} {i % 5} {i % 9}\n'.encode() for i in range(400)) + \
+    b''.join(f'f {i} {i + 1} {i + 2}\n'.encode() for i in range(1, 398))
+
+app = make_app()
+add_user(app, 'owner')
+owner = login(app, 'owner')
+
+def upload(content, filename):
+    response = owner.post('/api/upload', data={'file': (io.BytesIO(content), filename),
+                                               'is_public': 'true'},
+                          content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']
+
+model = upload(MESH, 'strip.obj')
+DOWNLOAD = f"/api/download/{model['id']}"
+
+def variant_kinds(content_hash):
+    with app.app_context():
+        return {rendition.kind for rendition in Rendition.query.filter_by(content_hash=content_hash)}
+
+def test_text_uploads_get_stored_variants():
+    kinds = variant_kinds(model['content_hash'])
+    assert 'gzip' in kinds
+    assert ('zstd' in kinds) == (compression.zstandard is not None)
+
+def test_gzip_is_served_to_clients_that_accept_it():
+    response = app.test_client().get(DOWNLOAD, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code == 200
+    assert response.content_encoding == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert response.headers['ETag'] == f'"{model["content_hash"]}-gzip"'
+    assert gzip.decompress(response.data) == MESH
+
+def test_identity_without_accept_encoding():
+    for headers in ({}, {'Accept-Encoding': 'identity'}, {'Accept-Encoding': 'gzip;q=0'}):
+        response = app.test_client().get(DOWNLOAD, headers=headers)
+        assert response.content_encoding is None, headers
+        assert response.data == MESH
+        assert 'Accept-Encoding' in response.vary
+
+def test_ranges_always_address_the_original_bytes():
+    response = app.test_client().get(DOWNLOAD, headers={'Accept-Encoding': 'gzip',
+                                                        'Range': 'bytes=0-9'})
+    assert response.status_code == 206
+    assert response.content_encoding is None
+    assert response.data == MESH[:10]
+
+def test_variant_etag_revalidates():
+    headers = {'Accept-Encoding': 'gzip'}
+    etag = app.test_client().get(DOWNLOAD, headers=headers).headers['ETag']
+    response = app.test_client().get(DOWNLOAD, headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+
+def test_small_and_non_text_files_are_left_alone():
+    # Too small for gzip to save MIN_SAVING, so no variant is kept
+    tiny = upload(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n', 'tiny.obj')
+    assert not variant_kinds(tiny['content_hash']) & {'gzip', 'zstd'}
+
+    ascii_stl = (b'solid t\nfacet normal 0 0 1\nouter loop\nvertex 0 0 0\nvertex 1 0 0\n'
+                 b'vertex 0 1 0\nendloop\nendfacet\nendsolid t\n') * 20
+    stl = upload(ascii_stl, 'tri.stl')
+    assert not variant_kinds(stl['content_hash']) & {'gzip', 'zstd'}
+
+def test_compress_variants_is_idempotent():
+    with app.app_context():
+        before = Rendition.query.filter_by(content_hash=model['content_hash']).count()
+        compression.compress_variants(model['content_hash'], 'obj')
+        assert Rendition.query.filter_by(content_hash=model['content_hash']).count() == before
+        gz = Rendition.query.filter_by(content_hash=model['content_hash'], kind='gzip').one()
+        assert storage.get_backend().stat(gz.key) is not None
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,109 @@
+"""
+Checks for the write-behind download counters: buffering, merged reads,
+the batched flush, retries after a failed flush and the no-interval mode.
+
+    python -m pytest test_counters.py
+    python test_counters.py
+"""
+import io
+import threading
+
+from testing import add_user, count_queries, login, make_app, run_as_script
+from app import counters, db
+from app.models import DownloadEvent, Model3D
+
+TRIANGLE = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'
+
+# A long interval: nothing is flushed unless a test asks for it
+app = make_app(DOWNLOAD_COUNTER_FLUSH_INTERVAL=3600, DOWNLOAD_COUNTER_MAX_PENDING=1000)
+add_user(app, 'owner')
+owner = login(app, 'owner')
+
+def upload(content, filename):
+    response = owner.post('/api/upload', data={'file': (io.BytesIO(content), filename),
+                                               'is_public': 'true'},
+                          content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']['id']
+
+first = upload(TRIANGLE + b'# first\n', 'first.obj')
+second = upload(TRIANGLE + b'# second\n', 'second.obj')
+
+def download(model_id):
+    response = app.test_client().get(f'/api/download/{model_id}')
+    assert response.status_code == 200
+    response.close()
+
+def stored(model_id):
+    with app.app_context():
+        return db.session.get(Model3D, model_id).downloads or 0
+
+def buffer():
+    with app.app_context():
+        return counters.get_buffer()
+
+def test_downloads_are_buffered_and_merged_into_reads():
+    buffer().flush()
+    before = stored(first)
+    total = app.test_client().get('/api/stats').get_json()['total_downloads']
+    download(first)
+    download(first)
+
+    assert stored(first) == before
+    assert app.test_client().get(f'/api/model/{first}').get_json()['model']['downloads'] == before + 2
+    assert app.test_client().get('/api/stats').get_json()['total_downloads'] == total + 2
+
+    assert buffer().flush() == 2
+    assert stored(first) == before + 2
+    assert buffer().total_unflushed() == 0
+    assert app.test_client().get('/api/stats').get_json()['total_downloads'] == total + 2
+
+def test_one_update_per_flush():
+    buffer().flush()
+    with app.app_context():
+        events = DownloadEvent.query.count()
+    before = stored(first), stored(second)
+    with app.app_context():
+        counters.record_downloads([first, second, first])
+    with count_queries(app) as statements:
+        assert buffer().flush() == 3
+    updates = [statement for statement in statements if statement.startswith('UPDATE model3_d')]
+    assert len(updates) == 1 and 'CASE' in updates[0]
+    assert (stored(first), stored(second)) == (before[0] + 2, before[1] + 1)
+    with app.app_context():
+        assert DownloadEvent.query.count() == events + 3
+
+def test_failed_flush_keeps_the_counts():
+    buffer().flush()
+    before = stored(second)
+    with app.app_context():
+        counters.record_downloads([second])
+    saved = counters.write_deltas
+
+    def broken(deltas, events=None):
+        raise RuntimeError('database is down')
+    counters.write_deltas = broken
+    try:
+        assert buffer().flush() == 0
+    finally:
+        counters.write_deltas = saved
+    assert buffer().unflushed(second) == 1
+    assert buffer().flush() == 1
+    assert stored(second) == before + 1
+
+def test_no_interval_writes_through_without_a_thread():
+    direct = make_app(DOWNLOAD_COUNTER_FLUSH_INTERVAL=0)
+    add_user(direct, 'owner')
+    response = login(direct, 'owner').post(
+        '/api/upload', data={'file': (io.BytesIO(TRIANGLE), 'tri.obj'), 'is_public': 'true'},
+        content_type='multipart/form-data')
+    model_id = response.get_json()['model']['id']
+    threads = threading.active_count()
+    direct.test_client().get(f'/api/download/{model_id}').close()
+    assert threading.active_count() == threads
+    with direct.app_context():
+        assert db.session.get(Model3D, model_id).downloads == 1
+        assert counters.get_buffer().total_unflushed() == 0
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
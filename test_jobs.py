@@ -0,0 +1,152 @@
+"""
+Checks for the database job queue: dedupe, claims, retries, heartbeats
+and stale jobs, periodic jobs and the post-upload pipeline.
+
+    python -m pytest test_jobs.py
+    python test_jobs.py
+"""
+import io
+import time
+from datetime import datetime, timedelta
+
+from config import Config
+from testing import add_user, login, make_app, run_as_script
+from app import db, jobs
+from app.models import Job, Model3D
+
+calls = []
+
+def record(value, fail=False):
+    calls.append(value)
+    if fail:
+        raise RuntimeError(f'failed on {value}')
+
+jobs.register('test-record', record)
+
+app = make_app(PIPELINE_ASYNC=True, JOB_MAX_ATTEMPTS=2, JOB_RETRY_BACKOFF=10, JOB_TIMEOUT=300)
+
+def reset():
+    calls.clear()
+    with app.app_context():
+        Job.query.delete()
+        db.session.commit()
+
+def test_dedupe_key_holds_until_claimed():
+    reset()
+    with app.app_context():
+        assert jobs.enqueue('test-record', dedupe_key='k', value=1) is not None
+        assert jobs.enqueue('test-record', dedupe_key='k', value=2) is None
+        assert jobs.enqueue_many([('test-record', 'k', {'value': 3}),
+                                  ('test-record', 'other', {'value': 4})]) == 1
+        job = jobs.claim(['test-record'], 'w1')
+        assert job.arguments == {'value': 1} and job.state == 'running'
+        # Once running, the same work may be queued again
+        assert jobs.enqueue('test-record', dedupe_key='k', value=5) is not None
+
+def test_unknown_kinds_are_refused():
+    with app.app_context():
+        try:
+            jobs.enqueue('no-such-kind')
+        except ValueError:
+            return
+    raise AssertionError('unknown kind queued')
+
+def test_failures_back_off_then_fail():
+    reset()
+    with app.app_context():
+        jobs.enqueue('test-record', value=1, fail=True)
+        assert jobs.run_due('w1', ['test-record']) == 1
+        job = Job.query.one()
+        assert job.state == 'queued' and 'failed on 1' in job.last_error
+        assert job.run_after > datetime.utcnow() + timedelta(seconds=5)
+        assert jobs.run_due('w1', ['test-record']) == 0  # not due yet
+
+        job.run_after = datetime.utcnow()
+        db.session.commit()
+        assert jobs.run_due('w1', ['test-record']) == 1
+        assert Job.query.one().state == 'failed'
+        assert calls == [1, 1]
+
+def test_heartbeats_keep_long_jobs_running():
+    reset()
+    with app.app_context():
+        jobs.enqueue('test-record', value=1)
+        jobs.enqueue('test-record', value=2)
+        alive = jobs.claim(['test-record'], 'w1')
+        dead = jobs.claim(['test-record'], 'w2')
+        long_ago = datetime.utcnow() - timedelta(hours=2)
+        Job.query.update({Job.started_at: long_ago, Job.heartbeat_at: long_ago})
+        db.session.commit()
+
+        # w1 is still working on its job; w2 went away
+        assert jobs.heartbeat([alive.id, dead.id], 'w1') == 1
+        assert jobs.requeue_stale() == 1
+        assert db.session.get(Job, alive.id).state == 'running'
+        requeued = db.session.get(Job, dead.id)
+        assert requeued.state == 'queued' and requeued.locked_by is None
+        assert requeued.last_error == 'Worker stopped responding'
+
+def test_late_results_from_a_replaced_worker_are_dropped():
+    reset()
+    with app.app_context():
+        jobs.enqueue('test-record', value=1)
+        job = jobs.claim(['test-record'], 'w1')
+        Job.query.update({Job.heartbeat_at: datetime.utcnow() - timedelta(hours=1)})
+        db.session.commit()
+        jobs.requeue_stale()
+        job.run_after = datetime.utcnow()
+        db.session.commit()
+        assert jobs.claim(['test-record'], 'w2').id == job.id
+
+        jobs.finish(job.id, error='too late', worker_id='w1')
+        assert db.session.get(Job, job.id).state == 'running'
+        jobs.finish(job.id, worker_id='w2')
+        assert db.session.get(Job, job.id).state == 'succeeded'
+
+def test_periodic_jobs_are_queued_once_per_interval():
+    reset()
+    with app.app_context():
+        jobs.enqueue_periodic()
+        queued = {job.kind for job in Job.query}
+        assert {'expire-uploads', 'reconcile-stats', 'compact-downloads'} <= queued
+        count = Job.query.count()
+        jobs.enqueue_periodic()
+        assert Job.query.count() == count
+
+def test_uploads_queue_each_pipeline_stage():
+    reset()
+    add_user(app, 'owner')
+    response = login(app, 'owner').post(
+        '/api/upload', data={'file': (io.BytesIO(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'), 'tri.obj'),
+                             'is_public': 'true'},
+        content_type='multipart/form-data')
+    assert response.status_code == 201
+    model_id = response.get_json()['model']['id']
+    with app.app_context():
+        assert {job.kind for job in Job.query} == {'metadata', 'compress', 'render'}
+        assert db.session.get(Model3D, model_id).face_count is None
+        assert jobs.run_due('w1') == 3
+        assert db.session.get(Model3D, model_id).face_count == 1
+
+def test_the_web_process_runs_queued_jobs_outside_the_request():
+    assert Config.PIPELINE_ASYNC and Config.INLINE_WORKER
+    web = make_app(PIPELINE_ASYNC=True)
+    add_user(web, 'owner')
+    jobs.start_inline_runner(web)
+    response = login(web, 'owner').post(
+        '/api/upload', data={'file': (io.BytesIO(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n# inline\n'),
+                                      'tri.obj'), 'is_public': 'true'},
+        content_type='multipart/form-data')
+    assert response.status_code == 201
+    model_id = response.get_json()['model']['id']
+    assert response.get_json()['model']['face_count'] is None
+    deadline = time.monotonic() + 20
+    with web.app_context():
+        while db.session.get(Model3D, model_id).face_count is None:
+            assert time.monotonic() < deadline, 'inline runner did not process the upload'
+            db.session.rollback()
+            time.sleep(0.1)
+        assert db.session.get(Model3D, model_id).face_count == 1
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
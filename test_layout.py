@@ -0,0 +1,89 @@
+"""
+Checks for the sharded layout of legacy (pre blob store) upload files and
+the online `flask migrate-uploads` move.
+
+    python -m pytest test_layout.py
+    python test_layout.py
+"""
+import os
+
+from testing import add_user, make_app, run_as_script
+from app import db, storage
+from app.models import Model3D
+
+MESH = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'
+
+app = make_app()
+owner_id = add_user(app, 'owner')
+
+def legacy_model(filename, content=MESH):
+    """A model row and file as written before the blob store: flat in
+    UPLOAD_FOLDER, named after the stored file"""
+    with app.app_context():
+        with open(storage.get_backend().local_path(filename), 'wb') as f:
+            f.write(content)
+        model = Model3D(name=filename, filename=filename, original_filename='tri.obj',
+                        file_size=len(content), file_extension='obj', is_public=True,
+                        user_id=owner_id)
+        db.session.add(model)
+        db.session.commit()
+        return model.id
+
+def test_sharded_keys_fan_out_in_two_levels():
+    with app.app_context():
+        key = storage.sharded_key('abc.obj')
+        files_dir, first, second, name = key.split('/')
+        assert files_dir == storage.FILES_DIR
+        assert len(first) == len(second) == 2
+        assert name == 'abc.obj'
+        assert storage.sharded_key('abc.obj') == key
+        assert storage.sharded_key('abd.obj') != key
+
+def test_migration_moves_files_and_keeps_serving():
+    ids = [legacy_model(f'legacy-{i}.obj', MESH + f'# {i}\n'.encode()) for i in range(5)]
+    client = app.test_client()
+    assert client.get(f'/api/download/{ids[0]}').status_code == 200
+
+    with app.app_context():
+        batches = list(storage.migrate_flat_files(batch_size=2))
+        assert batches == [2, 2, 1]
+        backend = storage.get_backend()
+        for model_id in ids:
+            model = db.session.get(Model3D, model_id)
+            assert model.filename == storage.sharded_key(model.name)
+            assert os.path.exists(backend.local_path(model.filename))
+            assert not os.path.exists(backend.local_path(model.name))
+        # Nothing left to move the second time
+        assert list(storage.migrate_flat_files(batch_size=2)) == []
+
+    for index, model_id in enumerate(ids):
+        response = client.get(f'/api/download/{model_id}')
+        assert response.status_code == 200
+        assert response.data == MESH + f'# {index}\n'.encode()
+
+def test_rows_loaded_before_the_move_still_resolve():
+    model_id = legacy_model('stale-row.obj')
+    with app.app_context():
+        stale = db.session.get(Model3D, model_id)
+        db.session.expunge(stale)
+        list(storage.migrate_flat_files())
+        # The detached row still names the flat file, which is gone
+        assert stale.filename == 'stale-row.obj'
+        assert storage.resolve_model_key(stale) == storage.sharded_key('stale-row.obj')
+
+def test_missing_files_resolve_to_none_without_listing_the_folder():
+    model_id = legacy_model('gone.obj')
+    with app.app_context():
+        os.remove(storage.get_backend().local_path('gone.obj'))
+        model = db.session.get(Model3D, model_id)
+        assert storage.resolve_model_key(model) is None
+        original_listdir = os.listdir
+        os.listdir = None  # any directory scan would blow up here
+        try:
+            response = app.test_client().get(f'/api/view/{model_id}')
+        finally:
+            os.listdir = original_listdir
+    assert response.status_code == 404
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
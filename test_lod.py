@@ -0,0 +1,125 @@
+"""
+Checks for decimated LOD renditions and the ?lod= parameter of /api/view.
+
+    python -m pytest test_lod.py
+    python test_lod.py
+"""
+import io
+
+import numpy as np
+
+from testing import add_user, login, make_app, run_as_script
+from app import lod, meshes, storage
+from app.models import Rendition
+
+def sphere(rings=80, segments=100):
+    """A closed UV sphere with about 2 * rings * segments faces"""
+    theta = np.linspace(0, np.pi, rings + 1)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    t, p = np.meshgrid(theta, phi, indexing='ij')
+    ring_points = np.stack([np.sin(t) * np.cos(p), np.sin(t) * np.sin(p), np.cos(t)], axis=-1)
+    positions = np.concatenate([[[0, 0, 1]], ring_points.reshape(-1, 3), [[0, 0, -1]]])
+
+    def at(ring, segment):
+        return 1 + ring * segments + segment % segments
+    faces = [(0, at(0, s), at(0, s + 1)) for s in range(segments)]
+    for r in range(rings - 2):
+        for s in range(segments):
+            faces += [(at(r, s), at(r + 1, s), at(r + 1, s + 1)),
+                      (at(r, s), at(r + 1, s + 1), at(r, s + 1))]
+    bottom = len(positions) - 1
+    faces += [(bottom, at(rings - 2, s + 1), at(rings - 2, s)) for s in range(segments)]
+    return meshes.Mesh(positions.astype(np.float32), np.array(faces, dtype=np.int64))
+
+BALL = sphere()
+BALL_OBJ = b''.join(b'v %.6f %.6f %.6f\n' % tuple(point) for point in BALL.positions) + \
+    b''.join(b'f %d %d %d\n' % tuple(face + 1) for face in BALL.faces)
+
+def test_simplify_hits_its_target_and_keeps_the_shape():
+    for target in (2000, 400):
+        simple = lod.simplify(BALL, target)
+        assert 0.5 * target <= len(simple.faces) <= 1.1 * target, len(simple.faces)
+        radius = np.linalg.norm(simple.positions, axis=1)
+        assert np.all(np.abs(radius - 1) < 0.1)
+        assert len(meshes.compact(simple).faces) == len(simple.faces)
+
+def test_simplify_keeps_vertex_colors():
+    # Red on the northern half, blue on the southern one
+    north = BALL.positions[:, 2:3] > 0
+    painted = BALL._replace(colors=np.where(north, [1, 0, 0], [0, 0, 1]).astype(np.float32))
+    simple = lod.simplify(painted, 2000)
+    assert simple.colors is not None and len(simple.colors) == len(simple.positions)
+    assert simple.uvs is None
+    far_north = simple.positions[:, 2] > 0.5
+    assert np.allclose(simple.colors[far_north], [1, 0, 0])
+    assert np.allclose(simple.colors[simple.positions[:, 2] < -0.5], [0, 0, 1])
+
+app = make_app()
+add_user(app, 'owner')
+owner = login(app, 'owner')
+
+def upload(content, filename):
+    response = owner.post('/api/upload', data={'file': (io.BytesIO(content), filename),
+                                               'is_public': 'true'},
+                          content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']
+
+ball = upload(BALL_OBJ, 'ball.obj')
+small = upload(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 0 0 1\nf 1 2 3\nf 1 2 4\nf 1 3 4\nf 2 3 4\n', 'tetra.obj')
+
+def served_faces(model, lod_param):
+    response = app.test_client().get(f"/api/view/{model['id']}", query_string={'lod': lod_param})
+    assert response.status_code == 200, response.data[:500]
+    assert response.mimetype == 'model/gltf-binary'
+    with app.app_context():
+        path = storage.new_tmp_path()
+    with open(path, 'wb') as f:
+        f.write(response.data)
+    return len(meshes.load_mesh(path, 'glb').faces), response.headers['ETag']
+
+def test_levels_are_stored_for_heavy_meshes_only():
+    assert len(BALL.faces) > lod.MIN_LOD_FACES
+    with app.app_context():
+        kinds = {r.kind for r in Rendition.query.filter_by(content_hash=ball['content_hash'])}
+        assert {'lod1', 'lod2'} <= kinds
+        kinds = {r.kind for r in Rendition.query.filter_by(content_hash=small['content_hash'])}
+        assert not kinds & {'lod1', 'lod2'}
+
+def test_view_serves_each_level():
+    full, full_etag = served_faces(ball, 0)
+    lod1, lod1_etag = served_faces(ball, 1)
+    lod2, _ = served_faces(ball, 2)
+    assert full == len(BALL.faces)
+    assert lod2 < lod1 < full
+    assert full_etag != lod1_etag
+
+def test_browse_cards_keep_vertex_colors():
+    colored = upload(b''.join(b'v %.6f %.6f %.6f 0.2 0.6 0.4\n' % tuple(point)
+                              for point in BALL.positions) +
+                     b''.join(b'f %d %d %d\n' % tuple(face + 1) for face in BALL.faces), 'green.obj')
+    response = app.test_client().get(f"/api/view/{colored['id']}", query_string={'lod': 2})
+    assert response.status_code == 200
+    with app.app_context():
+        path = storage.new_tmp_path()
+    with open(path, 'wb') as f:
+        f.write(response.data)
+    simple = meshes.load_mesh(path, 'glb')
+    assert len(simple.faces) < len(BALL.faces) / 10
+    assert np.allclose(simple.colors[:, :3], [0.2, 0.6, 0.4], atol=1e-3)
+
+def test_levels_past_the_coarsest_get_the_coarsest():
+    coarsest = served_faces(ball, len(lod.LOD_LEVELS))
+    assert served_faces(ball, len(lod.LOD_LEVELS) + 1) == coarsest
+    assert served_faces(ball, 100000) == coarsest
+    with app.app_context():
+        assert lod.pick_rendition(ball['content_hash'], 10 ** 9).kind == lod.lod_kind(len(lod.LOD_LEVELS))
+
+def test_light_meshes_fall_back_to_the_glb():
+    assert served_faces(small, 2)[0] == 4
+
+def test_negative_levels_are_refused():
+    assert app.test_client().get(f"/api/view/{ball['id']}?lod=-1").status_code == 400
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
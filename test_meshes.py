@@ -0,0 +1,196 @@
+"""
+Checks for the mesh readers, the GLB writer and the conversion stage:
+what parses, what is refused as MeshError and what survives into the GLB.
+
+    python -m pytest test_meshes.py
+    python test_meshes.py
+"""
+import io
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from testing import add_user, login, make_app, run_as_script
+from app import conversion, meshes, storage
+from app.models import Rendition
+
+TETRA_OBJ = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 0 0 1\nf 1 2 3\nf 1 2 4\nf 1 3 4\nf 2 3 4\n'
+
+def write_temp(content, suffix):
+    handle, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(handle, 'wb') as f:
+        f.write(content)
+    return path
+
+def load(content, extension):
+    path = write_temp(content, '.' + extension)
+    try:
+        return meshes.load_mesh(path, extension)
+    finally:
+        os.remove(path)
+
+def round_trip(mesh, flat=False):
+    path = write_temp(b'', '.glb')
+    try:
+        meshes.write_glb(mesh, path, flat=flat)
+        return meshes.load_mesh(path, 'glb')
+    finally:
+        os.remove(path)
+
+def refused(content, extension):
+    try:
+        load(content, extension)
+    except meshes.MeshError:
+        return True
+    return False
+
+def binary_stl(triangles):
+    records = np.zeros(len(triangles), dtype=meshes.STL_TRIANGLE)
+    records['vertices'] = triangles
+    return b'\0' * 80 + struct.pack('<I', len(triangles)) + records.tobytes()
+
+CUBE_CORNERS = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=np.float32)
+CUBE_FACES = [(0, 1, 3), (0, 3, 2), (4, 6, 7), (4, 7, 5), (0, 4, 5), (0, 5, 1),
+              (2, 3, 7), (2, 7, 6), (0, 2, 6), (0, 6, 4), (1, 5, 7), (1, 7, 3)]
+CUBE_STL = binary_stl(CUBE_CORNERS[np.array(CUBE_FACES)])
+
+def test_obj_polygons_and_negative_indices():
+    mesh = load(b'v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nf -4 -3 -2 -1\n', 'obj')
+    assert mesh.faces.tolist() == [[0, 1, 2], [0, 2, 3]]
+    assert mesh.colors is None and mesh.uvs is None
+
+def test_stl_ascii_and_binary_agree():
+    ascii_stl = b'solid cube\n' + b''.join(
+        b'facet normal 0 0 0\nouter loop\n'
+        + b''.join(b'vertex %g %g %g\n' % tuple(CUBE_CORNERS[i]) for i in face)
+        + b'endloop\nendfacet\n' for face in CUBE_FACES) + b'endsolid cube\n'
+    for content in (ascii_stl, CUBE_STL):
+        mesh = load(content, 'stl')
+        assert len(mesh.positions) == 8  # corners welded
+        assert len(mesh.faces) == 12
+
+def test_ply_ascii_and_binary_with_colors():
+    header = ('ply\nformat {}\nelement vertex 3\nproperty float x\nproperty float y\n'
+              'property float z\nproperty uchar red\nproperty uchar green\nproperty uchar blue\n'
+              'element face 1\nproperty list uchar int vertex_indices\nend_header\n')
+    ascii_ply = header.format('ascii 1.0').encode() + \
+        b'0 0 0 255 0 0\n1 0 0 0 255 0\n0 1 0 0 0 255\n3 0 1 2\n'
+    vertices = np.array([(0, 0, 0, 255, 0, 0), (1, 0, 0, 0, 255, 0), (0, 1, 0, 0, 0, 255)],
+                        dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                               ('r', 'u1'), ('g', 'u1'), ('b', 'u1')])
+    binary_ply = header.format('binary_little_endian 1.0').encode() + vertices.tobytes() + \
+        struct.pack('<Biii', 3, 0, 1, 2)
+    for content in (ascii_ply, binary_ply):
+        mesh = load(content, 'ply')
+        assert mesh.faces.tolist() == [[0, 1, 2]]
+        assert np.allclose(mesh.colors, np.eye(3))
+
+def test_malformed_files_raise_mesh_error():
+    assert refused(b'v 0 0 0\nv 1 0 zero\nv 0 1 0\nf 1 2 3\n', 'obj')
+    assert refused(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 7\n', 'obj')
+    assert refused(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 -9\n', 'obj')
+    assert refused(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 x\n', 'obj')
+    assert refused(b'v 0 0 0\nv 1 0 0\nv 0 1 0\n', 'obj')
+    assert refused(b'solid x\nfacet normal 0 0 1\nouter loop\nvertex 0 0 0\nvertex 1 0 nope\n'
+                   b'vertex 0 1 0\nendloop\nendfacet\nendsolid x\n', 'stl')
+    assert refused(b'ply\nformat ascii 1.0\nelement vertex 3\nproperty float x\nproperty float y\n'
+                   b'property float z\nelement face 1\nproperty list uchar int vertex_indices\n'
+                   b'end_header\n0 0 0\n1 0 0\n0 1 0\n3 0 1 5\n', 'ply')
+    assert refused(b'ply\nformat ascii 1.0\nelement vertex two\nend_header\n', 'ply')
+    assert refused(b'ply\nformat ascii 1.0\nelement vertex 1\nproperty quad x\nend_header\n', 'ply')
+    assert refused(struct.pack('<III', meshes.GLB_MAGIC, 2, 30) + struct.pack('<II', 10, meshes.CHUNK_JSON)
+                   + b'{"meshes":', 'glb')
+    assert refused(b'', 'stl')
+
+def test_obj_uvs_and_colors_survive_the_glb():
+    obj = (b'v 0 0 0 1 0 0\nv 1 0 0 0 1 0\nv 1 1 0 0 0 1\nv 0 1 0 1 1 1\n'
+           b'vt 0 0\nvt 1 0\nvt 1 1\nvt 0 1\nvt 0.5 0.5\n'
+           b'f 1/1 2/2 3/3\nf 1/5 3/3 4/4\n')
+    mesh = load(obj, 'obj')
+    # Vertex 1 is used with two uvs, so it is split in two
+    assert len(mesh.positions) == 5
+    assert mesh.colors.shape == (5, 3)
+    corner_uvs = mesh.uvs[mesh.faces]
+    assert np.allclose(corner_uvs[0], [[0, 1], [1, 1], [1, 0]])  # v flipped for glTF
+    assert np.allclose(corner_uvs[1][0], [0.5, 0.5])
+
+    glb = round_trip(mesh)
+    assert np.allclose(glb.uvs[glb.faces], corner_uvs)
+    assert np.allclose(glb.colors[glb.faces], mesh.colors[mesh.faces])
+    assert np.allclose(glb.positions[glb.faces], mesh.positions[mesh.faces])
+
+def test_obj_without_uvs_on_every_corner_keeps_shared_vertices():
+    mesh = load(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 1 1 0\nvt 0 0\nf 1/1 2/1 3/1\nf 2 4 3\n', 'obj')
+    assert len(mesh.positions) == 4
+    assert mesh.uvs is None
+
+def test_stl_keeps_hard_edges():
+    mesh = load(CUBE_STL, 'stl')
+    glb_path = write_temp(b'', '.glb')
+    try:
+        meshes.write_glb(mesh, glb_path, flat=True)
+        gltf, _ = meshes.read_glb_container(glb_path)
+        flat = meshes.load_mesh(glb_path, 'glb')
+    finally:
+        os.remove(glb_path)
+    # No normals to average across edges: viewers shade each face flat,
+    # and the corners stay welded
+    assert 'NORMAL' not in gltf['meshes'][0]['primitives'][0]['attributes']
+    assert len(flat.positions) == 8 and len(flat.faces) == 12
+
+    smooth = round_trip(mesh)
+    assert len(smooth.positions) == 8
+
+app = make_app()
+add_user(app, 'owner')
+
+def upload(content, filename):
+    response = login(app, 'owner').post(
+        '/api/upload', data={'file': (io.BytesIO(content), filename), 'is_public': 'true'},
+        content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']
+
+def glb_rendition(content_hash):
+    with app.app_context():
+        return Rendition.query.filter_by(content_hash=content_hash,
+                                         kind=conversion.GLB_KIND).first()
+
+def test_conversion_skips_malformed_uploads():
+    model = upload(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 9\n', 'broken.obj')
+    assert glb_rendition(model['content_hash']) is None
+    # The original is still what the viewer gets
+    response = app.test_client().get(f"/api/view/{model['id']}")
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+
+def test_view_serves_the_converted_glb():
+    model = upload(CUBE_STL, 'cube.stl')
+    rendition = glb_rendition(model['content_hash'])
+    assert rendition is not None
+    response = app.test_client().get(f"/api/view/{model['id']}")
+    assert response.mimetype == 'model/gltf-binary'
+    assert response.data[:4] == b'glTF'
+    with app.app_context():
+        with storage.local_copy(rendition.key) as path:
+            assert len(meshes.load_mesh(path, 'glb').positions) == 8
+
+def test_stl_glb_is_smaller_than_the_stl():
+    # A 40x40 height field: 3200 triangles sharing 1681 vertices
+    n = 40
+    x, y = np.meshgrid(np.arange(n + 1), np.arange(n + 1))
+    grid = np.stack([x, y, np.sin(x) * np.cos(y)], axis=-1).reshape(-1, 3).astype(np.float32)
+    cell = (np.arange(n)[:, None] * (n + 1) + np.arange(n)[None, :]).ravel()
+    faces = np.concatenate([np.stack([cell, cell + 1, cell + n + 2], axis=1),
+                            np.stack([cell, cell + n + 2, cell + n + 1], axis=1)])
+    stl = binary_stl(grid[faces])
+    model = upload(stl, 'terrain.stl')
+    response = app.test_client().get(f"/api/view/{model['id']}")
+    assert response.mimetype == 'model/gltf-binary'
+    # Welded vertices without normals; a flat GLB would be larger than the STL
+    assert len(response.data) < len(stl) / 2
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,129 @@
+"""
+Checks for geometry metadata: what the extractor computes per format,
+how it lands on Model3D and the /api/models filters and sorts using it.
+
+    python -m pytest test_metadata.py
+    python test_metadata.py
+"""
+import io
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from testing import add_user, login, make_app, run_as_script
+from app import db, metadata, meshes
+from app.models import Model3D
+
+def unit_cube(scale):
+    corners = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)],
+                       dtype=np.float32) * scale
+    faces = [(0, 1, 3), (0, 3, 2), (4, 6, 7), (4, 7, 5), (0, 4, 5), (0, 5, 1),
+             (2, 3, 7), (2, 7, 6), (0, 2, 6), (0, 6, 4), (1, 5, 7), (1, 7, 3)]
+    return corners, np.array(faces)
+
+def cube_stl(scale):
+    corners, faces = unit_cube(scale)
+    records = np.zeros(len(faces), dtype=meshes.STL_TRIANGLE)
+    records['vertices'] = corners[faces]
+    return b'\0' * 80 + struct.pack('<I', len(faces)) + records.tobytes()
+
+def cube_obj(scale):
+    corners, faces = unit_cube(scale)
+    return b''.join(b'v %g %g %g\n' % tuple(corner) for corner in corners) + \
+        b''.join(b'f %d %d %d\n' % tuple(face + 1) for face in faces)
+
+def extract(content, extension):
+    handle, path = tempfile.mkstemp(suffix='.' + extension)
+    with os.fdopen(handle, 'wb') as f:
+        f.write(content)
+    try:
+        return metadata.extract(path, extension)
+    finally:
+        os.remove(path)
+
+def test_cube_metadata_for_every_format():
+    corners, faces = unit_cube(2)
+    handle, glb_path = tempfile.mkstemp(suffix='.glb')
+    os.close(handle)
+    meshes.write_glb(meshes.Mesh(corners, faces), glb_path)
+    with open(glb_path, 'rb') as f:
+        glb = f.read()
+    os.remove(glb_path)
+
+    ply = (b'ply\nformat ascii 1.0\nelement vertex 8\nproperty float x\nproperty float y\n'
+           b'property float z\nelement face 12\nproperty list uchar int vertex_indices\nend_header\n'
+           + b''.join(b'%g %g %g\n' % tuple(corner) for corner in corners)
+           + b''.join(b'3 %d %d %d\n' % tuple(face) for face in faces))
+
+    for content, extension in ((cube_stl(2), 'stl'), (cube_obj(2), 'obj'), (ply, 'ply'), (glb, 'glb')):
+        info = extract(content, extension)
+        assert info.vertex_count == 8, extension
+        assert info.face_count == 12, extension
+        assert info.bbox_min == [0, 0, 0] and info.bbox_max == [2, 2, 2], extension
+        assert abs(info.surface_area - 24) < 1e-6, extension
+
+def test_stl_batches_give_the_same_answer():
+    content = cube_stl(3)
+    whole = extract(content, 'stl')
+    saved = metadata.STL_BATCH
+    metadata.STL_BATCH = 5  # several batches sharing corners
+    try:
+        assert extract(content, 'stl') == whole
+    finally:
+        metadata.STL_BATCH = saved
+
+def test_units_guess():
+    assert metadata.guess_units(2.0, 'obj') == 'm'
+    assert metadata.guess_units(150.0, 'obj') == 'cm'
+    assert metadata.guess_units(150.0, 'stl') == 'mm'
+    assert metadata.guess_units(5000.0, 'ply') == 'mm'
+    assert metadata.guess_units(5000.0, 'glb') == 'm'
+    assert metadata.guess_units(0.0, 'obj') is None
+
+app = make_app()
+add_user(app, 'owner')
+owner = login(app, 'owner')
+
+def upload(content, filename):
+    response = owner.post('/api/upload', data={'file': (io.BytesIO(content), filename),
+                                               'is_public': 'true'},
+                          content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']
+
+small = upload(cube_stl(1), 'small.stl')
+large = upload(cube_obj(500), 'large.obj')
+detailed = upload(b''.join(b'v %d %d 0\n' % (i, i % 2) for i in range(40))
+                  + b''.join(b'f %d %d %d\n' % (i, i + 1, i + 2) for i in range(1, 39)), 'strip.obj')
+
+def listed(**params):
+    response = app.test_client().get('/api/models', query_string=params)
+    assert response.status_code == 200, response.data[:500]
+    return [model['id'] for model in response.get_json()['models']]
+
+def test_metadata_is_stored_and_exposed():
+    model = app.test_client().get(f"/api/model/{large['id']}").get_json()['model']
+    assert model['vertex_count'] == 8
+    assert model['face_count'] == 12
+    assert model['units_guess'] == 'cm'
+    assert model['bounding_box'] == {'min': [0, 0, 0], 'max': [500, 500, 500]}
+    assert abs(model['surface_area'] - 6 * 500 ** 2) < 1
+
+def test_reuploads_copy_the_stored_values():
+    again = upload(cube_stl(1), 'copy.stl')
+    with app.app_context():
+        assert db.session.get(Model3D, again['id']).face_count == 12
+
+def test_filters_and_sorts():
+    assert set(listed(min_faces=20)) == {detailed['id']}
+    assert set(listed(max_faces=12, format='obj')) == {large['id']}
+    assert large['id'] in listed(units='cm')
+    assert small['id'] not in listed(units='cm')
+    assert listed(min_area=1000) == [large['id']]
+    by_faces = listed(sort='-face_count', format='obj')
+    assert by_faces == [detailed['id'], large['id']]
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,82 @@
+"""
+Checks for the schema migrations: a database built by migrations alone
+matches db.create_all(), databases from create_all() are recorded as
+current untouched, and an old database is brought forward with its data.
+
+    python -m pytest test_migrations.py
+    python test_migrations.py
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect
+
+from testing import make_app, run_as_script
+from app import db, migrations, search
+from app.models import CatalogStat, Model3D
+
+def empty_app():
+    """A test app whose database has no tables at all"""
+    app = make_app()
+    with app.app_context():
+        db.drop_all()
+    return app
+
+def schema(app):
+    """{table: (columns, indexes)} by name"""
+    with app.app_context():
+        inspector = inspect(db.engine)
+        return {table: ({column['name'] for column in inspector.get_columns(table)},
+                        {index['name'] for index in inspector.get_indexes(table)})
+                for table in inspector.get_table_names()
+                if table != 'schema_migrations' and not table.startswith(search.FTS_TABLE)}
+
+def test_migrations_alone_build_the_current_schema():
+    migrated = empty_app()
+    with migrated.app_context():
+        applied = migrations.upgrade()
+        assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+        assert migrations.upgrade() == []
+        assert all(applied for _, _, applied in migrations.status())
+        assert inspect(db.engine).has_table(search.FTS_TABLE)
+    assert schema(migrated) == schema(make_app())
+
+def test_created_databases_are_recorded_without_changes():
+    app = make_app()
+    before = schema(app)
+    with app.app_context():
+        assert len(migrations.upgrade()) == len(migrations.MIGRATIONS)
+    assert schema(app) == before
+
+def test_old_databases_keep_their_data():
+    app = empty_app()
+    with app.app_context():
+        migrations.upgrade(target=1)
+        assert not inspect(db.engine).has_table('blob')
+        with db.engine.begin() as connection:
+            connection.execute(migrations.user_v1.insert(), [
+                {'id': 1, 'username': 'old', 'email': 'old@example.com',
+                 'password_hash': 'x', 'full_name': 'Old'}])
+            connection.execute(migrations.model3_d_v1.insert(), [
+                {'name': 'Ancient dragon', 'filename': 'a.obj', 'original_filename': 'a.obj',
+                 'file_size': 10, 'file_extension': 'obj', 'downloads': 4, 'is_public': True,
+                 'upload_date': datetime(2020, 5, 1), 'user_id': 1},
+                {'name': 'Undated', 'filename': 'b.stl', 'original_filename': 'b.stl',
+                 'file_size': 20, 'file_extension': 'stl', 'downloads': 1, 'is_public': True,
+                 'upload_date': None, 'user_id': 1},
+            ])
+
+        migrations.upgrade()
+        # Migration 9 counted the existing rows, migration 14 dated them
+        totals = {(row.metric, row.bucket): row.value for row in CatalogStat.query}
+        assert totals['models', ''] == 2 and totals['users', ''] == 1
+        assert totals['downloads', ''] == 5 and totals['models', 'ext:stl'] == 1
+        undated = Model3D.query.filter_by(name='Undated').one()
+        assert undated.upload_date == datetime(2020, 5, 1)
+
+    # Migration 7 indexed them for search
+    response = app.test_client().get('/api/models', query_string={'search': 'drag'})
+    assert [model['name'] for model in response.get_json()['models']] == ['Ancient dragon']
+    assert app.test_client().get('/api/stats').get_json()['total_models'] == 2
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,100 @@
+"""
+Checks for handing file bytes to the front proxy (X-Accel-Redirect and
+X-Sendfile) and for which downloads are counted.
+
+    python -m pytest test_offload.py
+    python test_offload.py
+"""
+import io
+
+from testing import add_user, login, make_app, run_as_script
+from app import db, storage
+from app.models import Model3D
+
+MESH = b''.join(f'v {i} {i % 4} {i % 6}\n'.encode() for i in range(200)) + \
+    b''.join(f'f {i} {i + 1} {i + 2}\n'.encode() for i in range(1, 198))
+
+def app_with_model(mode):
+    app = make_app(FILE_SERVING_MODE=mode, X_ACCEL_REDIRECT_PREFIX='/_protected/')
+    add_user(app, 'owner')
+    response = login(app, 'owner').post(
+        '/api/upload', data={'file': (io.BytesIO(MESH), 'strip.obj'), 'is_public': 'true'},
+        content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return app, response.get_json()['model']
+
+accel_app, accel_model = app_with_model('x-accel')
+sendfile_app, sendfile_model = app_with_model('x-sendfile')
+direct_app, direct_model = app_with_model('direct')
+
+def downloads(app, model_id):
+    with app.app_context():
+        return db.session.get(Model3D, model_id).downloads
+
+def test_x_accel_redirect_names_the_internal_location():
+    response = accel_app.test_client().get(f"/api/download/{accel_model['id']}")
+    assert response.status_code == 200
+    assert response.data == b''
+    key = storage.blob_key(accel_model['content_hash'])
+    assert response.headers['X-Accel-Redirect'] == f'/_protected/{key}'
+    assert response.headers['ETag'] == f'"{accel_model["content_hash"]}"'
+    assert response.headers['Content-Disposition'].startswith('attachment')
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+def test_x_sendfile_passes_the_path_and_negotiates_variants():
+    client = sendfile_app.test_client()
+    url = f"/api/download/{sendfile_model['id']}"
+    with sendfile_app.app_context():
+        backend = storage.get_backend()
+        original = backend.local_path(storage.blob_key(sendfile_model['content_hash']))
+
+    assert client.get(url).headers['X-Sendfile'] == original
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['X-Sendfile'].endswith('.gz')
+    assert response.content_encoding == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+
+    # Ranges address the original bytes, so no variant is offered
+    response = client.get(url, headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=5-9'})
+    assert response.headers['X-Sendfile'] == original
+    assert 'Content-Encoding' not in response.headers
+
+def test_revalidation_is_answered_here():
+    response = accel_app.test_client().get(
+        f"/api/download/{accel_model['id']}",
+        headers={'If-None-Match': f'"{accel_model["content_hash"]}"'})
+    assert response.status_code == 304
+    assert 'X-Accel-Redirect' not in response.headers
+
+def test_private_models_are_authorized_before_offloading():
+    add_user(accel_app, 'stranger')
+    owner = login(accel_app, 'owner')
+    model_id = accel_model['id']
+    hide = {'updates': [{'id': model_id, 'is_public': False}]}
+    assert owner.post('/api/models:batchUpdate', json=hide).status_code == 200
+    response = login(accel_app, 'stranger').get(f'/api/download/{model_id}')
+    assert response.status_code == 403
+    assert 'X-Accel-Redirect' not in response.headers
+    assert 'X-Accel-Redirect' in owner.get(f'/api/download/{model_id}').headers
+    show = {'updates': [{'id': model_id, 'is_public': True}]}
+    assert owner.post('/api/models:batchUpdate', json=show).status_code == 200
+
+def test_only_downloads_from_the_first_byte_are_counted():
+    for app, model in ((sendfile_app, sendfile_model), (direct_app, direct_model)):
+        client = app.test_client()
+        url = f"/api/download/{model['id']}"
+        before = downloads(app, model['id'])
+
+        client.get(url)
+        client.get(url, headers={'Range': 'bytes=0-99'})
+        assert downloads(app, model['id']) == before + 2
+
+        # Resuming, or re-checking a cached copy, is not a new download
+        client.get(url, headers={'Range': 'bytes=100-'})
+        client.get(url, headers={'Range': 'bytes=-50'})
+        client.get(url, headers={'If-None-Match': f'"{model["content_hash"]}"'})
+        assert downloads(app, model['id']) == before + 2
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
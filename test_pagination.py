@@ -0,0 +1,89 @@
+"""
+Checks for cursor pagination of /api/models and /browse: keyset pages in
+upload order (ties included), offset cursors for other orders, cursor
+validation and the ?count= totals.
+
+    python -m pytest test_pagination.py
+    python test_pagination.py
+"""
+import io
+from datetime import datetime, timedelta
+
+from testing import add_user, login, make_app, run_as_script
+from app import db
+from app.models import Model3D
+
+app = make_app()
+add_user(app, 'owner')
+owner = login(app, 'owner')
+
+ids = []
+for number in range(7):
+    response = owner.post('/api/upload', data={
+        'file': (io.BytesIO(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n# %d\n' % number), f'm{number}.obj'),
+        'is_public': 'true'}, content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    ids.append(response.get_json()['model']['id'])
+
+# Pairs of models share an upload time, so pages must break ties by id
+with app.app_context():
+    start = datetime(2024, 1, 1)
+    for position, model_id in enumerate(ids):
+        db.session.get(Model3D, model_id).upload_date = start + timedelta(hours=position // 2)
+    db.session.commit()
+
+def walk(**params):
+    """Every id of a listing, following next_cursor, and the page count"""
+    seen, pages, cursor = [], 0, None
+    while True:
+        query = dict(params, per_page=2, **({'cursor': cursor} if cursor else {}))
+        response = app.test_client().get('/api/models', query_string=query)
+        assert response.status_code == 200, response.data[:500]
+        body = response.get_json()
+        seen += [model['id'] for model in body['models']]
+        pages += 1
+        cursor = body['next_cursor']
+        if cursor is None:
+            return seen, pages
+
+def test_upload_order_pages_cover_every_model_once():
+    newest_first = sorted(ids, key=lambda model_id: (ids.index(model_id) // 2, model_id), reverse=True)
+    assert walk() == (newest_first, 4)
+    assert walk(sort='upload_date') == (newest_first[::-1], 4)
+
+def test_other_orders_page_by_offset():
+    seen, pages = walk(sort='file_size')
+    assert sorted(seen) == sorted(ids) and pages == 4
+
+def test_cursors_are_checked():
+    first = app.test_client().get('/api/models', query_string={'per_page': 2}).get_json()
+    cursor = first['next_cursor']
+    response = app.test_client().get('/api/models', query_string={'cursor': cursor, 'sort': 'downloads'})
+    assert response.status_code == 400
+    response = app.test_client().get('/api/models', query_string={'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
+    response = app.test_client().get('/browse', query_string={'cursor': 'not-a-cursor'})
+    assert response.status_code == 302
+
+def test_totals_only_when_asked():
+    body = app.test_client().get('/api/models').get_json()
+    assert 'total' not in body
+    body = app.test_client().get('/api/models', query_string={'count': 'exact'}).get_json()
+    assert (body['total'], body['total_exact']) == (7, True)
+    body = app.test_client().get('/api/models', query_string={'count': 'estimate'}).get_json()
+    assert body['total'] == 7
+    body = app.test_client().get('/api/models', query_string={'page': 2, 'per_page': 3}).get_json()
+    assert (body['total'], body['pages'], len(body['models'])) == (7, 3, 3)
+
+def test_upload_date_is_required():
+    with app.app_context():
+        assert not Model3D.__table__.c.upload_date.nullable
+        model = Model3D(name='dated', filename='x', original_filename='x.obj', file_size=1,
+                        file_extension='obj', user_id=1)
+        db.session.add(model)
+        db.session.flush()
+        assert model.upload_date is not None
+        db.session.rollback()
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,231 @@
+"""
+Query count checks for the listing pages and the response cache.
+
+Runs against a throwaway SQLite database (no server needed):
+    python -m pytest test_query_counts.py
+    python test_query_counts.py
+"""
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import event
+
+from config import Config
+
+TEMP_DIR = tempfile.mkdtemp()
+Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(TEMP_DIR, 'test.db')
+Config.UPLOAD_FOLDER = os.path.join(TEMP_DIR, 'uploads')
+Config.TESTING = True
+Config.CACHE_ENABLED = False  # the listing checks measure the database path
+
+from app import counters, create_app, db
+from app.models import User, Model3D
+
+OWNERS = 10
+MODELS_PER_OWNER = 12
+
+app = create_app()
+
+def cached_app():
+    """Another app on the same database with the response cache on, as one
+    worker sharing a cache tier (the in-process stand-in) with the others"""
+    worker = create_app()
+    worker.config['CACHE_ENABLED'] = True
+    worker.config['CACHE_SHARED_URL'] = 'memory://test'
+    return worker
+
+with app.app_context():
+    db.create_all()
+    start = datetime(2024, 1, 1)
+    for index in range(OWNERS):
+        user = User(username=f'owner{index}', email=f'owner{index}@example.com',
+                    full_name=f'Owner {index}', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+        for number in range(MODELS_PER_OWNER):
+            db.session.add(Model3D(
+                name=f'Model {index}-{number}',
+                description='test model',
+                filename=f'{index}-{number}.obj',
+                original_filename=f'{index}-{number}.obj',
+                file_size=100 + number,
+                file_extension='obj',
+                upload_date=start + timedelta(minutes=index * MODELS_PER_OWNER + number),
+                user_id=user.id
+            ))
+    db.session.commit()
+
+@contextmanager
+def count_queries(target=app):
+    """Collect the SQL statements run inside the block"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with target.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+def queries_for(url, target=app):
+    client = target.test_client()
+    with count_queries(target) as statements:
+        response = client.get(url)
+    assert response.status_code == 200, response.data[:500]
+    return len(statements), response
+
+def test_api_models_page_is_one_query():
+    count, response = queries_for('/api/models?per_page=100')
+    models = response.get_json()['models']
+    assert len(models) == 100
+    assert all(model['user']['username'].startswith('owner') for model in models)
+    assert count == 1, f'{count} queries for one page'
+
+def test_api_models_query_count_does_not_grow_with_page_size():
+    small, _ = queries_for('/api/models?per_page=5')
+    large, _ = queries_for('/api/models?per_page=100')
+    assert small == large
+
+def test_api_models_next_page_is_one_query():
+    _, response = queries_for('/api/models?per_page=50')
+    cursor = response.get_json()['next_cursor']
+    count, response = queries_for(f'/api/models?per_page=50&cursor={cursor}')
+    assert len(response.get_json()['models']) == 50
+    assert count == 1
+
+def test_api_models_exact_count_adds_one_query():
+    count, response = queries_for('/api/models?per_page=100&count=exact')
+    assert response.get_json()['total'] == OWNERS * MODELS_PER_OWNER
+    assert count == 2
+
+def test_api_models_numbered_page():
+    count, response = queries_for('/api/models?page=2&per_page=100')
+    assert len(response.get_json()['models']) == OWNERS * MODELS_PER_OWNER - 100
+    assert count == 2  # the page and its total
+
+def test_browse_page_query_count():
+    count, response = queries_for('/browse')
+    assert b'owner' in response.data
+    assert count == 1, f'{count} queries for the browse page'
+
+def test_user_model_count_is_counted_in_sql():
+    with app.app_context():
+        with count_queries() as statements:
+            users = User.query.options(db.undefer(User.model_count)).all()
+            counts = [user.to_dict()['model_count'] for user in users]
+        assert counts == [MODELS_PER_OWNER] * OWNERS
+        assert len(statements) == 1
+
+def test_cached_listing_needs_no_queries():
+    worker = cached_app()
+    count, response = queries_for('/api/models?per_page=10', worker)
+    assert response.headers['X-Cache'] == 'MISS'
+    count, response = queries_for('/api/models?per_page=10', worker)
+    assert response.headers['X-Cache'] == 'HIT-LOCAL'
+    assert count == 0
+    count, response = queries_for('/api/models?per_page=10', cached_app())
+    assert response.headers['X-Cache'] == 'HIT-SHARED'
+    assert count == 0
+
+def test_visibility_change_invalidates_every_worker():
+    first, second = cached_app(), cached_app()
+    url = '/api/models?per_page=1'
+    _, response = queries_for(url, first)
+    newest = response.get_json()['models'][0]['id']
+    queries_for(url, second)
+    
+    with second.app_context():
+        db.session.get(Model3D, newest).is_public = False
+        db.session.commit()
+    try:
+        _, response = queries_for(url, first)
+        assert response.headers['X-Cache'] == 'MISS'
+        assert response.get_json()['models'][0]['id'] != newest
+        _, response = queries_for(url, second)
+        assert response.headers['X-Cache'] == 'HIT-SHARED'  # rebuilt by the first
+        assert response.get_json()['models'][0]['id'] != newest
+    finally:
+        with second.app_context():
+            db.session.get(Model3D, newest).is_public = True
+            db.session.commit()
+    _, response = queries_for(url, first)
+    assert response.get_json()['models'][0]['id'] == newest
+
+def test_counter_flush_invalidates_model():
+    worker = cached_app()
+    url = '/api/model/1'
+    _, response = queries_for(url, worker)
+    downloads = response.get_json()['model']['downloads']
+    with worker.app_context():
+        counters.write_deltas({1: 3})
+    _, response = queries_for(url, worker)
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['model']['downloads'] == downloads + 3
+
+def user_lookups(statements):
+    return [statement for statement in statements if re.search(r'FROM "?user"?\b', statement)]
+
+def test_warm_authenticated_view_skips_user_lookup():
+    with app.app_context():
+        viewer = User(username='viewer', email='viewer@example.com', full_name='Viewer')
+        viewer.set_password('secret')
+        db.session.add(viewer)
+        db.session.flush()
+        # Private, so the view checks who is asking
+        model = Model3D(name='Private', filename='private.obj', original_filename='private.obj',
+                        file_size=8, file_extension='obj', is_public=False, user_id=viewer.id)
+        db.session.add(model)
+        db.session.commit()
+        model_id = model.id
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+    with open(os.path.join(Config.UPLOAD_FOLDER, 'private.obj'), 'w') as f:
+        f.write('v 0 0 0\n')
+    
+    client = app.test_client()
+    client.post('/auth/login', data={'login_field': 'viewer', 'password': 'secret'})
+    with count_queries() as cold:
+        assert client.get(f'/api/view/{model_id}').status_code == 200
+    with count_queries() as warm:
+        assert client.get(f'/api/view/{model_id}').status_code == 200
+    assert len(user_lookups(cold)) == 1
+    assert user_lookups(warm) == []
+
+def test_api_token_is_checked_without_queries():
+    client = app.test_client()
+    response = client.post('/api/tokens', json={'username': 'owner1', 'password': 'x'})
+    assert response.status_code == 401  # seeded users have no real password
+    with app.app_context():
+        owner = User.query.filter_by(username='owner1').first()
+        owner.set_password('secret')
+        db.session.commit()
+    response = client.post('/api/tokens', json={'username': 'owner1', 'password': 'secret'})
+    headers = {'Authorization': f"Bearer {response.get_json()['token']}"}
+    
+    url = '/api/models?user_only=true&per_page=100'
+    client.get(url, headers=headers)
+    with count_queries() as statements:
+        response = app.test_client().get(url, headers=headers)
+    assert len(response.get_json()['models']) == MODELS_PER_OWNER
+    assert user_lookups(statements) == []
+    assert not [statement for statement in statements if 'revoked_token' in statement]
+    
+    response = app.test_client().delete('/api/model/1', headers=headers)
+    assert response.status_code == 403  # read scope only
+
+if __name__ == '__main__':
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\n{len(tests) - failed}/{len(tests)} passed")
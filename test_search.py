@@ -0,0 +1,90 @@
+"""
+Checks for full-text search: ranking, prefix matching, index upkeep on
+insert, update and delete, /browse, and the substring fallback for
+databases without the index.
+
+    python -m pytest test_search.py
+    python test_search.py
+"""
+import io
+
+from testing import add_user, login, make_app, run_as_script
+from app import db, search
+from app.models import Model3D
+
+TRIANGLE = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'
+
+def upload(client, name, description='', is_public='true'):
+    response = client.post('/api/upload', data={
+        'file': (io.BytesIO(TRIANGLE + f'# {name}\n'.encode()), 'model.obj'),
+        'name': name, 'description': description, 'is_public': is_public,
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']['id']
+
+def found(app, text, client=None, **params):
+    response = (client or app.test_client()).get('/api/models', query_string=dict(params, search=text))
+    assert response.status_code == 200, response.data[:500]
+    return [model['id'] for model in response.get_json()['models']]
+
+app = make_app()
+add_user(app, 'owner')
+owner = login(app, 'owner')
+
+in_description = upload(owner, 'Garden prop', 'A small dragon statue for gardens')
+in_name = upload(owner, 'Dragon', 'Scaly and green')
+unrelated = upload(owner, 'Teapot', 'The Utah teapot')
+hidden = upload(owner, 'Secret dragon', is_public='false')
+
+def test_index_is_used():
+    with app.app_context():
+        assert search.has_index()
+        assert db.session.execute(db.text(f'SELECT count(*) FROM {search.FTS_TABLE}')).scalar() == 4
+
+def test_name_matches_rank_above_description_matches():
+    assert found(app, 'dragon') == [in_name, in_description]
+    assert hidden in found(app, 'dragon', client=owner, user_only='true')
+
+def test_every_word_matches_as_a_prefix():
+    assert found(app, 'dra') == [in_name, in_description]
+    assert found(app, 'drag stat') == [in_description]
+    assert found(app, 'dragon teapot') == []
+    assert found(app, 'UTAH') == [unrelated]
+    assert found(app, '"*') != []  # punctuation only: no search at all
+
+def test_updates_and_deletes_reach_the_index():
+    model_id = upload(owner, 'Kettle')
+    assert found(app, 'kettle') == [model_id]
+    response = owner.post('/api/models:batchUpdate',
+                          json={'updates': [{'id': model_id, 'name': 'Samovar'}]})
+    assert response.status_code == 200
+    assert found(app, 'kettle') == []
+    assert found(app, 'samovar') == [model_id]
+    assert owner.delete(f'/api/model/{model_id}').status_code == 200
+    assert found(app, 'samovar') == []
+    with app.app_context():
+        assert db.session.execute(db.text(
+            f"SELECT count(*) FROM {search.FTS_TABLE} WHERE {search.FTS_TABLE} MATCH 'samovar'")).scalar() == 0
+
+def test_browse_searches_too():
+    page = app.test_client().get('/browse', query_string={'search': 'teap'}).get_data(as_text=True)
+    assert 'Teapot' in page and 'Dragon' not in page
+
+def test_without_the_index_substrings_still_match():
+    plain = make_app()
+    with plain.app_context():
+        for statement in ('DROP TRIGGER {0}_ai', 'DROP TRIGGER {0}_ad', 'DROP TRIGGER {0}_au',
+                          'DROP TABLE {0}'):
+            db.session.execute(db.text(statement.format(search.FTS_TABLE)))
+        db.session.commit()
+    add_user(plain, 'owner')
+    client = login(plain, 'owner')
+    model_id = upload(client, 'Lighthouse')
+    with plain.app_context():
+        assert not search.has_index()
+        assert Model3D.query.count() == 1
+    assert found(plain, 'ghtho') == [model_id]
+    assert found(plain, 'harbour') == []
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,111 @@
+"""
+Checks for how model files are served: validators, conditional GET,
+byte ranges and cache headers.
+
+    python -m pytest test_serving.py
+    python test_serving.py
+"""
+import io
+
+from testing import add_user, login, make_app, run_as_script
+
+# Repetitive text, so the stored gzip variant is worth keeping
+MESH = b''.join(f'v {i} {i % 7} {i % 3}\n'.encode() for i in range(300)) + \
+    b''.join(f'f {i} {i + 1} {i + 2}\n'.encode() for i in range(1, 298))
+
+app = make_app()
+add_user(app, 'owner')
+owner = login(app, 'owner')
+
+def upload(content=MESH, filename='strip.obj', is_public='true'):
+    response = owner.post('/api/upload', data={'file': (io.BytesIO(content), filename),
+                                               'is_public': is_public},
+                          content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']
+
+public_model = upload()
+private_model = upload(MESH + b'# private\n', 'private.obj', is_public='false')
+DOWNLOAD = f"/api/download/{public_model['id']}"
+ORIGINAL = f"/api/view/{public_model['id']}?original=true"
+
+def test_download_has_a_strong_etag_and_revalidates():
+    response = app.test_client().get(DOWNLOAD)
+    assert response.status_code == 200
+    assert response.data == MESH
+    assert response.headers['ETag'] == f'"{public_model["content_hash"]}"'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert 'Last-Modified' in response.headers
+
+    response = app.test_client().get(DOWNLOAD, headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    assert response.data == b''
+
+def test_single_range():
+    response = app.test_client().get(DOWNLOAD, headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.data == MESH[10:20]
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(MESH)}'
+
+    response = app.test_client().get(DOWNLOAD, headers={'Range': 'bytes=-5'})
+    assert response.data == MESH[-5:]
+
+def test_multiple_ranges_are_multipart():
+    response = app.test_client().get(DOWNLOAD, headers={'Range': 'bytes=0-3,100-103'})
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    body = response.get_data()
+    assert MESH[0:4] in body and MESH[100:104] in body
+    assert f'Content-Range: bytes 100-103/{len(MESH)}'.encode() in body
+    assert len(body) == int(response.headers['Content-Length'])
+
+def test_overlapping_ranges_get_the_whole_file():
+    response = app.test_client().get(DOWNLOAD, headers={'Range': 'bytes=0-9,5-19'})
+    assert response.status_code == 200
+    assert response.data == MESH
+
+def test_unsatisfiable_range():
+    response = app.test_client().get(DOWNLOAD, headers={'Range': f'bytes={len(MESH) + 10}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(MESH)}'
+
+def test_stale_if_range_gets_the_whole_file():
+    response = app.test_client().get(DOWNLOAD, headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert response.status_code == 200
+    assert response.data == MESH
+
+def test_plain_urls_are_revalidated():
+    for url in (DOWNLOAD, ORIGINAL, f"/api/view/{public_model['id']}"):
+        cache_control = app.test_client().get(url).cache_control
+        assert cache_control.no_cache, url
+        assert cache_control.public
+        assert not cache_control.immutable
+        assert cache_control.max_age is None
+
+def test_versioned_urls_are_immutable():
+    etag = public_model['content_hash']
+    response = app.test_client().get(f'{DOWNLOAD}?v={etag}')
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == app.config['ASSET_CACHE_MAX_AGE']
+    assert not response.cache_control.no_cache
+
+    # A version that is not what the URL serves now is not pinned
+    response = app.test_client().get(f'{DOWNLOAD}?v=stale')
+    assert response.cache_control.no_cache and not response.cache_control.immutable
+
+def test_view_switches_etag_when_the_glb_exists():
+    view = app.test_client().get(f"/api/view/{public_model['id']}")
+    assert view.mimetype == 'model/gltf-binary'
+    assert view.headers['ETag'] == f'"{public_model["content_hash"]}-glb"'
+    assert view.cache_control.no_cache
+
+def test_private_models_stay_out_of_shared_caches():
+    url = f"/api/download/{private_model['id']}"
+    assert app.test_client().get(url).status_code == 403
+    response = owner.get(f"{url}?v={private_model['content_hash']}")
+    assert response.status_code == 200
+    assert response.cache_control.private
+    assert not response.cache_control.public
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
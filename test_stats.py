@@ -0,0 +1,101 @@
+"""
+Checks for the materialized catalog statistics: counters kept in step
+with uploads, visibility changes, deletes, registrations and downloads,
+and reconcile() correcting drift.
+
+    python -m pytest test_stats.py
+    python test_stats.py
+"""
+import io
+from datetime import datetime
+
+from testing import add_user, login, make_app, run_as_script
+from app import db, stats
+from app.models import CatalogStat, Model3D
+
+app = make_app()
+add_user(app, 'owner')
+owner = login(app, 'owner')
+
+def upload(content, filename, is_public='true'):
+    response = owner.post('/api/upload', data={'file': (io.BytesIO(content), filename),
+                                               'is_public': is_public},
+                          content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']['id']
+
+def snapshot():
+    response = app.test_client().get('/api/stats')
+    assert response.status_code == 200, response.data[:500]
+    return response.get_json()
+
+def counter(metric, bucket=stats.TOTAL):
+    with app.app_context():
+        row = db.session.get(CatalogStat, (metric, bucket))
+        return row.value if row else 0
+
+TRIANGLE = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'
+today = datetime.utcnow().strftime('%Y-%m-%d')
+
+def test_uploads_and_registrations_are_counted():
+    before = snapshot()
+    upload(TRIANGLE + b'# a\n', 'a.obj')
+    upload(TRIANGLE + b'# b\n', 'b.obj')
+    upload(TRIANGLE + b'# c\n', 'c.obj', is_public='false')
+    add_user(app, 'newcomer')
+    after = snapshot()
+    assert after['total_models'] == before['total_models'] + 2
+    assert after['by_format']['obj'] == before['by_format'].get('obj', 0) + 2
+    assert after['by_day'][today]['uploads'] == before['by_day'].get(today, {}).get('uploads', 0) + 2
+    assert after['total_users'] == before['total_users'] + 1
+
+def test_visibility_changes_and_deletes():
+    model_id = upload(TRIANGLE + b'# toggled\n', 'toggled.obj')
+    total = counter('models')
+    owner.post('/api/models:batchUpdate', json={'updates': [{'id': model_id, 'is_public': False}]})
+    assert counter('models') == total - 1
+    # Setting the same value again changes nothing
+    owner.post('/api/models:batchUpdate', json={'updates': [{'id': model_id, 'is_public': False}]})
+    assert counter('models') == total - 1
+    owner.post('/api/models:batchUpdate', json={'updates': [{'id': model_id, 'is_public': True}]})
+    assert counter('models') == total
+
+    app.test_client().get(f'/api/download/{model_id}').close()
+    downloads = counter('downloads')
+    assert owner.delete(f'/api/model/{model_id}').status_code == 200
+    assert counter('models') == total - 1
+    assert counter('downloads') == downloads - 1
+
+def test_downloads_are_counted_per_day():
+    model_id = upload(TRIANGLE + b'# popular\n', 'popular.obj')
+    before = counter('downloads'), counter('downloads', f'day:{today}')
+    for _ in range(3):
+        app.test_client().get(f'/api/download/{model_id}').close()
+    assert (counter('downloads'), counter('downloads', f'day:{today}')) == (before[0] + 3, before[1] + 3)
+    assert snapshot()['by_day'][today]['downloads'] == before[1] + 3
+
+def test_reconcile_corrects_drift():
+    model_id = upload(TRIANGLE + b'# drift\n', 'drift.obj')
+    expected = snapshot()
+    with app.app_context():
+        # Changed behind the ORM's back: no session hook sees it
+        db.session.execute(db.update(Model3D).where(Model3D.id == model_id)
+                           .values(downloads=Model3D.downloads + 10))
+        db.session.execute(db.update(CatalogStat).where(CatalogStat.metric == 'users')
+                           .values(value=99))
+        db.session.commit()
+        changed = stats.reconcile()
+        assert changed[('downloads', stats.TOTAL)] == 10
+        assert changed[('users', stats.TOTAL)] == expected['total_users'] - 99
+        assert stats.reconcile() == {}
+    after = snapshot()
+    assert after['total_downloads'] == expected['total_downloads'] + 10
+    assert after['total_users'] == expected['total_users']
+    assert after['by_format'] == expected['by_format']
+
+def test_days_are_validated():
+    assert app.test_client().get('/api/stats?days=0').status_code == 400
+    assert app.test_client().get('/api/stats?days=400').status_code == 400
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,166 @@
+"""
+Checks for the content-addressed blob store: deduplication, reference
+counts and when stored files are removed.
+
+    python -m pytest test_storage.py
+    python test_storage.py
+"""
+import hashlib
+import io
+import os
+
+from sqlalchemy import event
+
+from testing import add_user, login, make_app, run_as_script
+from app import db, storage
+from app.models import Blob, Model3D, Rendition
+
+app = make_app()
+add_user(app, 'alice')
+
+def upload(client, content, filename='mesh.obj'):
+    response = client.post('/api/upload', data={'file': (io.BytesIO(content), filename)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']
+
+def blob_path(digest):
+    with app.app_context():
+        return storage.get_backend().local_path(storage.blob_key(digest))
+
+def blob_row(digest):
+    with app.app_context():
+        blob = db.session.get(Blob, digest)
+        return None if blob is None else (blob.ref_count, blob.size)
+
+def test_identical_uploads_share_one_blob():
+    client = login(app, 'alice')
+    content = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n# shared\n'
+    first = upload(client, content)
+    second = upload(client, content, 'copy.obj')
+    assert first['content_hash'] == second['content_hash']
+    assert first['id'] != second['id']
+    assert blob_row(first['content_hash']) == (2, len(content))
+
+    client.delete(f"/api/model/{first['id']}")
+    assert blob_row(first['content_hash']) == (1, len(content))
+    assert os.path.exists(blob_path(first['content_hash']))
+
+    client.delete(f"/api/model/{second['id']}")
+    assert blob_row(first['content_hash']) is None
+    assert not os.path.exists(blob_path(first['content_hash']))
+
+def test_concurrent_first_uploads_of_the_same_content():
+    client = login(app, 'alice')
+    content = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n# raced\n'
+    digest = hashlib.sha256(content).hexdigest()
+
+    # Another upload inserts the row right after this one's UPDATE missed it
+    def race(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE blob') and cursor.rowcount == 0 and not raced:
+            raced.append(statement)
+            cursor.connection.execute('INSERT INTO blob (digest, size, ref_count) VALUES (?, ?, 1)',
+                                      (digest, len(content)))
+
+    raced = []
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'after_cursor_execute', race)
+    try:
+        model = upload(client, content)
+    finally:
+        event.remove(engine, 'after_cursor_execute', race)
+    assert raced
+    assert model['content_hash'] == digest
+    assert blob_row(digest) == (2, len(content))
+    assert os.path.exists(blob_path(digest))
+    assert client.get(f"/api/download/{model['id']}").data == content
+
+def test_last_reference_removes_renditions():
+    client = login(app, 'alice')
+    model = upload(client, b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n' * 50, 'rendered.obj')
+    digest = model['content_hash']
+    with app.app_context():
+        keys = [key for (key,) in db.session.query(Rendition.key).filter_by(content_hash=digest)]
+        backend = storage.get_backend()
+        paths = [backend.local_path(key) for key in keys]
+    assert keys  # the inline pipeline stored a GLB at least
+    assert all(os.path.exists(path) for path in paths)
+
+    client.delete(f"/api/model/{model['id']}")
+    with app.app_context():
+        assert Rendition.query.filter_by(content_hash=digest).count() == 0
+    assert not any(os.path.exists(path) for path in paths)
+
+def test_reupload_before_removal_keeps_the_file():
+    client = login(app, 'alice')
+    content = b'v 0 0 0\nv 0 0 1\nv 0 1 0\nf 1 2 3\n# revived\n'
+    model = upload(client, content)
+    digest = model['content_hash']
+
+    # Delete the model but hold back the file removal, as a queued job would
+    with app.app_context():
+        row = db.session.get(Model3D, model['id'])
+        keys = storage.release_blob(digest)
+        db.session.delete(row)
+        db.session.commit()
+    assert keys == [storage.blob_key(digest)]
+    assert blob_row(digest) == (0, len(content))
+
+    again = upload(client, content)
+    assert blob_row(digest) == (1, len(content))
+    with app.app_context():
+        storage.remove_files(keys)
+    assert os.path.exists(blob_path(digest))
+    assert blob_row(digest) == (1, len(content))
+    assert client.get(f"/api/download/{again['id']}").data == content
+
+def test_upload_after_removal_stores_the_file_again():
+    client = login(app, 'alice')
+    content = b'v 1 1 1\nv 2 1 1\nv 1 2 1\nf 1 2 3\n# recreated\n'
+    model = upload(client, content)
+    digest = model['content_hash']
+    client.delete(f"/api/model/{model['id']}")
+    assert not os.path.exists(blob_path(digest))
+
+    again = upload(client, content)
+    assert again['content_hash'] == digest
+    assert client.get(f"/api/download/{again['id']}").data == content
+
+def test_failed_upload_leaves_no_blob_file():
+    client = login(app, 'alice')
+    content = b'v 5 5 5\nv 6 5 5\nv 5 6 5\nf 1 2 3\n# fails\n'
+    with app.app_context():
+        digest, size = storage.store_stream(io.BytesIO(content))
+        assert os.path.exists(blob_path(digest))
+        # The row insert fails after the blob is stored (name is NOT NULL)
+        db.session.add(Model3D(name=None, filename=storage.blob_key(digest),
+                               original_filename='x.obj', file_size=size,
+                               file_extension='obj', content_hash=digest, user_id=1))
+        try:
+            db.session.commit()
+        except Exception:
+            storage.rollback()
+        else:
+            raise AssertionError('the insert should have failed')
+    assert blob_row(digest) is None
+    assert not os.path.exists(blob_path(digest))
+
+    # The same content still uploads normally afterwards
+    model = upload(client, content)
+    assert client.get(f"/api/download/{model['id']}").data == content
+
+def test_rollback_keeps_a_blob_someone_else_holds():
+    content = b'v 7 7 7\nv 8 7 7\nv 7 8 7\nf 1 2 3\n# held\n'
+    with app.app_context():
+        digest, size = storage.store_stream(io.BytesIO(content))
+        # Another transaction claims the same digest before this one gives up
+        db.session.info.pop(storage.NEW_BLOBS)
+        db.session.commit()
+        db.session.info[storage.NEW_BLOBS] = [digest]
+        storage.rollback()
+    assert blob_row(digest) == (1, len(content))
+    assert os.path.exists(blob_path(digest))
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
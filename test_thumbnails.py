@@ -0,0 +1,102 @@
+"""
+Checks for the rendered previews and /api/thumbnail/<id>.
+
+    python -m pytest test_thumbnails.py
+    python test_thumbnails.py
+"""
+import io
+import re
+
+import numpy as np
+from PIL import Image
+
+from testing import add_user, login, make_app, run_as_script
+from app import meshes, thumbnails
+from app.models import Rendition
+
+TETRA = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 0 0 1\nf 1 3 2\nf 1 2 4\nf 1 4 3\nf 2 3 4\n'
+
+def test_render_fills_the_middle_and_leaves_the_margins_clear():
+    positions = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32)
+    faces = np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+    image = thumbnails.render(meshes.Mesh(positions, faces), 64)
+    assert image.size == (64, 64) and image.mode == 'RGBA'
+    alpha = np.asarray(image)[..., 3]
+    assert alpha[32, 32] == 255
+    assert alpha[0, :].max() == 0 and alpha[:, 0].max() == 0
+
+def test_meshes_without_faces_are_refused():
+    mesh = meshes.Mesh(np.zeros((3, 3), dtype=np.float32), np.array([[0, 0, 1]]))
+    try:
+        thumbnails.render(mesh, 32)
+    except meshes.MeshError:
+        return
+    raise AssertionError('degenerate mesh rendered')
+
+app = make_app()
+add_user(app, 'owner')
+add_user(app, 'stranger')
+owner = login(app, 'owner')
+
+def upload(content, filename, is_public='true'):
+    response = owner.post('/api/upload', data={'file': (io.BytesIO(content), filename),
+                                               'is_public': is_public},
+                          content_type='multipart/form-data')
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['model']
+
+model = upload(TETRA, 'tetra.obj')
+URL = f"/api/thumbnail/{model['id']}"
+
+def test_every_size_and_format_is_stored():
+    with app.app_context():
+        kinds = {r.kind for r in Rendition.query.filter_by(content_hash=model['content_hash'])}
+    for size in thumbnails.THUMBNAIL_SIZES:
+        for image_format in thumbnails.THUMBNAIL_FORMATS:
+            assert thumbnails.thumbnail_kind(size, image_format) in kinds
+
+def test_format_follows_accept():
+    response = app.test_client().get(URL, headers={'Accept': 'image/webp,image/*'})
+    assert response.mimetype == 'image/webp'
+    assert Image.open(io.BytesIO(response.data)).format == 'WEBP'
+    assert 'Accept' in response.vary
+
+    response = app.test_client().get(URL, headers={'Accept': 'image/png'})
+    assert response.mimetype == 'image/png'
+    assert Image.open(io.BytesIO(response.data)).format == 'PNG'
+
+def test_size_picks_the_closest_stored_one_at_least_as_large():
+    for asked, expected in ((100, 128), (128, 128), (200, 256), (5000, 512)):
+        response = app.test_client().get(URL, query_string={'size': asked},
+                                         headers={'Accept': 'image/png'})
+        assert Image.open(io.BytesIO(response.data)).size == (expected, expected), asked
+
+def test_thumbnails_revalidate():
+    response = app.test_client().get(URL)
+    etag = response.headers['ETag']
+    assert app.test_client().get(URL, headers={'If-None-Match': etag}).status_code == 304
+
+def test_card_thumbnails_are_immutable():
+    for page in ('/', '/browse'):
+        html = app.test_client().get(page).get_data(as_text=True)
+        urls = re.findall(r'src="(/api/thumbnail/%d[^"]*)"' % model['id'], html)
+        assert urls, page
+        url = urls[0].replace('&amp;', '&')
+        assert f"v={model['content_hash']}" in url
+        response = app.test_client().get(url)
+        assert response.status_code == 200
+        assert response.cache_control.immutable and response.cache_control.public
+        assert response.cache_control.max_age == app.config['ASSET_CACHE_MAX_AGE']
+    # Without the version the answer must be revalidated
+    assert app.test_client().get(URL).cache_control.no_cache
+
+def test_private_and_unrenderable_models():
+    private = upload(TETRA + b'# mine\n', 'mine.obj', is_public='false')
+    assert login(app, 'stranger').get(f"/api/thumbnail/{private['id']}").status_code == 403
+    assert owner.get(f"/api/thumbnail/{private['id']}").status_code == 200
+
+    scene = upload(b'{"asset": {"version": "2.0"}}', 'scene.gltf')
+    assert app.test_client().get(f"/api/thumbnail/{scene['id']}").status_code == 404
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
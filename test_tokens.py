@@ -0,0 +1,118 @@
+"""
+Checks for API tokens: issuing, scopes, expiry and tampering, revocation
+and which identity a request with both a token and a session acts as.
+
+    python -m pytest test_tokens.py
+    python test_tokens.py
+"""
+import io
+import time
+
+from testing import add_user, login, make_app, run_as_script
+from app import tokens
+
+app = make_app(API_TOKEN_REVOCATION_REFRESH=3600)
+add_user(app, 'alice')
+add_user(app, 'mallory')
+
+def issue(scopes=('read',), **extra):
+    response = app.test_client().post('/api/tokens', json=dict(
+        username='alice', password='secret', scopes=list(scopes), **extra))
+    assert response.status_code == 201, response.data[:500]
+    return response.get_json()['token']
+
+def bearer(token):
+    return {'Authorization': f'Bearer {token}'}
+
+def upload(headers, client=None):
+    return (client or app.test_client()).post(
+        '/api/upload', headers=headers,
+        data={'file': (io.BytesIO(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'), 'tri.obj')},
+        content_type='multipart/form-data')
+
+def test_scopes_follow_the_method():
+    read = issue()
+    assert app.test_client().get('/api/models?user_only=true', headers=bearer(read)).status_code == 200
+    assert upload(bearer(read)).status_code == 403
+    write = issue(['read', 'write'])
+    response = upload(bearer(write))
+    assert response.status_code == 201
+    assert response.get_json()['model']['user']['username'] == 'alice'
+
+def test_bad_tokens_are_refused():
+    token = issue()
+    claims, signature = token[len(tokens.PREFIX):].split('.')
+    forged = tokens.PREFIX + claims + '.' + signature[::-1]
+    assert app.test_client().get('/api/models', headers=bearer(forged)).status_code == 401
+    assert app.test_client().get('/api/models', headers=bearer('3dam_nonsense')).status_code == 401
+    short = issue(expires_in=1)
+    time.sleep(2)
+    assert app.test_client().get('/api/models', headers=bearer(short)).status_code == 401
+
+def test_wrong_password_and_tokens_issuing_tokens():
+    response = app.test_client().post('/api/tokens', json={'username': 'alice', 'password': 'nope'})
+    assert response.status_code == 401
+    response = app.test_client().post('/api/tokens', headers=bearer(issue(['read', 'write'])), json={})
+    assert response.status_code == 403
+
+def test_bad_token_requests_are_refused():
+    credentials = {'username': 'alice', 'password': 'secret'}
+    for body in (['alice', 'secret'], 'alice'):
+        assert app.test_client().post('/api/tokens', json=body).status_code == 400, body
+    # JSON booleans are not lifetimes, though Python counts them as ints
+    for expires_in in (True, False, 0, 1.5, '60'):
+        response = app.test_client().post('/api/tokens', json=dict(credentials, expires_in=expires_in))
+        assert response.status_code == 400, expires_in
+
+def test_a_token_acts_as_its_user_despite_a_session():
+    # Mallory's session cookie must not lend her identity to Alice's
+    # read-only token, nor Alice's token borrow Mallory's session scopes
+    mallory = login(app, 'mallory')
+    assert upload({}, client=mallory).status_code == 201
+    assert upload(bearer(issue(['read', 'write']))).status_code == 201
+    read = issue()
+    response = mallory.get('/api/models?user_only=true', headers=bearer(read))
+    assert response.status_code == 200
+    owners = {model['user']['username'] for model in response.get_json()['models']}
+    assert owners == {'alice'}
+    assert upload(bearer(read), client=mallory).status_code == 403
+    response = mallory.post('/api/tokens/revoke', headers=bearer(read), json={'all': True})
+    assert response.status_code == 403
+
+def test_read_tokens_may_only_revoke_themselves():
+    victim = issue(['read', 'write'])
+    read = issue()
+    response = app.test_client().post('/api/tokens/revoke', headers=bearer(read), json={'all': True})
+    assert response.status_code == 403
+    response = app.test_client().post('/api/tokens/revoke', headers=bearer(read), json={'token': victim})
+    assert response.status_code == 403
+    assert app.test_client().get('/api/models', headers=bearer(victim)).status_code == 200
+
+    response = app.test_client().post('/api/tokens/revoke', headers=bearer(read), json={})
+    assert response.status_code == 200
+    assert app.test_client().get('/api/models', headers=bearer(read)).status_code == 401
+
+def test_write_tokens_and_sessions_revoke_others():
+    first, second = issue(), issue()
+    writer = issue(['read', 'write'])
+    response = app.test_client().post('/api/tokens/revoke', headers=bearer(writer), json={'token': first})
+    assert response.status_code == 200
+    assert app.test_client().get('/api/models', headers=bearer(first)).status_code == 401
+
+    # Someone else's token cannot be revoked
+    response = login(app, 'mallory').post('/api/tokens/revoke', json={'token': second})
+    assert response.status_code == 403
+
+    response = login(app, 'alice').post('/api/tokens/revoke', json={'all': True})
+    assert response.status_code == 200
+    for token in (second, writer):
+        assert app.test_client().get('/api/models', headers=bearer(token)).status_code == 401
+    time.sleep(1.1)  # issue times are whole seconds; the revocation second is covered
+    assert app.test_client().get('/api/models', headers=bearer(issue())).status_code == 200
+
+def test_revoke_needs_an_object_body():
+    response = app.test_client().post('/api/tokens/revoke', headers=bearer(issue()), json=['all'])
+    assert response.status_code == 400
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
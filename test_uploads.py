@@ -0,0 +1,180 @@
+"""
+Checks for resumable upload sessions: chunks in any order, quotas,
+completion through the worker and expiry.
+
+    python -m pytest test_uploads.py
+    python test_uploads.py
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from testing import add_user, drain_jobs, login, make_app, run_as_script
+from app import db, uploads
+from app.models import Blob, Model3D, UploadSession
+
+MESH = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 0 0 1\nf 1 2 3\nf 1 2 4\nf 1 3 4\nf 2 3 4\n'
+
+app = make_app(PIPELINE_ASYNC=True, UPLOAD_SESSION_MAX_PER_USER=3,
+               UPLOAD_QUOTA_PER_USER=1000, UPLOAD_EXPIRE_INTERVAL=60)
+add_user(app, 'uploader')
+add_user(app, 'other')
+
+def start(client, size=len(MESH), filename='tetra.obj'):
+    return client.post('/api/uploads', json={'filename': filename, 'size': size, 'name': 'Tetra'})
+
+def send(client, upload_id, start_byte, data, total=len(MESH)):
+    stop = start_byte + len(data)
+    return client.put(f'/api/uploads/{upload_id}', data=data, headers={
+        'Content-Range': f'bytes {start_byte}-{stop - 1}/{total}'})
+
+def cancel_all(client):
+    with app.app_context():
+        ids = [upload.id for upload in UploadSession.query.all()]
+    for upload_id in ids:
+        client.delete(f'/api/uploads/{upload_id}')
+
+def test_chunks_in_any_order_then_complete_in_the_worker():
+    client = login(app, 'uploader')
+    response = start(client)
+    assert response.status_code == 201
+    upload_id = response.get_json()['upload']['upload_id']
+    with app.app_context():
+        part = uploads.part_path(upload_id)
+    assert os.path.getsize(part) == 0  # nothing preallocated
+
+    middle = len(MESH) // 2
+    response = send(client, upload_id, middle, MESH[middle:])
+    assert response.headers['Upload-Offset'] == '0'
+    assert client.post(f'/api/uploads/{upload_id}/complete').status_code == 409
+    response = send(client, upload_id, 0, MESH[:middle])
+    assert response.headers['Upload-Offset'] == str(len(MESH))
+
+    response = client.post(f'/api/uploads/{upload_id}/complete')
+    assert response.status_code == 202
+    assert response.get_json()['upload']['state'] == 'finalizing'
+    assert send(client, upload_id, 0, MESH[:4]).status_code == 409
+    # Asking again does not queue the work twice
+    assert client.post(f'/api/uploads/{upload_id}/complete').status_code == 202
+
+    assert drain_jobs(app, ['finalize-upload']) == ['finalize-upload']
+    upload = client.get(f'/api/uploads/{upload_id}').get_json()['upload']
+    assert upload['state'] == 'completed'
+    response = client.post(f'/api/uploads/{upload_id}/complete')
+    assert response.status_code == 201
+    model = response.get_json()['model']
+    assert model['id'] == upload['model_id']
+    assert client.get(f"/api/download/{model['id']}").data == MESH
+    assert not os.path.exists(part)
+    drain_jobs(app)
+
+def test_sessions_belong_to_their_user():
+    upload_id = start(login(app, 'uploader')).get_json()['upload']['upload_id']
+    other = login(app, 'other')
+    assert other.get(f'/api/uploads/{upload_id}').status_code == 404
+    assert send(other, upload_id, 0, MESH).status_code == 404
+    cancel_all(login(app, 'uploader'))
+
+def test_ranges_outside_the_file_are_refused():
+    client = login(app, 'uploader')
+    upload_id = start(client).get_json()['upload']['upload_id']
+    assert send(client, upload_id, len(MESH) - 2, b'xyz').status_code == 416
+    assert send(client, upload_id, 0, MESH, total=len(MESH) + 1).status_code == 416
+    cancel_all(client)
+
+def test_open_sessions_and_bytes_are_limited_per_user():
+    client = login(app, 'uploader')
+    assert start(client, size=1001).status_code == 413
+    for _ in range(3):
+        assert start(client, size=100).status_code == 201
+    response = start(client, size=100)
+    assert response.status_code == 429
+    # Another user has their own allowance
+    assert start(login(app, 'other'), size=900).status_code == 201
+    cancel_all(client)
+    assert start(client, size=900).status_code == 201
+    assert start(client, size=200).status_code == 413
+    cancel_all(client)
+
+def test_request_body_must_be_an_object():
+    client = login(app, 'uploader')
+    assert client.post('/api/uploads', json=['tetra.obj', 100]).status_code == 400
+    assert client.post('/api/uploads', json={'filename': 'a.obj', 'size': 'big'}).status_code == 400
+    assert client.post('/api/uploads', json={'filename': 'a.exe', 'size': 10}).status_code == 400
+
+def test_expired_sessions_are_reaped_by_the_worker():
+    client = login(app, 'uploader')
+    upload_id = start(client).get_json()['upload']['upload_id']
+    with app.app_context():
+        part = uploads.part_path(upload_id)
+        db.session.get(UploadSession, upload_id).expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        from app import jobs
+        jobs.enqueue_periodic()
+    assert 'expire-uploads' in drain_jobs(app)
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+    assert not os.path.exists(part)
+
+def test_finalize_is_retried_after_a_failed_commit():
+    client = login(app, 'uploader')
+    cancel_all(client)
+    content = MESH + b'# retried\n'
+    upload_id = start(client, size=len(content)).get_json()['upload']['upload_id']
+    send(client, upload_id, 0, content, total=len(content))
+    assert client.post(f'/api/uploads/{upload_id}/complete').status_code == 202
+    with app.app_context():
+        part = uploads.part_path(upload_id)
+        # Expiry leaves a session that is being finalized alone
+        db.session.get(UploadSession, upload_id).expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        assert uploads.expire_sessions() == 0
+        db.session.commit()
+
+        failures = []
+
+        def fail_once(session):
+            if not failures:
+                failures.append(session)
+                raise RuntimeError('database went away')
+
+        event.listen(Session, 'before_commit', fail_once)
+        try:
+            uploads.finalize(upload_id)
+        except RuntimeError:
+            pass
+        finally:
+            event.remove(Session, 'before_commit', fail_once)
+        assert failures
+        assert os.path.getsize(part) == len(content)
+        assert db.session.get(UploadSession, upload_id).state == 'finalizing'
+        assert Model3D.query.filter_by(file_size=len(content)).count() == 0
+
+    # The queued job retries from the same scratch file
+    assert drain_jobs(app, ['finalize-upload']) == ['finalize-upload']
+    upload = client.get(f'/api/uploads/{upload_id}').get_json()['upload']
+    assert upload['state'] == 'completed'
+    assert client.get(f"/api/download/{upload['model_id']}").data == content
+    assert not os.path.exists(part)
+    with app.app_context():
+        model = db.session.get(Model3D, upload['model_id'])
+        assert db.session.get(Blob, model.content_hash).ref_count == 1
+    drain_jobs(app)
+
+def test_inline_completion_without_a_worker():
+    inline = make_app(PIPELINE_ASYNC=False)
+    add_user(inline, 'solo')
+    client = login(inline, 'solo')
+    upload_id = client.post('/api/uploads', json={'filename': 'tetra.obj', 'size': len(MESH)}) \
+        .get_json()['upload']['upload_id']
+    client.put(f'/api/uploads/{upload_id}', data=MESH,
+               headers={'Content-Range': f'bytes 0-{len(MESH) - 1}/{len(MESH)}'})
+    response = client.post(f'/api/uploads/{upload_id}/complete')
+    assert response.status_code == 201
+    with inline.app_context():
+        model = db.session.get(Model3D, response.get_json()['model']['id'])
+        assert model.face_count == 4  # processed inline as well
+
+if __name__ == '__main__':
+    raise SystemExit(run_as_script(globals()))
@@ -0,0 +1,118 @@
+"""
+Helpers shared by the test_*.py checks.
+
+Each test module builds its own app on a throwaway SQLite database and
+upload folder, so the modules can run together under pytest or one at a
+time as scripts.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+from sqlalchemy import event
+
+from config import Config
+from app import create_app, db, jobs
+from app.models import User
+
+# Settings every test app starts from; make_app(**overrides) changes them
+DEFAULTS = {
+    'TESTING': True,
+    'WTF_CSRF_ENABLED': False,
+    'CACHE_ENABLED': False,
+    'CACHE_SHARED_URL': '',
+    'PIPELINE_ASYNC': False,  # run post-upload processing inline
+    'DOWNLOAD_COUNTER_FLUSH_INTERVAL': 0,  # write counters on every download
+    'STORAGE_BACKEND': 'local',
+    'FILE_SERVING_MODE': 'direct',
+}
+
+_MISSING = object()
+
+def make_app(**overrides):
+    """A fresh app with its own database and upload folder, tables created"""
+    temp_dir = tempfile.mkdtemp()
+    settings = dict(DEFAULTS,
+                    SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(temp_dir, 'test.db'),
+                    UPLOAD_FOLDER=os.path.join(temp_dir, 'uploads'))
+    settings.update(overrides)
+
+    # create_app() reads Config, so set it only while the app is built
+    saved = {name: Config.__dict__.get(name, _MISSING) for name in settings}
+    for name, value in settings.items():
+        setattr(Config, name, value)
+    try:
+        app = create_app()
+    finally:
+        for name, value in saved.items():
+            if value is _MISSING:
+                delattr(Config, name)
+            else:
+                setattr(Config, name, value)
+
+    with app.app_context():
+        db.create_all()
+    return app
+
+def add_user(app, username, password='secret'):
+    """Create a user and return their id"""
+    with app.app_context():
+        user = User(username=username, email=f'{username}@example.com', full_name=username.title())
+        user.set_password(password)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+def login(app, username, password='secret'):
+    """A test client logged in as `username`"""
+    client = app.test_client()
+    response = client.post('/auth/login', data={'login_field': username, 'password': password})
+    assert response.status_code in (200, 302), response.data[:500]
+    return client
+
+def drain_jobs(app, kinds=None):
+    """Run queued jobs in this process until none is due, as a worker
+    would (without its process pool). Returns the kinds run, in order."""
+    ran = []
+    with app.app_context():
+        while True:
+            job = jobs.claim(kinds or list(jobs.HANDLERS), 'test-worker')
+            if job is None:
+                return ran
+            try:
+                jobs.HANDLERS[job.kind](**job.arguments)
+            except Exception as e:
+                db.session.rollback()
+                jobs.finish(job.id, error=str(e))
+            else:
+                jobs.finish(job.id)
+            ran.append(job.kind)
+
+@contextmanager
+def count_queries(app):
+    """Collect the SQL statements run inside the block"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+def run_as_script(namespace):
+    """Run every test_* function of a module, for `python test_x.py`"""
+    tests = [value for name, value in sorted(namespace.items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\n{len(tests) - failed}/{len(tests)} passed")
+    return failed
@@ -1,5 +1,5 @@
 import os
-from app import create_app, db
+from app import create_app, db, migrations
 from app.models import User, Model3D
 
 # Debug: Print environment variables
@@ -18,26 +18,17 @@ try:
             # Test if we can connect to the database
             db.session.execute(db.text("SELECT 1"))
             print("Database connection successful")
+            db.session.remove()  # migrations use their own connection
             
-            # Create tables
-            db.create_all()
-            print("Database tables created successfully")
-            
-            # Verify tables exist
-            result = db.session.execute(db.text("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'"))
-            tables = [row[0] for row in result]
-            print(f"Tables in database: {tables}")
+            # Bring the schema up to date (a no-op when nothing is pending).
+            # Deployments with a release phase run `flask migrate-schema` first.
+            applied = migrations.upgrade()
+            print(f"Applied migrations {applied}" if applied else "Database schema is up to date")
             
         except Exception as db_error:
+            # Never drop or recreate tables here; fix the cause and redeploy
             print(f"Database error: {db_error}")
-            # Try alternative table creation
-            try:
-                db.drop_all()
-                db.create_all()
-                print("Database tables recreated successfully")
-            except Exception as recreate_error:
-                print(f"Failed to recreate tables: {recreate_error}")
-                
+
 except Exception as e:
     print(f"Error creating app: {e}")
     # Create a minimal app for debugging